@@ -1,23 +1,66 @@
 import React from 'react';
 import logo from './logo.svg';
 import './App.css';
+import { usePollGame } from './usePollGame';
+
+function Game({ gameId, token }: { gameId: string; token: string }) {
+  const { state, error } = usePollGame(gameId, token);
+  if (!state) {
+    return <p>{error ?? 'Loading game...'}</p>;
+  }
+  return (
+    <div>
+      <p>
+        {state.winner !== null
+          ? `${state.seats[state.winner].name} won`
+          : state.turn < 0
+          ? 'Waiting for the host to start'
+          : state.turn === state.player_index
+          ? 'Your turn'
+          : `${state.seats[state.turn].name} to move`}
+      </p>
+      <p>
+        Piles: {state.left_card || '-'} ({state.left_count}) / {state.right_card || '-'} ({state.right_count}), {state.center_count} left to draw
+      </p>
+      <p>Your cards: {state.cards.match(/../g)?.join(' ')}</p>
+      <ul>
+        {state.seats.map((seat, i) => (
+          <li key={i}>{seat.name}: {seat.hand} cards</li>
+        ))}
+      </ul>
+      {error && <p>{error}</p>}
+    </div>
+  );
+}
 
 function App() {
+  // Until there is a lobby screen a game is opened with ?game=<key>&token=<token>, using the
+  // token create_game, join_game or match_status returned for that seat
+  const params = new URLSearchParams(window.location.search);
+  const gameId = params.get('game');
+  const token = params.get('token');
+
   return (
     <div className="App">
       <header className="App-header">
-        <img src={logo} className="App-logo" alt="logo" />
-        <p>
-          Edit <code>src/App.tsx</code> and save to reload.
-        </p>
-        <a
-          className="App-link"
-          href="https://reactjs.org"
-          target="_blank"
-          rel="noopener noreferrer"
-        >
-          Learn React
-        </a>
+        {gameId && token ? (
+          <Game gameId={gameId} token={token} />
+        ) : (
+          <>
+            <img src={logo} className="App-logo" alt="logo" />
+            <p>
+              Edit <code>src/App.tsx</code> and save to reload.
+            </p>
+            <a
+              className="App-link"
+              href="https://reactjs.org"
+              target="_blank"
+              rel="noopener noreferrer"
+            >
+              Learn React
+            </a>
+          </>
+        )}
       </header>
     </div>
   );
@@ -0,0 +1,74 @@
+// The game server's JSON endpoints, mounted under /poison
+const API_ROOT = process.env.REACT_APP_API_ROOT ?? '/poison';
+
+export interface Seat {
+  name: string;
+  hand: number;
+}
+
+export interface GameState {
+  key: string;
+  turn: number;
+  version: number;
+  player_key: string;
+  player_index: number;
+  cards: string;
+  left_card: string;
+  right_card: string;
+  left_count: number;
+  right_count: number;
+  center_count: number;
+  seats: Seat[];
+  last_actor: number | null;
+  winner: number | null;
+  // How long the server would like us to wait before polling again
+  poll_after_ms: number;
+  // Signed for this seat; only create_game and join_game send it
+  token?: string;
+}
+
+export interface MatchStatus {
+  ticket: number;
+  matched: boolean;
+  game_id?: string;
+  player_index?: number;
+  token?: string;
+}
+
+export class ApiError extends Error {
+  constructor(public status: number, message: string, public retryAfterMs?: number) {
+    super(message);
+  }
+}
+
+export async function post<T>(endpoint: string, body: object): Promise<T> {
+  const response = await fetch(`${API_ROOT}${endpoint}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  const payload = await response.json().catch(() => ({}));
+  if (!response.ok) {
+    const retryAfter = payload.retry_after ?? Number(response.headers.get('Retry-After'));
+    throw new ApiError(response.status, payload.message ?? response.statusText, retryAfter ? retryAfter * 1000 : undefined);
+  }
+  return payload as T;
+}
+
+// Player tokens come from create_player. Create, join and a finished match hand back a
+// token bound to the game and seat, which is the one to keep for polling and moves
+export function createGame(playerToken: string): Promise<GameState> {
+  return post<GameState>('create_game', { token: playerToken });
+}
+
+export function joinGame(gameId: string, playerToken: string): Promise<GameState> {
+  return post<GameState>('join_game', { token: playerToken, game_id: gameId });
+}
+
+export function matchStatus(playerToken: string): Promise<MatchStatus> {
+  return post<MatchStatus>('match_status', { token: playerToken });
+}
+
+export function pollGame(gameId: string, token: string, minVersion?: number): Promise<GameState> {
+  return post<GameState>('poll_game', { token, game_id: gameId, min_version: minVersion });
+}
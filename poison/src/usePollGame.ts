@@ -0,0 +1,73 @@
+import { useEffect, useState } from 'react';
+import { ApiError, GameState, pollGame } from './api';
+
+const FALLBACK_MS = 1000;
+const MAX_ERROR_MS = 30000;
+
+// Polls a game, waiting as long as each response's poll_after_ms asks. Errors back off
+// exponentially (or for the server's Retry-After), and polling pauses while the page is hidden
+export function usePollGame(gameId: string | null, token: string | null) {
+  const [state, setState] = useState<GameState | null>(null);
+  const [error, setError] = useState<string | null>(null);
+
+  useEffect(() => {
+    if (!gameId || !token) {
+      return;
+    }
+    let timer: ReturnType<typeof setTimeout> | undefined;
+    let stopped = false;
+    let busy = false;
+    let failures = 0;
+    let version: number | undefined;
+
+    const schedule = (ms: number) => {
+      if (!stopped) {
+        timer = setTimeout(poll, ms);
+      }
+    };
+
+    const poll = async () => {
+      timer = undefined;
+      if (document.hidden) {
+        return;
+      }
+      busy = true;
+      try {
+        const next = await pollGame(gameId, token, version);
+        if (stopped) {
+          return;
+        }
+        failures = 0;
+        version = next.version;
+        setState(next);
+        setError(null);
+        schedule(next.poll_after_ms ?? FALLBACK_MS);
+      } catch (e) {
+        failures += 1;
+        setError(e instanceof Error ? e.message : String(e));
+        const backoff = Math.min(MAX_ERROR_MS, FALLBACK_MS * 2 ** failures);
+        schedule(e instanceof ApiError && e.retryAfterMs ? e.retryAfterMs : backoff);
+      } finally {
+        busy = false;
+      }
+    };
+
+    const onVisible = () => {
+      if (!document.hidden && timer === undefined && !busy) {
+        poll();
+      }
+    };
+
+    document.addEventListener('visibilitychange', onVisible);
+    poll();
+    return () => {
+      stopped = true;
+      if (timer !== undefined) {
+        clearTimeout(timer);
+      }
+      document.removeEventListener('visibilitychange', onVisible);
+    };
+  }, [gameId, token]);
+
+  return { state, error };
+}
@@ -0,0 +1,50 @@
+from typing import List, Tuple
+import json
+
+from .models import Game, GameAction
+
+# The public log of a game: what each seat did and what it did to everyone's hands, but never which
+# cards were drawn. Clients catch up from the last index they saw instead of refetching the game
+
+MAX_PAGE = 100
+
+
+def hands(game):
+    # type: (Game) -> List[int]
+    return [s['hand'] for s in game.seats]
+
+
+def effect(game, before):
+    # type: (Game, List[int]) -> dict
+    """The public effect of a change to game, given the hand sizes from before it"""
+
+    changed = {str(i): n - before[i] for i, n in enumerate(hands(game)) if n != before[i]}
+    return {'hands': changed, 'turn': game.turn}
+
+
+def since(game_id, after=-1, limit=MAX_PAGE):
+    # type: (str, int, int) -> Tuple[List[dict], bool]
+    """Actions after index `after` in order, and whether there are more"""
+
+    limit = max(1, min(limit, MAX_PAGE))
+    rows = list(
+        GameAction.objects.filter(game_id=game_id, index__gt=after).order_by('index')
+        .values_list('index', 'action', 'player__index', 'data', 'effect', 'created')[:limit + 1]
+    )
+    entries = []
+    for index, action, seat, data, effect, created in rows[:limit]:
+        entry = {'index': index, 'action': GameAction.Type(action).name, 'seat': seat, 'created': created}
+        if action == GameAction.Type.CardPlayed:
+            params = json.loads(data)
+            entry['card'] = params.get('card')
+            entry['side'] = params.get('side')
+        elif action == GameAction.Type.CardDrawn:
+            params = json.loads(data)
+            if params.get('timeout'):
+                entry['timeout'] = True
+            if params.get('drew') is False:
+                # The turn passed with nothing left to draw
+                entry['drew'] = False
+        entry.update(effect)
+        entries.append(entry)
+    return entries, len(rows) > limit
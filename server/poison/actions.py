@@ -4,6 +4,7 @@ from random import shuffle
 import json
 
 from .models import CardType, Game, GameAction, GamePlayer, Card
+from . import metrics
 from .exceptions import (
     InvalidCardPlayException,
     MissingCardException,
@@ -33,20 +34,20 @@ CARD_TO_INT = {
 
 def _draw_cards(game, player, n):
     # type: (Game, GamePlayer, int) -> None
-    deck = Card.get_deck(game.center_deck)
-    if len(deck) <= n:
+    if game.center_count <= n:
         right = Card.get_deck(game.right_deck)
         left = Card.get_deck(game.left_deck)
         new_cards = [*left[1:], *right[1:]]
         shuffle(new_cards)
-        deck.extend(new_cards)
-        if len(deck) < n:
+        if game.center_count + len(new_cards) < n:
             raise OutOfCardsException()
+        metrics.reshuffles.inc()
+        game.center_deck = game.center_deck + Card.encode_deck(new_cards)
         game.left_deck = Card.encode_deck([left[0]])
         game.right_deck = Card.encode_deck([right[0]])
 
-    player.cards += Card.encode_deck(deck[0:n])
-    game.center_deck = Card.encode_deck(deck[n:])
+    player.cards += game.take_center(n)
+    game.sync_hand(player)
 
 
 def _card_index(deck, card):
@@ -72,16 +73,8 @@ def _is_adjacent(c1, c2):
     return False
 
 
-def play_card(game, player, card, is_right):
-    # type: (Game, GamePlayer, Card, bool) -> None
-    pile = Card.get_deck(game.right_deck if is_right else game.left_deck)
-    top = pile[0]
-    hand = Card.get_deck(player.cards)
-    
-    index = _card_index(hand, card)
-    if index < 0:
-        raise MissingCardException()
-
+def _check_play(top, card):
+    # type: (Card, Card) -> None
     if top.type == CardType.Joker:
         if not card.is_face():
             raise InvalidCardPlayException()
@@ -97,12 +90,26 @@ def play_card(game, player, card, is_right):
         else:
             raise InvalidCardPlayException()
 
+
+def play_card(game, player, card, is_right):
+    # type: (Game, GamePlayer, Card, bool) -> None
+    pile = Card.get_deck(game.right_deck if is_right else game.left_deck)
+    top = pile[0]
+    hand = Card.get_deck(player.cards)
+    
+    index = _card_index(hand, card)
+    if index < 0:
+        raise MissingCardException()
+
+    _check_play(top, card)
+
     if is_right:
         game.right_deck = Card.encode_deck([card, *pile])
     else:
         game.left_deck = Card.encode_deck([card, *pile])
     hand.pop(index)
     player.cards = Card.encode_deck(hand)
+    game.sync_hand(player)
 
     players = GamePlayer.objects.filter(game__pk=game.key) # type: Iterable[GamePlayer]
     ni = (game.turn + 1) % len(players)
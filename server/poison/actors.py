@@ -0,0 +1,104 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+from weakref import WeakKeyDictionary
+import asyncio
+
+from django.conf import settings
+
+from .exceptions import GameBusyException
+
+# A game actor is one asyncio task per live game that runs that game's commands strictly in order.
+# Concurrent actions on one game queue up in memory instead of racing on Game/GamePlayer rows, and
+# when all of a game's writes go through its actor (actor mode plus sharding) they never wait on
+# each other's database locks. A full queue rejects new commands, which pushes back on clients
+
+T = TypeVar('T')
+
+
+class GameActor:
+    def __init__(self, key, registry, queue_size, idle_seconds):
+        # type: (str, ActorRegistry, int, float) -> None
+        self.key = key
+        self.registry = registry
+        self.idle_seconds = idle_seconds
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def submit(self, command, *args):
+        # type: (Callable[..., Awaitable[T]], *Any) -> asyncio.Future
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((command, args, future))
+        except asyncio.QueueFull:
+            raise GameBusyException(getattr(settings, 'POISON_ACTOR_RETRY_AFTER', 0.5))
+        return future
+
+    async def _run(self):
+        while True:
+            try:
+                command, args, future = await asyncio.wait_for(self.queue.get(), self.idle_seconds)
+            except asyncio.TimeoutError:
+                # Nothing can be queued between the timeout and leaving the registry since there is
+                # no await in between, so no command is ever stranded
+                if self.queue.empty():
+                    self.registry.retire(self)
+                    return
+                continue
+
+            if future.cancelled():
+                continue
+            try:
+                result = await command(*args)
+            except Exception as e:
+                # Drop this loop's own frame from the traceback handed to the caller. Anything that
+                # clears the caller's traceback frames would otherwise close the actor coroutine
+                if not future.cancelled():
+                    future.set_exception(e.with_traceback(e.__traceback__.tb_next))
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+
+
+class ActorRegistry:
+    def __init__(self, queue_size=32, idle_seconds=30.0):
+        # type: (int, float) -> None
+        self.queue_size = queue_size
+        self.idle_seconds = idle_seconds
+        self.actors = {} # type: Dict[str, GameActor]
+
+    def get(self, key):
+        # type: (str) -> GameActor
+        actor = self.actors.get(key)
+        if actor is None:
+            actor = self.actors[key] = GameActor(key, self, self.queue_size, self.idle_seconds)
+        return actor
+
+    def retire(self, actor):
+        # type: (GameActor) -> None
+        if self.actors.get(actor.key) is actor:
+            del self.actors[actor.key]
+
+    async def submit(self, key, command, *args):
+        # type: (str, Callable[..., Awaitable[T]], *Any) -> T
+        return await self.get(key).submit(command, *args)
+
+
+_registries = WeakKeyDictionary() # type: WeakKeyDictionary[asyncio.AbstractEventLoop, ActorRegistry]
+
+
+def registry():
+    # type: () -> ActorRegistry
+    """The actor registry for the running event loop"""
+
+    loop = asyncio.get_running_loop()
+    actors = _registries.get(loop) # type: Optional[ActorRegistry]
+    if actors is None:
+        actors = _registries[loop] = ActorRegistry(
+            getattr(settings, 'POISON_ACTOR_QUEUE_SIZE', 32),
+            getattr(settings, 'POISON_ACTOR_IDLE_SECONDS', 30.0),
+        )
+    return actors
+
+
+def enabled():
+    # type: () -> bool
+    return getattr(settings, 'POISON_GAME_ACTORS', False)
@@ -1,8 +1,111 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.functional import cached_property
 
-from .models import Player, GamePlayer, GameAction, Game
+from .models import Player, GamePlayer, GameAction, Game, MatchTicket, PlayerStats
+from . import dashboard
 
-admin.site.register(Player)
-admin.site.register(GamePlayer)
-admin.site.register(GameAction)
-admin.site.register(Game)
+
+class EstimatedCountPaginator(Paginator):
+    # An unfiltered changelist over a large table shows the planner's row estimate instead of counting
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            estimate = dashboard.estimated_count(self.object_list.model, self.object_list.db)
+            if estimate is not None:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Filtered pages do not count the whole table as well
+    show_full_result_count = False
+
+
+class GameStateFilter(admin.SimpleListFilter):
+    title = 'state'
+    parameter_name = 'state'
+
+    def lookups(self, request, model_admin):
+        return [('lobby', 'Lobby'), ('active', 'Active'), ('finished', 'Finished')]
+
+    def queryset(self, request, queryset):
+        # Lobby and active games are read through the unfinished_games index
+        if self.value() == 'lobby':
+            return queryset.filter(winner=None, turn__lt=0)
+        if self.value() == 'active':
+            return queryset.filter(winner=None, turn__gte=0)
+        if self.value() == 'finished':
+            return queryset.exclude(winner=None)
+        return queryset
+
+
+@admin.register(Game)
+class GameAdmin(LargeTableAdmin):
+    list_display = ('key', 'created', 'turn', 'version', 'open_seats', 'winner')
+    list_filter = (GameStateFilter,)
+    search_fields = ('=key',)
+    ordering = ('-created',)
+    change_list_template = 'admin/poison/game/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('dashboard/', self.admin_site.admin_view(self.dashboard_view), name='poison_dashboard'),
+        ] + super().get_urls()
+
+    def dashboard_view(self, request):
+        context = {
+            **self.admin_site.each_context(request),
+            **dashboard.summary(),
+            'title': 'Live games',
+            'opts': self.model._meta,
+        }
+        return TemplateResponse(request, 'admin/poison/dashboard.html', context)
+
+
+@admin.register(GamePlayer)
+class GamePlayerAdmin(LargeTableAdmin):
+    list_display = ('id', 'game_id', 'index', 'player')
+    list_select_related = ('player',)
+    raw_id_fields = ('game', 'player')
+    search_fields = ('=game__key', '=player__key')
+    ordering = ('-id',)
+
+
+@admin.register(GameAction)
+class GameActionAdmin(LargeTableAdmin):
+    list_display = ('id', 'game_id', 'index', 'action', 'player_name', 'created')
+    list_select_related = ('player__player',)
+    raw_id_fields = ('game', 'player')
+    search_fields = ('=game__key',)
+    ordering = ('-id',)
+
+    @admin.display(description='player')
+    def player_name(self, obj):
+        return obj.player.player.name
+
+
+@admin.register(Player)
+class PlayerAdmin(LargeTableAdmin):
+    list_display = ('key', 'name')
+    search_fields = ('=key',)
+
+
+@admin.register(PlayerStats)
+class PlayerStatsAdmin(LargeTableAdmin):
+    list_display = ('player', 'games_played', 'wins', 'cards_played', 'poison_calls')
+    list_select_related = ('player',)
+    raw_id_fields = ('player',)
+    search_fields = ('=player__key',)
+
+
+@admin.register(MatchTicket)
+class MatchTicketAdmin(LargeTableAdmin):
+    list_display = ('id', 'player', 'created', 'game_id', 'seat', 'matched')
+    list_select_related = ('player',)
+    raw_id_fields = ('player', 'game')
+    ordering = ('-id',)
@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 
 
 class PoisonConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'poison'
+
+    def ready(self):
+        from . import turns
+        request_started.connect(turns.start_on_request)
@@ -0,0 +1,119 @@
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.db import close_old_connections, transaction
+from django.http import HttpRequest, JsonResponse
+
+from .messages import (
+    CreateGameRequest,
+    JoinGameRequest,
+    PerformActionRequest,
+    PollGameRequest
+)
+from .models import Game
+from .ratelimit import admission
+from .views import error_handler, with_token
+from . import actors, game, hotstate, profiling, ratelimit, replicas
+
+# Django's ORM is not async-native, so each view does all of its database work in a single
+# hop onto a worker thread. Leaving the hop thread-insensitive lets requests for different
+# games run in parallel instead of queueing behind the one shared sync thread.
+
+
+def _run_db(f, *args, atomic=False, captured=None):
+    # captured is the request's profiling state when this runs from a game actor's task instead
+    captured = captured or profiling.capture()
+
+    def run():
+        close_old_connections()
+        try:
+            with profiling.hop(captured):
+                if atomic:
+                    with transaction.atomic():
+                        return f(*args)
+                return f(*args)
+        finally:
+            close_old_connections()
+
+    thread_sensitive = getattr(settings, 'POISON_ASYNC_DB_THREAD_SENSITIVE', False)
+    return sync_to_async(run, thread_sensitive=thread_sensitive)()
+
+
+def _create_game(req):
+    # type: (CreateGameRequest) -> dict
+    g = game.create_game(req.player_id)
+    return with_token(Game.encode_game(g, req.player_id))
+
+
+def _join_game(req):
+    # type: (JoinGameRequest) -> dict
+    g = game.join_game(req.game_id, req.player_id)
+    return with_token(Game.encode_game(g, req.player_id))
+
+
+def _poll_game(req):
+    # type: (PollGameRequest) -> dict
+    state = hotstate.read(req.game_id, req.player_id, req.seat, req.min_version)
+    if state is not None:
+        return state
+
+    def load():
+        try:
+            g = Game.objects.get(pk=req.game_id)
+        except Exception:
+            raise BadRequest(f'Bad game id: {req.game_id}')
+        return Game.encode_game(g, req.player_id, req.seat)
+    return replicas.read_state(load, req.min_version)
+
+
+def _perform_action(req):
+    # type: (PerformActionRequest) -> dict
+    g = game.perform_action(req.game_id, req.player_id, req.kind, req.params, req.seat)
+    return Game.encode_game(g, req.player_id, req.seat)
+
+
+@transaction.non_atomic_requests
+@error_handler
+@admission
+async def create_game(request):
+    # type: (HttpRequest) -> JsonResponse
+
+    req = CreateGameRequest(request.body)
+    return JsonResponse(await _run_db(_create_game, req, atomic=True))
+
+
+@transaction.non_atomic_requests
+@error_handler
+@admission
+async def join_game(request):
+    # type: (HttpRequest) -> JsonResponse
+
+    req = JoinGameRequest(request.body)
+    return JsonResponse(await _run_db(_join_game, req, atomic=True))
+
+
+@transaction.non_atomic_requests
+@error_handler
+@admission
+async def poll_game(request):
+    # type: (HttpRequest) -> JsonResponse
+
+    req = PollGameRequest(request.body)
+    ratelimit.consume('poll_game', req.player_id, req.game_id)
+    return JsonResponse(await _run_db(_poll_game, req))
+
+
+@transaction.non_atomic_requests
+@error_handler
+@admission
+async def perform_action(request):
+    # type: (HttpRequest) -> JsonResponse
+
+    req = PerformActionRequest(request.body)
+    ratelimit.consume('perform_action', req.player_id, req.game_id)
+    command = partial(_run_db, _perform_action, req, atomic=True, captured=profiling.capture())
+    if actors.enabled():
+        return JsonResponse(await actors.registry().submit(req.game_id, command))
+    return JsonResponse(await command())
@@ -0,0 +1,295 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from threading import Condition, Lock, Thread
+from time import perf_counter
+from typing import Callable, List, Optional, Set, Tuple
+import json
+import logging
+
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.db import close_old_connections, transaction
+
+from .actions import _check_play
+from .exceptions import (
+    GameAlreadStartedException,
+    GameChangedException,
+    GameFullException,
+    InvalidCardPlayException,
+    NotHostException,
+    NotInGameException,
+    PoisonException
+)
+from .models import CARDS, MAX_SEATS, CardType, Game, GameAction, GamePlayer, Player
+from . import game, metrics
+
+# Computer players. A bot is a Player with bot=True, seated like anyone else (its seat summary says
+# so), and it moves through game.perform_action like anyone else. Every committed change to a game
+# with a bot seat queues the game for the bot pool, POISON_BOT_WORKERS threads that each take a
+# queued game and make one move for one of its bots. That move's own commit queues the game again,
+# and a game is never queued twice or worked on by two threads at once. A move is made only on the
+# version it was picked for: if anyone else moved in the meantime, perform_action refuses it and the
+# commit that got there first queues the game for another look.
+#
+# Picking a move only looks at the bot's hand and the piles. With POISON_BOT_PROCESSES set it runs in
+# a process pool clear of the interpreter lock the request threads need. The pool starts the first
+# time a process wakes a bot, so management commands and a preloading master never fork it. A move
+# not picked within POISON_BOT_BUDGET seconds is a draw. A bot that can neither play nor draw passes
+# its turn, as a timeout would
+
+logger = logging.getLogger('poison.bots')
+
+Move = Tuple[str, Optional[str], Optional[str]]
+
+PLAY = 'play'
+DRAW = 'draw'
+
+
+def poisonable(pile):
+    # type: (str) -> bool
+    """Whether calling poison on the card just played onto pile makes the one who played it draw"""
+
+    top = [CARDS[pile[i:i + 2]] for i in range(0, min(len(pile), 6), 2)]
+    return len(top) < 3 or all(c.is_red() == top[0].is_red() for c in top[1:])
+
+
+def _score(card, pile, hand_size):
+    # type: (CardType, str, int) -> int
+    if hand_size == 1:
+        return 100
+    score = 0
+    if poisonable(pile):
+        score -= 10
+    if card == CardType.Two:
+        score += 3
+    elif card == CardType.Ace:
+        score += 2
+    return score
+
+
+def choose_move(hand, left, right, budget):
+    # type: (str, str, str, float) -> Move
+    """The best legal play for hand onto the left or right pile, a draw when there is none"""
+
+    deadline = perf_counter() + budget
+    best, best_score = (DRAW, None, None), None # type: Move, Optional[int]
+    for i in range(0, len(hand), 2):
+        code = hand[i:i + 2]
+        card = CARDS[code]
+        for side, pile in (('left', left), ('right', right)):
+            try:
+                _check_play(CARDS[pile[:2]], card)
+            except InvalidCardPlayException:
+                continue
+            score = _score(card.type, code + pile, len(hand) // 2)
+            if best_score is None or score > best_score:
+                best, best_score = (PLAY, code, side), score
+        if perf_counter() > deadline:
+            break
+    return best
+
+
+def budget():
+    # type: () -> float
+    return getattr(settings, 'POISON_BOT_BUDGET', 0.05)
+
+
+_processes = None # type: Optional[ProcessPoolExecutor]
+_processes_lock = Lock()
+
+
+def start_processes():
+    # type: () -> Optional[ProcessPoolExecutor]
+    """Starts the POISON_BOT_PROCESSES decision processes, None when moves are picked in the bot threads"""
+
+    global _processes
+    count = getattr(settings, 'POISON_BOT_PROCESSES', 0)
+    if not count:
+        return None
+    with _processes_lock:
+        if _processes is None:
+            _processes = ProcessPoolExecutor(count)
+            # Processes are only started for submitted work, and the first moves should not wait for them
+            for _ in range(count):
+                _processes.submit(choose_move, '', '', '', 0)
+    return _processes
+
+
+def _decide(hand, left, right):
+    # type: (str, str, str) -> Move
+    processes = start_processes()
+    if processes is None:
+        return choose_move(hand, left, right, budget())
+    future = processes.submit(choose_move, hand, left, right, budget())
+    try:
+        # The process works to the same budget, the slack covers handing the work over
+        return future.result(budget() * 2)
+    except TimeoutError:
+        future.cancel()
+        metrics.bot_timeouts.inc()
+        return DRAW, None, None
+
+
+def act(key):
+    # type: (str) -> bool
+    """Makes one move for a bot seated at the game, False when no bot has anything to do"""
+
+    g = Game.objects.get(pk=key)
+    bots = [i for i, s in enumerate(g.seats) if s.get('bot')]
+    if g.turn < 0 or g.winner is not None or not bots:
+        return False
+    seats = {gp.index: gp for gp in GamePlayer.objects.filter(game=g)}
+
+    # Any bot but the one that played can call poison on a play that leaves three of a colour on top
+    last = GameAction.objects.filter(game=g).values_list('action', 'data').first()
+    if last is not None and last[0] == GameAction.Type.CardPlayed and g.last_actor == (g.turn - 1) % len(g.seats):
+        pile = g.right_deck if json.loads(last[1]).get('side') == 'right' else g.left_deck
+        callers = [i for i in bots if i != g.last_actor]
+        if callers and poisonable(pile):
+            _perform(g, seats[callers[0]], GameAction.Type.PoisonCalled, {})
+            return True
+
+    if g.turn not in bots:
+        return False
+    gp = seats[g.turn]
+    left, right = g.left_deck[:6], g.right_deck[:6]
+    start = perf_counter()
+    kind, card, side = _decide(gp.cards, left, right)
+    metrics.bot_decisions.observe(perf_counter() - start)
+    if kind == PLAY:
+        _perform(g, gp, GameAction.Type.CardPlayed, {'card': card, 'side': side})
+    elif _can_draw(g):
+        _perform(g, gp, GameAction.Type.CardDrawn, {})
+    elif any(choose_move(s.cards, left, right, budget())[0] == PLAY for s in seats.values()):
+        game.pass_turn(g.key, g.version)
+    else:
+        # Nobody can play or draw, so passing round the table would only spin. The turn timeout
+        # still applies
+        return False
+    return True
+
+
+def _can_draw(g):
+    # type: (Game) -> bool
+    # Drawing reshuffles everything under the top cards of the piles once the center runs out
+    return g.center_count + max(len(g.left_deck) // 2 - 1, 0) + max(len(g.right_deck) // 2 - 1, 0) > 0
+
+
+def _perform(g, gp, kind, params):
+    # type: (Game, GamePlayer, GameAction.Type, dict) -> None
+    try:
+        game.perform_action(g.key, gp.player_id, kind, params, gp.index, g.version)
+    except GameChangedException:
+        logger.debug('Bot move in %s dropped, the game moved on', g.key)
+        return
+    metrics.bot_rate.mark()
+
+
+class BotPool:
+    def __init__(self, act, workers=2):
+        # type: (Callable[[str], object], int) -> None
+        self.act = act
+        self._queue = [] # type: List[str]
+        self._queued = set() # type: Set[str]
+        self._running = set() # type: Set[str]
+        self._again = set() # type: Set[str]
+        self._cond = Condition()
+        self._closed = False
+        self._threads = [Thread(target=self._run, name=f'poison-bot-{i}', daemon=True) for i in range(workers)]
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+
+    def wake(self, key):
+        # type: (str) -> None
+        with self._cond:
+            if key in self._running:
+                self._again.add(key)
+            elif key not in self._queued:
+                self._queued.add(key)
+                self._queue.append(key)
+                self._cond.notify()
+
+    def pending(self):
+        # type: () -> int
+        with self._cond:
+            return len(self._queue) + len(self._running)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                key = self._queue.pop(0)
+                self._queued.discard(key)
+                self._running.add(key)
+            close_old_connections()
+            try:
+                self.act(key)
+            except PoisonException as e:
+                logger.warning('Bot move in %s refused: %s', key, e.user_message)
+            except Exception:
+                logger.exception('Bot move failed in %s', key)
+            finally:
+                close_old_connections()
+                with self._cond:
+                    self._running.discard(key)
+                    if key in self._again:
+                        self._again.discard(key)
+                        self._queued.add(key)
+                        self._queue.append(key)
+                        self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(1)
+
+
+_pool = None # type: Optional[BotPool]
+_pool_lock = Lock()
+
+
+def pool():
+    # type: () -> BotPool
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = BotPool(act, getattr(settings, 'POISON_BOT_WORKERS', 2))
+                _pool.start()
+    return _pool
+
+
+def wake(key):
+    # type: (str) -> None
+    start_processes()
+    pool().wake(key)
+
+
+def add_bot(game_id, host_id, seat=None):
+    # type: (str, str, int) -> Game
+    """Seats a new bot at a game that has not started, for its host"""
+
+    try:
+        host = game.find_seat(game_id, host_id, seat)
+    except GamePlayer.DoesNotExist:
+        raise NotInGameException()
+    if host.index != 0:
+        raise NotHostException()
+    try:
+        g = Game.objects.get(pk=game_id)
+    except Game.DoesNotExist:
+        raise BadRequest(f'Bad game id: {game_id}')
+    if g.turn >= 0:
+        raise GameAlreadStartedException()
+    if len(g.seats) >= MAX_SEATS:
+        raise GameFullException()
+    # The game may still have started or filled up since, and then the bot's player goes too
+    with transaction.atomic():
+        bot = Player.objects.create(name=f'Bot {len(g.seats)}', bot=True)
+        return game.join_game(game_id, bot.key)
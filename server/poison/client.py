@@ -0,0 +1,162 @@
+"""
+Serving the built React client. collect() copies a `npm run build` output into POISON_CLIENT_DIR:
+every asset gets a copy with a content hash in its name (webpack's own hashed names are kept),
+references in the text assets are rewritten to match, whether absolute under /client/ or relative
+to the file, and gzip (plus brotli when the brotli package is installed) variants are written next
+to each compressible file. Hashed URLs never change content, so they are served with immutable
+cache headers. Files are also kept under their original names for whatever asks for them by name
+(robots.txt, a manifest's icons, old bookmarks), and those are revalidated like index.html
+"""
+
+from hashlib import sha256
+from pathlib import Path
+from typing import Callable, Dict, Optional
+import gzip
+import json
+import mimetypes
+import posixpath
+import re
+import shutil
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+URL_PREFIX = '/client/'
+ENTRY = 'index.html'
+MANIFEST = 'client-manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+HASHED = re.compile(r'\.[0-9a-f]{8,}\.')
+TEXT_SUFFIXES = {'.html', '.css', '.js', '.json', '.map', '.txt'}
+COMPRESSIBLE = TEXT_SUFFIXES | {'.svg', '.ico', '.xml', '.webmanifest'}
+MIN_COMPRESS = 256
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def client_dir():
+    # type: () -> Path
+    return Path(getattr(settings, 'POISON_CLIENT_DIR', settings.BASE_DIR / 'client'))
+
+
+def _fingerprint(path, data):
+    # type: (Path, bytes) -> str
+    if path.name == ENTRY or HASHED.search(path.name):
+        return path.name
+    return f'{path.stem}.{sha256(data).hexdigest()[:12]}{path.suffix}'
+
+
+def _compress(path, data):
+    # type: (Path, bytes) -> None
+    if path.suffix not in COMPRESSIBLE or len(data) < MIN_COMPRESS:
+        return
+    variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            path.with_name(path.name + suffix).write_bytes(compressed)
+
+
+def _rewriter(renamed, base):
+    # type: (Dict[str, str], str) -> Callable[[str], str]
+    """Rewrites references to renamed files in a text file in directory base, absolute or relative to base"""
+
+    refs = {URL_PREFIX + old: URL_PREFIX + new for old, new in renamed.items()}
+    relative = {posixpath.relpath(old, base): posixpath.relpath(new, base) for old, new in renamed.items()}
+    # Relative names are short and common words, so they only count as a whole quoted or url() value
+    pattern = re.compile(
+        '|'.join(re.escape(old) for old in sorted(refs, key=len, reverse=True)) +
+        '|(?<=["\'(=])(\\./)?(' + '|'.join(re.escape(old) for old in sorted(relative, key=len, reverse=True)) +
+        ')(?=["\')?#])'
+    )
+
+    def replace(m):
+        if m.group(2) is None:
+            return refs[m.group(0)]
+        return (m.group(1) or '') + relative[m.group(2)]
+    return lambda text: pattern.sub(replace, text)
+
+
+def collect(build, output):
+    # type: (Path, Path) -> Dict[str, str]
+    """Copies a client build into output and returns the map of original to served names"""
+
+    files = {p.relative_to(build).as_posix(): p.read_bytes() for p in sorted(build.rglob('*')) if p.is_file()}
+    names = {rel: (Path(rel).parent / _fingerprint(Path(rel), data)).as_posix() for rel, data in files.items()}
+    renamed = {old: new for old, new in names.items() if old != new}
+    rewriters = {} # type: Dict[str, Callable[[str], str]]
+
+    if output.exists():
+        shutil.rmtree(output)
+    for rel, data in files.items():
+        base = posixpath.dirname(rel) or '.'
+        if renamed and Path(rel).suffix in TEXT_SUFFIXES:
+            if base not in rewriters:
+                rewriters[base] = _rewriter(renamed, base)
+            data = rewriters[base](data.decode('utf-8')).encode('utf-8')
+        for name in {rel, names[rel]}:
+            target = output / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+            _compress(target, data)
+
+    (output / MANIFEST).write_text(json.dumps(names, indent=2, sort_keys=True))
+    return names
+
+
+def _accepted(request):
+    # type: (HttpRequest) -> set
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        q = params.strip().replace(' ', '')
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def serve(request, path):
+    # type: (HttpRequest, str) -> Optional[HttpResponse]
+    """The response for a collected file, None when the client has not been collected"""
+
+    root = client_dir().resolve()
+    if not root.is_dir():
+        return None
+    target = (root / path).resolve()
+    if root not in target.parents or not target.is_file() or target.name == MANIFEST:
+        raise Http404(path)
+
+    served, encoding = target, None
+    accepted = _accepted(request)
+    for coding, suffix in ENCODINGS:
+        variant = target.with_name(target.name + suffix)
+        if coding in accepted and variant.is_file():
+            served, encoding = variant, coding
+            break
+
+    content_type = mimetypes.guess_type(target.name)[0] or 'application/octet-stream'
+    accel = getattr(settings, 'POISON_CLIENT_ACCEL_REDIRECT', None)
+    if accel:
+        # The front proxy sends the file itself (nginx X-Accel-Redirect to an internal location)
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel.rstrip('/') + '/' + served.relative_to(root).as_posix()
+    else:
+        # FileResponse hands the open file to the server's wsgi.file_wrapper, i.e. sendfile
+        response = FileResponse(served.open('rb'), content_type=content_type)
+        response.headers.pop('Content-Disposition', None)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = IMMUTABLE if HASHED.search(target.name) else 'no-cache'
+    return response
@@ -0,0 +1,90 @@
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple, Type
+
+from django.db import connections, models
+from django.db.models import Count, Max, Q
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+
+from .models import Game, GameAction
+from . import metrics
+
+# Figures for the admin dashboard. Every query here is answered from an index or a partial index over
+# unfinished games, never a scan of the history, and whole-table sizes are the planner's estimate
+# where the database keeps one
+
+
+def estimated_count(model, using='default'):
+    # type: (Type[models.Model], str) -> Optional[int]
+    """An estimate of the rows in model's table, None when there is no cheap one"""
+
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+        # -1 until the table is first analyzed
+        if row is not None and row[0] >= 0:
+            return row[0]
+        return None
+    if isinstance(model._meta.pk, models.AutoField):
+        # The highest id, read from the primary key index, counts deleted rows too
+        return model.objects.using(using).aggregate(n=Max('pk'))['n'] or 0
+    return None
+
+
+def games_by_state():
+    # type: () -> Dict[str, Optional[int]]
+    counts = Game.objects.filter(winner=None).aggregate(
+        lobby=Count('pk', filter=Q(turn__lt=0)),
+        active=Count('pk', filter=Q(turn__gte=0)),
+    )
+    total = estimated_count(Game)
+    if total is None:
+        # No estimate (e.g. SQLite), so count them from the finished_games index
+        counts['finished'] = Game.objects.exclude(winner=None).count()
+    else:
+        counts['finished'] = max(0, total - counts['lobby'] - counts['active'])
+    return counts
+
+
+def actions_per_minute(minutes=10):
+    # type: (int) -> List[Tuple[str, int]]
+    """Actions in each of the last minutes, oldest first"""
+
+    now = timezone.now().replace(second=0, microsecond=0)
+    start = now - timedelta(minutes=minutes - 1)
+    counts = dict(
+        GameAction.objects.filter(created__gte=start).order_by()
+        .annotate(minute=TruncMinute('created')).values('minute').annotate(n=Count('pk')).values_list('minute', 'n')
+    )
+    times = [start + timedelta(minutes=i) for i in range(minutes)]
+    return [(t.strftime('%H:%M'), counts.get(t, 0)) for t in times]
+
+
+def longest_running(limit=10):
+    # type: (int) -> List[Game]
+    return list(
+        Game.objects.filter(winner=None, turn__gte=0).order_by('created')
+        .only('key', 'created', 'version', 'turn', 'seats')[:limit]
+    )
+
+
+def top_errors(limit=10):
+    # type: (int) -> List[Tuple[int, float]]
+    """Error codes returned by this process, most frequent first"""
+
+    counts = [(labels[0], n) for labels, n in metrics.errors.values().items()]
+    return sorted(counts, key=lambda c: -c[1])[:limit]
+
+
+def summary():
+    # type: () -> dict
+    return {
+        'games': games_by_state(),
+        'actions_per_minute': actions_per_minute(),
+        'action_rate': metrics.action_rate.rate() * 60,
+        'longest_running': longest_running(),
+        'top_errors': top_errors(),
+    }
@@ -1,3 +1,5 @@
+from math import ceil
+
 from django.http import JsonResponse
 
 
@@ -72,3 +74,48 @@ class NoPlaysYetException(PoisonException):
 class PoisonAlreadyCalledException(PoisonException):
     def __init__(self):
         super().__init__(11, 'Poison was already called')
+
+
+class RetryLaterException(PoisonException):
+    def __init__(self, code, message, retry_after):
+        # type: (int, str, float) -> None
+        super().__init__(code, message)
+        self.retry_after = retry_after
+
+    def to_response(self):
+        response = JsonResponse({
+            'code': self.code,
+            'message': self.user_message,
+            'retry_after': round(self.retry_after, 3),
+        }, status=429)
+        response['Retry-After'] = str(max(1, ceil(self.retry_after)))
+        return response
+
+
+class RateLimitedException(RetryLaterException):
+    def __init__(self, retry_after):
+        # type: (float) -> None
+        super().__init__(12, 'Too many requests', retry_after)
+
+
+class OverloadedException(RetryLaterException):
+    def __init__(self, retry_after):
+        # type: (float) -> None
+        super().__init__(13, 'Server is busy', retry_after)
+
+
+class InvalidTokenException(PoisonException):
+    def __init__(self):
+        super().__init__(14, 'Missing or invalid player token')
+
+
+class GameBusyException(RetryLaterException):
+    def __init__(self, retry_after):
+        # type: (float) -> None
+        super().__init__(15, 'Too many pending actions for this game', retry_after)
+
+
+class GameChangedException(RetryLaterException):
+    def __init__(self, retry_after):
+        # type: (float) -> None
+        super().__init__(16, 'The game changed while moving, try again', retry_after)
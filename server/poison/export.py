@@ -0,0 +1,122 @@
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+import csv
+import io
+import json
+import zlib
+
+from django.core.exceptions import BadRequest
+from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+from .models import Game, GameAction
+
+# History export. Rows are read in primary key chunks (WHERE id > last ORDER BY id LIMIT n), which
+# sidesteps GameAction's default ordering, holds one chunk in memory at a time and never pages with
+# OFFSET. Encoders and the gzip stage are generators too, so the whole pipeline streams
+
+FIELDS = {
+    'games': ['key', 'created', 'turn', 'version', 'winner', 'open_seats', 'seats'],
+    'actions': ['id', 'game_id', 'index', 'action', 'seat', 'player_key', 'data', 'created'],
+}
+FORMATS = ('ndjson', 'csv')
+
+
+def check(kind, fmt):
+    # type: (str, str) -> None
+    if kind not in FIELDS:
+        raise BadRequest(f'Unknown export: {kind}')
+    if fmt not in FORMATS:
+        raise BadRequest(f'Unknown format: {fmt}')
+
+
+def parse_time(value):
+    # type: (Optional[str]) -> Optional[datetime]
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise BadRequest(f'Bad time: {value}')
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, timezone.utc)
+
+
+def _games(since, until, game_ids):
+    qs = Game.objects.values('key', 'created', 'turn', 'version', 'winner', 'open_seats', 'seats')
+    if since is not None:
+        qs = qs.filter(created__gte=since)
+    if until is not None:
+        qs = qs.filter(created__lt=until)
+    if game_ids:
+        qs = qs.filter(key__in=game_ids)
+    return qs, 'key'
+
+
+def _actions(since, until, game_ids):
+    qs = GameAction.objects.values(
+        'id', 'game_id', 'index', 'action', 'data', 'created', seat=F('player__index'), player_key=F('player__player_id')
+    )
+    if since is not None:
+        qs = qs.filter(created__gte=since)
+    if until is not None:
+        qs = qs.filter(created__lt=until)
+    if game_ids:
+        qs = qs.filter(game_id__in=game_ids)
+    return qs, 'id'
+
+
+def rows(kind, since=None, until=None, game_ids=None, chunk_size=2000):
+    # type: (str, Optional[datetime], Optional[datetime], Optional[List[str]], int) -> Iterator[dict]
+    qs, pk = (_games if kind == 'games' else _actions)(since, until, game_ids)
+
+    last = None
+    while True:
+        page = qs.order_by(pk)
+        if last is not None:
+            page = page.filter(**{f'{pk}__gt': last})
+        chunk = list(page[:chunk_size])
+        for row in chunk:
+            if kind == 'actions':
+                row['action'] = GameAction.Type(row['action']).name
+            yield row
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1][pk]
+
+
+def encode(kind, fmt, source):
+    # type: (str, str, Iterable[dict]) -> Iterator[bytes]
+    check(kind, fmt)
+    if fmt == 'ndjson':
+        for row in source:
+            yield (json.dumps(row, cls=DjangoJSONEncoder) + '\n').encode('utf-8')
+    elif fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, FIELDS[kind])
+        writer.writeheader()
+        for row in source:
+            if 'seats' in row:
+                row['seats'] = json.dumps(row['seats'])
+            writer.writerow(row)
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzipped(chunks, flush_bytes=64 * 1024):
+    # type: (Iterable[bytes], int) -> Iterator[bytes]
+    """Gzip a byte stream, emitting output roughly every flush_bytes of input"""
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    pending = 0
+    for data in chunks:
+        out = compressor.compress(data)
+        pending += len(data)
+        if pending >= flush_bytes:
+            out += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield compressor.flush()
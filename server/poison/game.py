@@ -1,19 +1,34 @@
-from typing import List, Iterable
+from datetime import timedelta
+from typing import List, Iterable, Optional
 from random import shuffle
 import json
 
 from django.core.exceptions import BadRequest
+from django.db import transaction
+from django.utils import timezone
 
-from .models import Card, CardSuit, CardType, Game, GamePlayer, Player, GameAction
+from .models import MAX_SEATS, Card, CardSuit, CardType, Game, GamePlayer, Player, GameAction
 from .exceptions import (
     BadTurnException,
     GameAlreadStartedException,
     GameFullException,
     NotInGameException,
     NotEnoughPlayersException,
-    NotHostException
+    GameChangedException,
+    NotHostException,
+    OutOfCardsException
 )
 from .actions import play_card, draw_card, call_poison
+from . import actionlog, hotstate, metrics, notify, stats, turns
+from .profiling import span
+
+
+# How many times a move that lost the race to save against another change to its game is tried again
+SAVE_RETRIES = 3
+
+
+class _StaleGame(Exception):
+    pass
 
 
 def make_deck():
@@ -29,30 +44,94 @@ def make_deck():
     return deck
 
 
-def create_game(player_id):
-    # type: (str) -> Game
+def _advance(game):
+    # type: (Game) -> None
+    # Every change bumps the version and restarts the clock on whoever is to move
+    game.version += 1
+    game.changed = timezone.now()
+    timeout = turns.timeout()
+    if timeout and game.turn >= 0 and not game.is_finished:
+        game.turn_deadline = game.changed + timedelta(seconds=timeout)
+    else:
+        game.turn_deadline = None
 
-    try:
-        player = Player.objects.get(pk=player_id)
-    except Player.DoesNotExist:
-        raise BadRequest(f'Bad player id: {player_id}')
+
+def announce(game):
+    # type: (Game) -> None
+    """
+    Tells other workers about the game's new version once it is committed. Call it after saving,
+    since outside a transaction the hooks run straight away
+    """
+
+    key, version, deadline = game.key, game.version, game.turn_deadline
+    has_bots = any(s.get('bot') for s in game.seats)
+
+    def committed():
+        hotstate.publish(key)
+        notify.publish(key, version)
+        if deadline is not None:
+            turns.schedule(key, version, deadline.timestamp())
+        if has_bots:
+            # Imported here so processes that never see a bot game never load the bot pool
+            from . import bots
+            bots.wake(key)
+    transaction.on_commit(committed)
+
+
+def new_game():
+    # type: () -> Game
+    """An unsaved game with a shuffled deck and no seats"""
 
     deck = make_deck()
     shuffle(deck)
-    game = Game(
+    return Game(
         center_deck=Card.encode_deck(deck[2:]),
         left_deck=Card.encode_deck(deck[0:1]),
         right_deck=Card.encode_deck(deck[1:2]),
         turn=-1,
     )
-    game.save()
 
+
+def deal(game, gps):
+    # type: (Game, List[GamePlayer]) -> None
+    """Starts the game, dealing seven cards to every seat without saving or announcing anything"""
+
+    game.turn = 0
+    game.open_seats = 0
+    # Deal one card at a time round the table, taking all of them from the deck in one go
+    dealt = game.take_center(7 * len(gps))
+    codes = [dealt[i:i+2] for i in range(0, len(dealt), 2)]
+    for p in gps:
+        p.cards += ''.join(codes[p.index::len(gps)])
+        game.sync_hand(p)
+    _advance(game)
+
+
+def create_game(player_id):
+    # type: (str) -> Game
+
+    try:
+        player = Player.objects.get(pk=player_id)
+    except Player.DoesNotExist:
+        raise BadRequest(f'Bad player id: {player_id}')
+
+    game = new_game()
     gp = GamePlayer(index=0, game=game, player=player)
+    game.add_seat(gp)
+    game.save()
     gp.save()
 
     return game
 
 
+def find_seat(game_id, player_id, seat=None):
+    # type: (str, str, int) -> GamePlayer
+    # Seats from verified tokens are trusted, which avoids joining through Player
+    if seat is None:
+        return GamePlayer.objects.get(game__pk=game_id, player__pk=player_id)
+    return GamePlayer.objects.get(game__pk=game_id, index=seat)
+
+
 def join_game(game_id, player_id):
     # type: (str, str) -> Game
 
@@ -68,23 +147,34 @@ def join_game(game_id, player_id):
         raise GameAlreadStartedException()
 
     gps = GamePlayer.objects.filter(game__pk=game_id)
-    if len(gps) >= 6:
+    if len(gps) >= MAX_SEATS:
         raise GameFullException()
     for gp in gps:
-        if gp.player.key == player_id:
+        if gp.player_id == player_id:
             return g
     
-    gp = GamePlayer(index=len(gps), game=g, player=player)
-    gp.save()
+    # Only lands if nobody joined or started the game since it was read
+    version = g.version
+    with transaction.atomic():
+        gp = GamePlayer(index=len(gps), game=g, player=player)
+        gp.save()
+        g.add_seat(gp)
+        _advance(g)
+        if not g.save_if_version(version):
+            raise GameChangedException(0.1)
+    announce(g)
     return g
 
 
-def start_game(game_id, player_id):
-    # type: (str, str) -> Game
+def start_game(game_id, player_id, seat=None):
+    # type: (str, str, int) -> Game
+
+    if seat is not None and seat != 0:
+        raise NotHostException()
 
     try:
         g = Game.objects.get(pk=game_id) # type: Game
-        player = GamePlayer.objects.get(game__pk=game_id, player__pk=player_id)
+        player = find_seat(game_id, player_id, seat)
         if player.index != 0:
             raise NotHostException()
     except Game.DoesNotExist:
@@ -99,43 +189,63 @@ def start_game(game_id, player_id):
     if len(gps) < 2:
         raise NotEnoughPlayersException()
     
-    g.turn = 0
-    deck = Card.get_deck(g.center_deck)
-    for _ in range(0, 7):
+    version = g.version
+    with transaction.atomic():
+        deal(g, list(gps))
+        if not g.save_if_version(version):
+            raise GameChangedException(0.1)
         for p in gps:
-            card = deck.pop(0)
-            p.cards += Card.encode_deck([card])
-    g.center_deck = Card.encode_deck(deck)
-
-    for p in gps:
-        p.save()
-    g.save()
+            p.save()
+        stats.add([p.player_id for p in gps], games_played=1)
+    announce(g)
 
     return g
 
 
-def perform_action(game_id, player_id, kind, params):
-    # type: (str, str, GameAction.Type, dict) -> Game
+def perform_action(game_id, player_id, kind, params, seat=None, version=None):
+    # type: (str, str, GameAction.Type, dict, int, Optional[int]) -> Game
+    # The game is read, changed and saved in one transaction, and the save only lands if nobody else
+    # saved the game in between. A move that lost that race is checked again against the new state,
+    # unless it was decided on a given version, which is then refused once the game has moved on
+    for _ in range(SAVE_RETRIES):
+        try:
+            with transaction.atomic():
+                g = _perform_action(game_id, player_id, kind, params, seat, version)
+        except _StaleGame:
+            continue
+        metrics.actions.inc(kind.name)
+        metrics.action_rate.mark()
+        return g
+    raise GameChangedException(0.1)
+
+
+def _perform_action(game_id, player_id, kind, params, seat, expected):
+    # type: (str, str, GameAction.Type, dict, Optional[int], Optional[int]) -> Game
     try:
         g = Game.objects.get(pk=game_id) # type: Game
-        p = GamePlayer.objects.get(game__pk=game_id, player__pk=player_id) # type: GamePlayer
+        p = find_seat(game_id, player_id, seat)
     except Game.DoesNotExist:
         raise BadRequest(f'Bad game id: {game_id}')
     except GamePlayer.DoesNotExist:
         raise BadRequest(f'Bad player id: {player_id}')
 
+    if expected is not None and g.version != expected:
+        raise GameChangedException(0.1)
     if g.turn != p.index and kind != GameAction.Type.PoisonCalled:
         raise BadTurnException()
 
+    version = g.version
+    before = actionlog.hands(g)
     try:
-        if kind == GameAction.Type.CardPlayed:
-            card = params['card']
-            is_right = params['side'] == 'right'
-            play_card(g, p, Card(card), is_right)
-        elif kind == GameAction.Type.CardDrawn:
-            draw_card(g, p)
-        elif kind == GameAction.Type.PoisonCalled:
-            call_poison(g, p)
+        with span('rules'):
+            if kind == GameAction.Type.CardPlayed:
+                card = params['card']
+                is_right = params['side'] == 'right'
+                play_card(g, p, Card(card), is_right)
+            elif kind == GameAction.Type.CardDrawn:
+                draw_card(g, p)
+            elif kind == GameAction.Type.PoisonCalled:
+                call_poison(g, p)
     except KeyError as e:
         raise BadRequest(f'Missing required param: {e}')
 
@@ -145,9 +255,89 @@ def perform_action(game_id, player_id, kind, params):
         action=kind,
         game=g,
         player=p,
-        data=json.dumps(params)
+        data=json.dumps(params),
+        effect=actionlog.effect(g, before)
     )
+    stats.record_action(g, p, kind)
 
-    g.save()
+    g.last_actor = p.index
+    _advance(g)
+    if not g.save_if_version(version):
+        raise _StaleGame()
     p.save()
+    announce(g)
+    return g
+
+
+def timeout_turn(game_id, version):
+    # type: (str, int) -> Optional[Game]
+    """
+    Draws a card for the seat that let its turn run out and passes to the next seat. Nothing happens
+    unless the game is still at version when the change is saved
+    """
+
+    g = _pass_turn(game_id, version, True)
+    if g is not None:
+        metrics.turn_timeouts.inc()
+    return g
+
+
+def pass_turn(game_id, version):
+    # type: (str, int) -> Optional[Game]
+    """Passes the turn as a timeout would, for a seat with nothing to play and nothing left to draw"""
+
+    return _pass_turn(game_id, version, False)
+
+
+def _pass_turn(game_id, version, timed_out):
+    # type: (str, int, bool) -> Optional[Game]
+    try:
+        with transaction.atomic():
+            return _timeout_turn(game_id, version, timed_out)
+    except _StaleGame:
+        # Someone moved, or another process already passed this turn
+        return None
+
+
+def _timeout_turn(game_id, version, timed_out):
+    # type: (str, int, bool) -> Optional[Game]
+    try:
+        g = Game.objects.get(pk=game_id, version=version) # type: Game
+    except Game.DoesNotExist:
+        raise _StaleGame()
+    if timed_out:
+        if g.turn_deadline is None or g.turn_deadline > timezone.now():
+            return None
+    elif g.turn < 0 or g.winner is not None:
+        return None
+
+    p = GamePlayer.objects.get(game=g, index=g.turn)
+    before = actionlog.hands(g)
+    try:
+        draw_card(g, p)
+    except OutOfCardsException:
+        drew = False
+    else:
+        drew = True
+
+    g.turn = (g.turn + 1) % len(g.seats)
+    g.last_actor = p.index
+    _advance(g)
+    if not g.save_if_version(version):
+        raise _StaleGame()
+    if drew:
+        p.save()
+    # Logged even when there was nothing to draw, so the action log shows every turn change
+    data = {'timeout': True} if timed_out else {}
+    if not drew:
+        data['drew'] = False
+    GameAction.objects.create(
+        index=GameAction.objects.filter(game=g).count(),
+        action=GameAction.Type.CardDrawn,
+        game=g,
+        player=p,
+        data=json.dumps(data),
+        effect=actionlog.effect(g, before)
+    )
+    announce(g)
     return g
@@ -0,0 +1,248 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Optional
+import fcntl
+import logging
+import struct
+import tempfile
+import zlib
+
+from django.conf import settings
+
+from .models import CARD_CODES, MAX_SEATS, PK_LEN, GamePlayer, unpack_deck
+from . import polling
+
+# Hot game state shared by every worker on a host. POISON_SHARED_STATE names a shared memory block
+# of POISON_SHARED_STATE_SLOTS fixed-size records, one per live game (a game's slot is fixed by a
+# hash of its key, so a game can push out another that hashes to the same slot). The game module
+# rewrites a game's record after every committed change and polls are answered straight from it.
+# The database stays the source of truth. A missing, evicted or older record means the poll reads
+# the database as before. Writes that go around the game module (admin edits, bulk updates) do not
+# reach the record, so a record not rewritten for POISON_SHARED_STATE_MAX_AGE seconds is copied from
+# the database again before it answers a poll.
+#
+# Records are guarded seqlock style: a writer makes the sequence number odd, writes the record, then
+# makes it even again. Readers copy the record and retry if the sequence was odd or changed under
+# them. Writers on different processes take a file lock around that, so there is one writer at a time
+
+logger = logging.getLogger('poison.hotstate')
+
+# One byte per card, and no pile or hand can hold more than the whole deck
+MAX_CARDS = 54
+NAME_BYTES = 64
+RETRIES = 4
+
+SEQ = struct.Struct('<Q')
+# Player key, hand length, hand, name length, name, bot
+SEAT = f'{PK_LEN}sB{MAX_CARDS}sB{NAME_BYTES}s?'
+SEAT_FIELDS = 6
+# Sequence, game key, version, turn, last actor, winner, seats, center count, left and right lengths
+# and piles, time of the last change, time the record was written, then the seats
+RECORD = struct.Struct(f'<Q{PK_LEN}siibbBBBB{MAX_CARDS}s{MAX_CARDS}sdd' + SEAT * MAX_SEATS)
+HEAD_FIELDS = 14
+
+COLUMNS = (
+    'index', 'player_id', 'cards', 'game__version', 'game__turn', 'game__last_actor', 'game__winner',
+    'game__left_deck', 'game__right_deck', 'game__center_pile', 'game__center_offset', 'game__seats',
+    'game__changed',
+)
+
+
+class GameStore:
+    def __init__(self, name, slots):
+        # type: (str, int) -> None
+        from multiprocessing import resource_tracker, shared_memory
+
+        self.slots = slots
+        size = RECORD.size * slots
+        try:
+            self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name)
+            if self._shm.size < size:
+                self._shm.close()
+                raise ValueError(f'Shared memory {name} is smaller than {slots} slots')
+        # Workers come and go, the block has to outlive all of them until unlink()
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._buf = self._shm.buf
+        self._lock_file = open(Path(tempfile.gettempdir()) / f'{name}.lock', 'a')
+        self._lock = Lock()
+
+    def _offset(self, key):
+        # type: (str) -> int
+        return zlib.crc32(key.encode('ascii')) % self.slots * RECORD.size
+
+    def _write(self, key, version, record):
+        # type: (str, int, Optional[bytes]) -> None
+        """Writes record to the key's slot unless the slot holds a later version, None clears it"""
+
+        offset = self._offset(key)
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                seq, stored_key, stored_version = struct.unpack_from(f'<Q{PK_LEN}si', self._buf, offset)
+                if record is not None and stored_key == key.encode('ascii') and stored_version > version:
+                    return
+                SEQ.pack_into(self._buf, offset, seq + 1)
+                if record is None:
+                    self._buf[offset + SEQ.size:offset + RECORD.size] = bytes(RECORD.size - SEQ.size)
+                else:
+                    self._buf[offset + SEQ.size:offset + RECORD.size] = record[SEQ.size:]
+                SEQ.pack_into(self._buf, offset, seq + 2)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _read(self, key):
+        # type: (str) -> Optional[tuple]
+        offset = self._offset(key)
+        for _ in range(RETRIES):
+            seq = SEQ.unpack_from(self._buf, offset)[0]
+            if seq % 2:
+                continue
+            record = bytes(self._buf[offset:offset + RECORD.size])
+            if SEQ.unpack_from(self._buf, offset)[0] != seq:
+                continue
+            fields = RECORD.unpack(record)
+            return fields if fields[1] == key.encode('ascii') else None
+        return None
+
+    def publish(self, key):
+        # type: (str) -> None
+        """Copies the committed game from the database into its slot"""
+
+        rows = list(GamePlayer.objects.filter(game_id=key).order_by('index').values_list(*COLUMNS))
+        if not rows:
+            return
+        _, _, _, version, turn, last_actor, winner, left, right, center, offset, seats, changed = rows[0]
+        seat_fields = []
+        for (_, player_id, cards, *_), seat in zip(rows, seats):
+            name = seat['name'].encode('utf-8')
+            if len(name) > NAME_BYTES:
+                # Does not fit, so polls for this game go to the database
+                self._write(key, version, None)
+                return
+            cards = bytes(cards)
+            seat_fields += [player_id.encode('ascii'), len(cards), cards, len(name), name, seat.get('bot', False)]
+        seat_fields += [b'', 0, b'', 0, b'', False] * (MAX_SEATS - len(rows))
+        left, right = bytes(left), bytes(right)
+        record = RECORD.pack(
+            0, key.encode('ascii'), version, turn, -1 if last_actor is None else last_actor,
+            -1 if winner is None else winner, len(rows), len(bytes(center)) - offset, len(left), len(right),
+            left, right, changed.timestamp(), time(), *seat_fields
+        )
+        self._write(key, version, record)
+
+    def refresh(self, key):
+        # type: (str) -> None
+        try:
+            self.publish(key)
+        except Exception:
+            logger.exception('Could not publish %s', key)
+            self.invalidate(key)
+
+    def invalidate(self, key):
+        # type: (str) -> None
+        self._write(key, 0, None)
+
+    def encode(self, key, player_key, seat=None, max_age=None):
+        # type: (str, str, int, Optional[float]) -> Optional[dict]
+        """The same state Game.encode_game returns, None when the game is not held here"""
+
+        fields = self._read(key)
+        if fields is not None and max_age is not None and time() - fields[HEAD_FIELDS - 1] > max_age:
+            self.refresh(key)
+            fields = self._read(key)
+        if fields is None:
+            return None
+        _, _, version, turn, last_actor, winner, count, center_count, left_len, right_len, left, right, changed, _ = (
+            fields[:HEAD_FIELDS]
+        )
+        seats = [fields[HEAD_FIELDS + i * SEAT_FIELDS:HEAD_FIELDS + (i + 1) * SEAT_FIELDS] for i in range(count)]
+        last_actor = None if last_actor < 0 else last_actor
+        winner = None if winner < 0 else winner
+        if seat is None:
+            seat = next((i for i, s in enumerate(seats) if s[0] == player_key.encode('ascii')), None)
+        if seat is None or not 0 <= seat < count:
+            return None
+
+        left, right = left[:left_len], right[:right_len]
+        return {
+            'key': key,
+            'turn': turn,
+            'version': version,
+            'player_key': player_key,
+            'player_index': seat,
+            'cards': unpack_deck(seats[seat][2][:seats[seat][1]]),
+            'left_card': CARD_CODES[left[0]] if left else '',
+            'right_card': CARD_CODES[right[0]] if right else '',
+            'left_count': float(left_len),
+            'right_count': float(right_len),
+            'center_count': center_count,
+            'seats': [_seat(*s) for s in seats],
+            'last_actor': last_actor,
+            'winner': winner,
+            'poll_after_ms': polling.delay_ms(turn, winner, seat, count, datetime.fromtimestamp(changed, timezone.utc)),
+        }
+
+    def close(self, unlink=False):
+        self._lock_file.close()
+        self._buf = None
+        self._shm.close()
+        if unlink:
+            from multiprocessing import resource_tracker
+
+            # unlink() unregisters the block again
+            resource_tracker.register(self._shm._name, 'shared_memory')
+            self._shm.unlink()
+
+
+def _seat(player_key, hand, cards, name_len, name, bot):
+    # type: (bytes, int, bytes, int, bytes, bool) -> dict
+    seat = {'name': name[:name_len].decode('utf-8'), 'hand': hand}
+    if bot:
+        seat['bot'] = True
+    return seat
+
+
+_store = None # type: Optional[GameStore]
+_store_lock = Lock()
+
+
+def store():
+    # type: () -> Optional[GameStore]
+    global _store
+    name = getattr(settings, 'POISON_SHARED_STATE', None)
+    if name is None:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = GameStore(name, getattr(settings, 'POISON_SHARED_STATE_SLOTS', 4096))
+    return _store
+
+
+def publish(key):
+    # type: (str) -> None
+    s = store()
+    if s is None:
+        return
+    s.refresh(key)
+
+
+def _valid_key(key):
+    # type: (object) -> bool
+    return isinstance(key, str) and key.isascii()
+
+
+def read(key, player_key, seat=None, min_version=None):
+    # type: (str, str, int, Optional[int]) -> Optional[dict]
+    s = store()
+    if s is None or not _valid_key(key) or not _valid_key(player_key):
+        # Malformed ids are left for the database path to reject
+        return None
+    state = s.encode(key, player_key, seat, getattr(settings, 'POISON_SHARED_STATE_MAX_AGE', 10.0))
+    if state is None or (min_version is not None and state['version'] < min_version):
+        return None
+    return state
@@ -0,0 +1,43 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from django.core.exceptions import BadRequest
+from django.db.models import Q
+
+from .models import Game
+
+# Joinable games newest first, paged by keyset: a cursor is the (created, key) of the last game on the
+# previous page, so every page is one range scan of the open_lobby index however deep it goes, and
+# games joining or filling up between requests never shift later pages
+
+MAX_PAGE = 50
+
+
+def encode_cursor(game):
+    # type: (Game) -> str
+    return urlsafe_b64encode(f'{game.created.isoformat()}|{game.key}'.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    # type: (str) -> Tuple[datetime, str]
+    try:
+        created, key = urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(created), key
+    except (ValueError, UnicodeError):
+        raise BadRequest(f'Bad cursor: {cursor}')
+
+
+def open_games(cursor=None, limit=20):
+    # type: (Optional[str], int) -> Tuple[List[Game], Optional[str]]
+    """A page of joinable games and the cursor for the next one, None on the last page"""
+
+    limit = max(1, min(limit, MAX_PAGE))
+    games = Game.objects.filter(open_seats__gt=0).only('key', 'seats', 'open_seats', 'created')
+    if cursor is not None:
+        created, key = decode_cursor(cursor)
+        games = games.filter(Q(created__lt=created) | Q(created=created, key__lt=key))
+    page = list(games.order_by('-created', '-key')[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1])
+    return page, None
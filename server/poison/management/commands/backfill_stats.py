@@ -0,0 +1,54 @@
+import time
+from collections import defaultdict
+from itertools import islice
+from typing import Dict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from poison.models import Game, GameAction, GamePlayer, PlayerStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild player statistics from the full game history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        chunk = options['chunk_size']
+        start = time.perf_counter()
+        totals = defaultdict(lambda: defaultdict(int)) # type: Dict[str, Dict[str, int]]
+        rows = 0
+
+        # Only the columns counted are fetched, in primary key order so no sort is needed. Winners are
+        # looked up for each batch of seats, so memory follows the batch and not the whole history
+        seats = GamePlayer.objects.filter(game__turn__gte=0).order_by('pk').values_list('player_id', 'game_id', 'index')
+        seats = seats.iterator(chunk_size=chunk)
+        while True:
+            batch = list(islice(seats, chunk))
+            if not batch:
+                break
+            games = {game_id for _, game_id, _ in batch}
+            winners = dict(Game.objects.filter(pk__in=games).exclude(winner=None).values_list('key', 'winner'))
+            for player_id, game_id, index in batch:
+                totals[player_id]['games_played'] += 1
+                if winners.get(game_id) == index:
+                    totals[player_id]['wins'] += 1
+            rows += len(batch)
+
+        counted = {GameAction.Type.CardPlayed: 'cards_played', GameAction.Type.PoisonCalled: 'poison_calls'}
+        actions = GameAction.objects.filter(action__in=list(counted)).order_by('pk').values_list('player__player_id', 'action')
+        for player_id, action in actions.iterator(chunk_size=chunk):
+            totals[player_id][counted[action]] += 1
+            rows += 1
+
+        with transaction.atomic():
+            PlayerStats.objects.all().delete()
+            PlayerStats.objects.bulk_create(
+                (PlayerStats(player_id=player_id, **counts) for player_id, counts in totals.items()),
+                batch_size=chunk
+            )
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'Rebuilt stats for {len(totals)} players from {rows} rows in {elapsed:.1f}s')
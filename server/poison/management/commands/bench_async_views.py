@@ -0,0 +1,109 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from threading import local
+from typing import List
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+
+from poison.models import Game, Player
+from poison import game
+
+
+def _check(response):
+    # Only successful polls are comparable
+    if response.status_code != 200:
+        raise CommandError(f'poll_game answered {response.status_code}: {response.content[:200]!r}')
+
+
+class Command(BaseCommand):
+    help = 'Compare poll_game throughput and latency of the sync and async views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=64)
+        parser.add_argument('--games', type=int, default=16)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        n = options['requests']
+        concurrency = options['concurrency']
+
+        players, games = self._make_fixtures(options['games'])
+        bodies = [
+            json.dumps({'player_id': players[i % len(players)], 'game_id': games[i % len(games)]})
+            for i in range(n)
+        ]
+
+        try:
+            # Rate limits and admission control would turn most of the polls into quick 429s
+            with override_settings(POISON_RATE_LIMITS={}, POISON_MAX_IN_FLIGHT=None):
+                self._report('sync', *self._run_sync(reverse('poll_game'), bodies, concurrency))
+                self._report('async', *asyncio.run(
+                    self._run_async(reverse('async_poll_game'), bodies, concurrency)
+                ))
+        finally:
+            Game.objects.filter(pk__in=games).delete()
+            Player.objects.filter(pk__in=players).delete()
+
+    @staticmethod
+    def _make_fixtures(count):
+        players = []
+        games = []
+        for _ in range(count):
+            p1 = Player.objects.create(name='bench')
+            p2 = Player.objects.create(name='bench')
+            g = game.create_game(p1.key)
+            game.join_game(g.key, p2.key)
+            game.start_game(g.key, p1.key)
+            players.append(p1.key)
+            games.append(g.key)
+        return players, games
+
+    @staticmethod
+    def _run_sync(url, bodies, concurrency):
+        clients = local()
+
+        def send(body):
+            if not hasattr(clients, 'client'):
+                clients.client = Client()
+            start = time.perf_counter()
+            response = clients.client.post(url, body, content_type='application/json')
+            elapsed = time.perf_counter() - start
+            _check(response)
+            return elapsed
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(send, bodies))
+        return time.perf_counter() - start, latencies
+
+    @staticmethod
+    async def _run_async(url, bodies, concurrency):
+        client = AsyncClient()
+        gate = asyncio.Semaphore(concurrency)
+
+        async def send(body):
+            async with gate:
+                start = time.perf_counter()
+                response = await client.post(url, body, content_type='application/json')
+                elapsed = time.perf_counter() - start
+                _check(response)
+                return elapsed
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*[send(b) for b in bodies])
+        return time.perf_counter() - start, latencies
+
+    def _report(self, label, elapsed, latencies):
+        # type: (str, float, List[float]) -> None
+        cuts = quantiles(latencies, n=100)
+        self.stdout.write(
+            f'{label:>5}: {len(latencies) / elapsed:8.1f} req/s  '
+            f'p50 {cuts[49] * 1000:7.2f}ms  p99 {cuts[98] * 1000:7.2f}ms'
+        )
@@ -0,0 +1,46 @@
+import time
+from random import Random
+
+from django.core.management.base import BaseCommand
+
+from poison.models import CARD_CODES, Card, pack_deck, unpack_deck
+
+
+class Command(BaseCommand):
+    help = 'Compare row size and parse/encode cost of text and packed deck storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--decks', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = Random(options['seed'])
+        # Decks of every size a game goes through, from the full center deck down to a short hand
+        decks = []
+        for _ in range(options['decks']):
+            cards = list(CARD_CODES)
+            rng.shuffle(cards)
+            decks.append(''.join(cards[:rng.randint(1, len(cards))]))
+        packed = [pack_deck(d) for d in decks]
+
+        text_bytes = sum(len(d.encode('utf-8')) for d in decks)
+        packed_bytes = sum(len(p) for p in packed)
+        self.stdout.write(f'row bytes: text {text_bytes / len(decks):6.1f}  packed {packed_bytes / len(decks):6.1f}')
+
+        self._report('text', decks, lambda d: [Card(d[i:i+2]) for i in range(0, len(d), 2)], Card.encode_deck)
+        self._report('packed', packed, lambda p: Card.get_deck(unpack_deck(p)),
+                     lambda deck: pack_deck(Card.encode_deck(deck)))
+
+    def _report(self, label, stored, parse, encode):
+        start = time.perf_counter()
+        hydrated = [parse(s) for s in stored]
+        parsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for deck in hydrated:
+            encode(deck)
+        encoded = time.perf_counter() - start
+
+        self.stdout.write(
+            f'{label:>6}: parse {parsed / len(stored) * 1e6:6.2f}us  encode {encoded / len(stored) * 1e6:6.2f}us per deck'
+        )
@@ -0,0 +1,192 @@
+import json
+import random
+import subprocess
+import time
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from poison.actions import _card_index, _check_play, _draw_cards, _is_adjacent
+from poison.exceptions import InvalidCardPlayException
+from poison.models import CARD_CODES, Card, Game, GamePlayer, Player
+from poison import game
+
+# Each benchmark builds its inputs from a seeded Random and returns the operation to time. The
+# operation runs in batches and the best batch counts, as the least disturbed measure of its cost
+
+Bench = Callable[[random.Random], Callable[[], object]]
+
+
+def _decks(rng, count=64):
+    # type: (random.Random, int) -> List[str]
+    decks = []
+    for _ in range(count):
+        codes = list(CARD_CODES)
+        rng.shuffle(codes)
+        decks.append(''.join(codes[:rng.randint(1, len(codes))]))
+    return decks
+
+
+def bench_get_deck(rng):
+    decks = _decks(rng)
+    return lambda: [Card.get_deck(d) for d in decks]
+
+
+def bench_encode_deck(rng):
+    decks = [Card.get_deck(d) for d in _decks(rng)]
+    return lambda: [Card.encode_deck(d) for d in decks]
+
+
+def bench_card_init(rng):
+    codes = [rng.choice(CARD_CODES) for _ in range(256)]
+    return lambda: [Card(c) for c in codes]
+
+
+def bench_is_adjacent(rng):
+    pairs = [(Card(rng.choice(CARD_CODES)), Card(rng.choice(CARD_CODES))) for _ in range(256)]
+    return lambda: [_is_adjacent(a, b) for a, b in pairs]
+
+
+def bench_card_index(rng):
+    hands = [(Card.get_deck(d), Card(rng.choice(CARD_CODES))) for d in _decks(rng)]
+    return lambda: [_card_index(hand, card) for hand, card in hands]
+
+
+def bench_check_play(rng):
+    pairs = [(Card(rng.choice(CARD_CODES)), Card(rng.choice(CARD_CODES))) for _ in range(256)]
+
+    def run():
+        legal = 0
+        for top, card in pairs:
+            try:
+                _check_play(top, card)
+                legal += 1
+            except InvalidCardPlayException:
+                pass
+        return legal
+    return run
+
+
+def _table(rng):
+    # type: (random.Random) -> Tuple[Game, GamePlayer]
+    random.seed(rng.random())
+    g = game.new_game()
+    gp = GamePlayer(index=0, game=g, player=Player(name='bench'))
+    g.add_seat(gp)
+    return g, gp
+
+
+def bench_draw_cards(rng):
+    g, gp = _table(rng)
+    full = g.center_deck
+
+    def run():
+        g.center_deck = full
+        gp.cards = ''
+        for _ in range(40):
+            _draw_cards(g, gp, 1)
+    return run
+
+
+def bench_draw_reshuffle(rng):
+    g, gp = _table(rng)
+    center, left, right = g.center_deck, g.left_deck, g.right_deck
+    discards = center[:40], center[40:80]
+
+    def run():
+        g.center_deck = center[80:84]
+        g.left_deck = left + discards[0]
+        g.right_deck = right + discards[1]
+        gp.cards = ''
+        _draw_cards(g, gp, 3)
+    return run
+
+
+def bench_make_deck(rng):
+    return game.make_deck
+
+
+BENCHMARKS = {
+    'Card.get_deck': bench_get_deck,
+    'Card.encode_deck': bench_encode_deck,
+    'Card.__init__': bench_card_init,
+    'actions._is_adjacent': bench_is_adjacent,
+    'actions._card_index': bench_card_index,
+    'actions._check_play': bench_check_play,
+    'actions._draw_cards': bench_draw_cards,
+    'actions._draw_cards reshuffle': bench_draw_reshuffle,
+    'game.make_deck': bench_make_deck,
+} # type: Dict[str, Bench]
+
+
+def _revision():
+    # type: () -> Optional[str]
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark the rules engine and compare with the previous recorded run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1234)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--min-time', type=float, default=0.2, help='Seconds per timed batch')
+        parser.add_argument('--filter', default='', help='Only benchmarks whose name contains this')
+        parser.add_argument('--history', default=str(settings.BASE_DIR / 'bench-history.jsonl'))
+        parser.add_argument('--no-save', action='store_true')
+        parser.add_argument('--fail-over', type=float, default=None,
+                            help='Fail when any benchmark is this many percent slower than the previous run')
+
+    def handle(self, *args, **options):
+        history = Path(options['history'])
+        previous = self._last_run(history)
+        results = {}
+        regressions = []
+
+        for name, bench in BENCHMARKS.items():
+            if options['filter'] not in name:
+                continue
+            rng = random.Random(f'{options["seed"]}:{name}')
+            random.seed(options['seed'])
+            op = bench(rng)
+            timer = timeit.Timer(op)
+            number, _ = timer.autorange()
+            number = max(1, int(number * options['min_time'] / 0.2))
+            best = min(timer.repeat(options['repeat'], number)) / number
+            results[name] = best * 1e6
+
+            line = f'{name:<32} {results[name]:10.2f}us per call'
+            if name in previous:
+                delta = (results[name] - previous[name]) / previous[name] * 100
+                line += f'  {delta:+6.1f}%'
+                if options['fail_over'] is not None and delta > options['fail_over']:
+                    regressions.append(f'{name} {delta:+.1f}%')
+            self.stdout.write(line)
+
+        if not options['no_save']:
+            with history.open('a') as f:
+                f.write(json.dumps({
+                    'time': time.time(), 'revision': _revision(), 'seed': options['seed'], 'results': results
+                }) + '\n')
+        if regressions:
+            raise CommandError(f'Slower than the previous run: {", ".join(regressions)}')
+
+    @staticmethod
+    def _last_run(history):
+        # type: (Path) -> Dict[str, float]
+        """The most recent recorded result of each benchmark, runs with --filter record only some"""
+
+        latest = {} # type: Dict[str, float]
+        if history.is_file():
+            for line in history.read_text().splitlines():
+                if line.strip():
+                    latest.update(json.loads(line)['results'])
+        return latest
@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from statistics import median
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from poison.models import Game, Player
+from poison import game
+
+# Runs in a fresh interpreter: load the WSGI application, then send it one poll_game request
+PROBE = '''
+import io, json, os, sys, time
+from server.wsgi import application
+loaded = time.time()
+body = os.environ['POISON_BENCH_BODY'].encode('utf-8')
+environ = {
+    'REQUEST_METHOD': 'POST', 'PATH_INFO': os.environ['POISON_BENCH_PATH'], 'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'SERVER_PROTOCOL': 'HTTP/1.1',
+    'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+    'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+    'wsgi.version': (1, 0), 'wsgi.multithread': False, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+}
+statuses = []
+b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+print(json.dumps({'loaded': loaded, 'responded': time.time(), 'status': statuses[0]}))
+'''
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = 'Measure worker cold start: import time and time to the first poll_game response'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--settings-module', default='server.settings_api')
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--budget-ms', type=float, default=1000.0,
+                            help='Fail when the median time to first response is over this')
+        parser.add_argument('--top', type=int, default=10, help='Imports with the most self time to list')
+
+    def handle(self, *args, **options):
+        p1 = Player.objects.create(name='bench')
+        p2 = Player.objects.create(name='bench')
+        g = game.create_game(p1.key)
+        game.join_game(g.key, p2.key)
+        game.start_game(g.key, p1.key)
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': options['settings_module'],
+            # The production profile only answers its real host names
+            'POISON_API_PROFILE': os.environ.get('POISON_API_PROFILE', 'dev'),
+            'POISON_BENCH_PATH': reverse('poll_game'),
+            'POISON_BENCH_BODY': json.dumps({'player_id': p1.key, 'game_id': g.key}),
+        }
+
+        try:
+            imports = self._importtime(env)
+            runs = [self._run(env) for _ in range(options['runs'])]
+        finally:
+            Game.objects.filter(pk=g.key).delete()
+            Player.objects.filter(pk__in=[p1.key, p2.key]).delete()
+
+        total = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+        self.stdout.write(f'{options["settings_module"]}: {len(imports)} modules imported in {total / 1000:.1f}ms')
+        for name, own, cumulative, _ in sorted(imports, key=lambda i: -i[1])[:options['top']]:
+            self.stdout.write(f'  {own / 1000:8.1f}ms self {cumulative / 1000:8.1f}ms total  {name}')
+
+        loaded = median(r[0] for r in runs) * 1000
+        first = median(r[1] for r in runs) * 1000
+        self.stdout.write(f'median of {len(runs)}: application loaded {loaded:.1f}ms, first response {first:.1f}ms')
+        if first > options['budget_ms']:
+            raise CommandError(f'Startup over budget: {first:.1f}ms > {options["budget_ms"]:.1f}ms')
+
+    @staticmethod
+    def _probe(env, *flags):
+        # type: (Dict[str, str], str) -> Tuple[float, subprocess.CompletedProcess]
+        started = time.time()
+        result = subprocess.run(
+            [sys.executable, *flags, '-c', PROBE], env=env, cwd=settings.BASE_DIR, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise CommandError(f'Probe failed:\n{result.stderr}')
+        return started, result
+
+    def _run(self, env):
+        # type: (Dict[str, str]) -> Tuple[float, float]
+        started, result = self._probe(env)
+        probe = json.loads(result.stdout.splitlines()[-1])
+        if not probe['status'].startswith('200'):
+            raise CommandError(f'poll_game answered {probe["status"]}')
+        return probe['loaded'] - started, probe['responded'] - started
+
+    def _importtime(self, env):
+        # type: (Dict[str, str]) -> List[Tuple[str, int, int, int]]
+        """(module, self and cumulative microseconds, nesting depth) for every import in a cold start"""
+
+        _, result = self._probe(env, '-X', 'importtime')
+        imports = []
+        for line in result.stderr.splitlines():
+            match = IMPORT_LINE.match(line)
+            if match:
+                own, cumulative, indent, name = match.groups()
+                imports.append((name, int(own), int(cumulative), (len(indent) - 1) // 2))
+        return imports
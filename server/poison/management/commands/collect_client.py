@@ -0,0 +1,26 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from poison import client
+
+
+class Command(BaseCommand):
+    help = 'Fingerprint and precompress the React client build for serving'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--build', default=str(settings.BASE_DIR.parent / 'poison' / 'build'),
+                            help='The output of npm run build')
+        parser.add_argument('--output', default=None, help='Defaults to POISON_CLIENT_DIR')
+
+    def handle(self, *args, **options):
+        build = Path(options['build'])
+        if not (build / client.ENTRY).is_file():
+            raise CommandError(f'No client build in {build}, run npm run build first')
+        output = Path(options['output']) if options['output'] else client.client_dir()
+
+        names = client.collect(build, output)
+        renamed = sum(1 for old, new in names.items() if old != new)
+        compressed = sum(1 for _ in output.rglob('*.gz')) + sum(1 for _ in output.rglob('*.br'))
+        self.stdout.write(f'Collected {len(names)} files into {output} ({renamed} fingerprinted, {compressed} precompressed)')
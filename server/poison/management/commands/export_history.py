@@ -0,0 +1,50 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from poison import export
+
+
+class Command(BaseCommand):
+    help = 'Export game or action history as gzipped ndjson or csv'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(export.FIELDS))
+        parser.add_argument('--format', choices=export.FORMATS, default='ndjson')
+        parser.add_argument('--since', help='ISO time, inclusive')
+        parser.add_argument('--until', help='ISO time, exclusive')
+        parser.add_argument('--game', action='append', default=[], help='Only this game, may be repeated')
+        parser.add_argument('--output', '-o', help='File to write, stdout when omitted')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        kind = options['kind']
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        rows = export.rows(
+            kind,
+            export.parse_time(options['since']),
+            export.parse_time(options['until']),
+            options['game'],
+            options['chunk_size'],
+        )
+        start = time.perf_counter()
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for data in export.gzipped(export.encode(kind, options['format'], counted(rows))):
+                out.write(data)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
+
+        elapsed = time.perf_counter() - start
+        self.stderr.write(f'Exported {count} {kind} in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} rows/s)')
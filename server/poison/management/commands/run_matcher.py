@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from poison import game, matchmaking
+
+
+class Command(BaseCommand):
+    help = 'Seat queued players at new games, one matchmaking round per interval'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0)
+        parser.add_argument('--limit', type=int, default=1200, help='Most players seated per round')
+        parser.add_argument('--once', action='store_true')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            start = time.perf_counter()
+            games = matchmaking.match(options['limit'])
+            elapsed = time.perf_counter() - start
+            if games:
+                seated = sum(len(g.seats) for g in games)
+                self.stdout.write(f'Started {len(games)} games for {seated} players in {elapsed * 1000:.1f}ms')
+            if options['once']:
+                return
+            # A full round means more are waiting, so go again straight away
+            if not games or seated < options['limit'] - game.MAX_SEATS:
+                time.sleep(max(0.0, options['interval'] - elapsed))
@@ -0,0 +1,47 @@
+import signal
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from poison.sharding import ShardRouter
+
+
+class Command(BaseCommand):
+    help = 'Route poison requests to worker processes by consistent hashing of the game key'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--worker', action='append', default=[], help='Worker base url, may be repeated')
+        parser.add_argument('--spawn', type=int, default=0, help='Start this many local runserver workers')
+        parser.add_argument('--spawn-port', type=int, default=8100, help='Port of the first spawned worker')
+        parser.add_argument(
+            '--secret', default=getattr(settings, 'POISON_SHARD_SECRET', None),
+            help='Bearer token /_shards requires, without one only loopback callers may use it'
+        )
+
+    def handle(self, *args, **options):
+        workers = list(options['worker'])
+        processes = []
+        for i in range(options['spawn']):
+            port = options['spawn_port'] + i
+            processes.append(subprocess.Popen([
+                sys.executable, str(settings.BASE_DIR / 'manage.py'), 'runserver', '--noreload', f'127.0.0.1:{port}'
+            ]))
+            workers.append(f'http://127.0.0.1:{port}')
+
+        router = ShardRouter(workers, options['secret'])
+        server = router.serve(options['host'], options['port'])
+        self.stdout.write(f'Routing {options["host"]}:{options["port"]} to {", ".join(workers) or "no workers"}')
+        self.stdout.write('POST {"workers": [...]} to /_shards to rebalance')
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            for p in processes:
+                p.terminate()
@@ -0,0 +1,39 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from poison import replicas
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database over the stand-in replica, once per interval'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between copies, i.e. the replica lag')
+        parser.add_argument('--once', action='store_true')
+
+    def handle(self, *args, **options):
+        alias = replicas.alias()
+        if alias is None or alias == 'default':
+            raise CommandError('POISON_REPLICA does not name a separate database, try --settings server.settings_replica')
+        primary, replica = (connections[a].settings_dict for a in ('default', alias))
+        if primary['ENGINE'] != replica['ENGINE'] or not primary['ENGINE'].endswith('sqlite3'):
+            raise CommandError('Only SQLite databases can be copied, use real replication for anything else')
+
+        while True:
+            start = time.perf_counter()
+            # The backup API copies a consistent snapshot even while the primary is being written
+            source = sqlite3.connect(str(primary['NAME']))
+            target = sqlite3.connect(str(replica['NAME']))
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            elapsed = time.perf_counter() - start
+            if options['once']:
+                self.stdout.write(f'Copied {primary["NAME"]} to {replica["NAME"]} in {elapsed * 1000:.1f}ms')
+                return
+            time.sleep(max(0.0, options['interval'] - elapsed))
@@ -0,0 +1,120 @@
+from typing import List
+
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from .models import Game, GamePlayer, MatchTicket, Player
+from . import game, metrics, stats
+
+# Players waiting for a table hold a MatchTicket. Each matcher round takes the waiting tickets oldest
+# first and seats them at full tables. The remainder only becomes a smaller table (of at least two)
+# once its oldest player has waited POISON_MATCH_MAX_WAIT seconds, so busy periods fill tables and
+# quiet ones still get games. A round creates and starts all of its games in one transaction, and
+# claims its tickets with one UPDATE that only matches tickets still waiting. When another matcher
+# claimed any of them first, the round is rolled back and its players are left to the next round
+
+
+def enqueue(player_id):
+    # type: (str) -> MatchTicket
+    """The player's waiting ticket, creating one if they are not already queued"""
+
+    ticket = MatchTicket.objects.filter(player_id=player_id, game=None).first()
+    if ticket is not None:
+        return ticket
+    if not Player.objects.filter(pk=player_id).exists():
+        raise BadRequest(f'Bad player id: {player_id}')
+    try:
+        with transaction.atomic():
+            return MatchTicket.objects.create(player_id=player_id)
+    except IntegrityError:
+        # Queued by a concurrent request
+        return MatchTicket.objects.get(player_id=player_id, game=None)
+
+
+def status(player_id):
+    # type: (str) -> MatchTicket
+    ticket = MatchTicket.objects.filter(player_id=player_id).order_by('-id').first()
+    if ticket is None:
+        raise BadRequest(f'Player is not queued: {player_id}')
+    return ticket
+
+
+def _tables(waiting, max_wait, now):
+    # type: (List[MatchTicket], float, object) -> List[List[MatchTicket]]
+    tables = [waiting[i:i + game.MAX_SEATS] for i in range(0, len(waiting), game.MAX_SEATS)]
+    if tables and len(tables[-1]) < game.MAX_SEATS:
+        rest = tables[-1]
+        if len(rest) < 2 or (now - rest[0].created).total_seconds() < max_wait:
+            tables.pop()
+    return tables
+
+
+class _Contended(Exception):
+    pass
+
+
+def _claim(tickets, now):
+    # type: (List[MatchTicket], object) -> bool
+    """Seats the waiting tickets as set on them, False unless every one of them was still waiting"""
+
+    if not tickets:
+        return True
+    claimed = MatchTicket.objects.filter(pk__in=[t.pk for t in tickets], game=None).update(
+        game=Case(*[When(pk=t.pk, then=Value(t.game_id)) for t in tickets], output_field=models.CharField()),
+        seat=Case(*[When(pk=t.pk, then=Value(t.seat)) for t in tickets], output_field=models.IntegerField()),
+        matched=now,
+    )
+    return claimed == len(tickets)
+
+
+def match(limit=1200):
+    # type: (int) -> List[Game]
+    """Runs one matcher round over at most limit waiting players and returns the games it started"""
+
+    try:
+        return _match(limit)
+    except _Contended:
+        metrics.match_conflicts.inc()
+        return []
+
+
+def _match(limit):
+    # type: (int) -> List[Game]
+    max_wait = getattr(settings, 'POISON_MATCH_MAX_WAIT', 5.0)
+    now = timezone.now()
+    with transaction.atomic():
+        waiting = list(MatchTicket.objects.filter(game=None).select_related('player').order_by('created')[:limit])
+        tables = _tables(waiting, max_wait, now)
+
+        games = []
+        gps = []
+        tickets = []
+        for table in tables:
+            g = game.new_game()
+            seats = [GamePlayer(index=i, game=g, player=t.player) for i, t in enumerate(table)]
+            for gp in seats:
+                g.add_seat(gp)
+            game.deal(g, seats)
+            for t, gp in zip(table, seats):
+                t.game = g
+                t.seat = gp.index
+                t.matched = now
+            games.append(g)
+            gps.extend(seats)
+            tickets.extend(table)
+
+        Game.objects.bulk_create(games)
+        GamePlayer.objects.bulk_create(gps)
+        if not _claim(tickets, now):
+            raise _Contended()
+        for g in games:
+            game.announce(g)
+        if tickets:
+            stats.add([t.player_id for t in tickets], games_played=1)
+
+    for t in tickets:
+        metrics.match_wait.observe((now - t.created).total_seconds())
+    return games
@@ -1,14 +1,19 @@
 import json
 
+from django.conf import settings
 from django.core.exceptions import BadRequest
 
+from .exceptions import InvalidTokenException
 from .models import GameAction
+from .profiling import span
+from . import tokens
 
 
 def exception_catcher(f):
     def wrapper(*args):
         try:
-            f(*args)
+            with span('decode'):
+                f(*args)
         except KeyError as e:
             raise BadRequest(f'Missing required field: {e}')
         except json.decoder.JSONDecodeError:
@@ -16,6 +21,27 @@ def exception_catcher(f):
     return wrapper
 
 
+def read_identity(req, parsed, with_game=True):
+    # type: (object, dict, bool) -> None
+    # Signed tokens carry the player, and the seat when they were issued for the requested game
+    req.seat = None
+    if 'token' in parsed:
+        token = tokens.verify(parsed['token'])
+        req.player_id = token.player_id
+        if with_game:
+            req.game_id = parsed['game_id'] if 'game_id' in parsed else token.game_id
+            if req.game_id is None:
+                raise KeyError('game_id')
+            if req.game_id == token.game_id:
+                req.seat = token.seat
+    elif getattr(settings, 'POISON_REQUIRE_TOKENS', False):
+        raise InvalidTokenException()
+    else:
+        req.player_id = parsed['player_id']
+        if with_game:
+            req.game_id = parsed['game_id']
+
+
 class CreatePlayerRequest:
     @exception_catcher
     def __init__(self, blob):
@@ -32,7 +58,7 @@ class CreateGameRequest:
     def __init__(self, blob):
         #type: (str) -> None
         parsed = json.loads(blob)
-        self.player_id = parsed['player_id']
+        read_identity(self, parsed, with_game=False)
 
 
 class JoinGameRequest:
@@ -40,8 +66,7 @@ class JoinGameRequest:
     def __init__(self, blob):
         #type: (str) -> None
         parsed = json.loads(blob)
-        self.player_id = parsed['player_id']
-        self.game_id = parsed['game_id']
+        read_identity(self, parsed)
 
     
 class StartGameRequest:
@@ -49,8 +74,15 @@ class StartGameRequest:
     def __init__(self, blob):
         #type: (str) -> None
         parsed = json.loads(blob)
-        self.player_id = parsed['player_id']
-        self.game_id = parsed['game_id']
+        read_identity(self, parsed)
+
+
+class AddBotRequest:
+    @exception_catcher
+    def __init__(self, blob):
+        #type: (str) -> None
+        parsed = json.loads(blob)
+        read_identity(self, parsed)
 
 
 class PollGameRequest:
@@ -58,8 +90,26 @@ class PollGameRequest:
     def __init__(self, blob):
         #type: (str) -> None
         parsed = json.loads(blob)
-        self.player_id = parsed['player_id']
-        self.game_id = parsed['game_id']
+        read_identity(self, parsed)
+        # The version the client last got back from its own action, which a poll must not go behind
+        self.min_version = parsed.get('min_version')
+        if self.min_version is not None and not isinstance(self.min_version, int):
+            raise BadRequest('min_version must be an integer')
+
+
+class SyncActionsRequest:
+    @exception_catcher
+    def __init__(self, blob):
+        #type: (str) -> None
+        parsed = json.loads(blob)
+        read_identity(self, parsed)
+        # The last action index the client has seen, -1 for the whole log
+        self.after = parsed.get('after', -1)
+        self.limit = parsed.get('limit', 100)
+        if not isinstance(self.after, int):
+            raise BadRequest('after must be an integer')
+        if not isinstance(self.limit, int):
+            raise BadRequest('limit must be an integer')
 
 
 class PerformActionRequest:
@@ -67,10 +117,46 @@ class PerformActionRequest:
     def __init__(self, blob):
         #type: (str) -> None
         parsed = json.loads(blob)
-        self.player_id = parsed['player_id']
-        self.game_id = parsed['game_id']
+        read_identity(self, parsed)
         kind = parsed['type'] # type: int
         if kind not in GameAction.Type:
             raise BadRequest(f'Invalid action type: {kind}')
         self.kind = GameAction.Type(kind)
         self.params = parsed['params']
+
+
+class EnqueueRequest:
+    @exception_catcher
+    def __init__(self, blob):
+        #type: (str) -> None
+        parsed = json.loads(blob)
+        read_identity(self, parsed, with_game=False)
+
+
+class MatchStatusRequest:
+    @exception_catcher
+    def __init__(self, blob):
+        #type: (str) -> None
+        parsed = json.loads(blob)
+        read_identity(self, parsed, with_game=False)
+
+
+class ListGamesRequest:
+    @exception_catcher
+    def __init__(self, blob):
+        #type: (str) -> None
+        parsed = json.loads(blob) if blob else {}
+        self.cursor = parsed.get('cursor')
+        self.limit = parsed.get('limit', 20)
+        if self.cursor is not None and not isinstance(self.cursor, str):
+            raise BadRequest('cursor must be a string')
+        if not isinstance(self.limit, int):
+            raise BadRequest('limit must be an integer')
+
+
+class PlayerStatsRequest:
+    @exception_catcher
+    def __init__(self, blob):
+        #type: (str) -> None
+        parsed = json.loads(blob)
+        read_identity(self, parsed, with_game=False)
@@ -0,0 +1,213 @@
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from django.db.models import Count, Exists, OuterRef, Q
+
+from .models import Game, GamePlayer, MatchTicket
+
+# In-process metrics rendered in the Prometheus text exposition format. Every metric guards its
+# own state with a lock so request threads can update them concurrently. Values are per process
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values, extra=''):
+    # type: (Tuple[str, ...], Tuple, str) -> str
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    # type: (float) -> str
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        # type: (str, str, Tuple[str, ...]) -> None
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values = {} # type: Dict[Tuple, float]
+        self._lock = Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def values(self):
+        # type: () -> Dict[Tuple, float]
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        # type: () -> Iterable[str]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{_labels(self.label_names, labels)} {_number(value)}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        # type: (str, str, Tuple[str, ...], Tuple[float, ...]) -> None
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {} # type: Dict[Tuple, List[float]]
+        self._lock = Lock()
+
+    def observe(self, value, *labels):
+        # type: (float, *str) -> None
+        # Each series is [count per bucket..., sum]; cumulative counts are computed on render
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def samples(self):
+        # type: () -> Iterable[str]
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        for labels, values in series:
+            total = 0
+            for bound, n in zip(self.buckets, values):
+                total += n
+                le = _labels(self.label_names, labels, f'le="{_number(bound)}"')
+                yield f'{self.name}_bucket{le} {total}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {_number(values[-1])}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {total}'
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect, labels=()):
+        # type: (str, str, Callable[[], Dict[Tuple, float]], Tuple[str, ...]) -> None
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._collect = collect
+
+    def samples(self):
+        # type: () -> Iterable[str]
+        for labels, value in self._collect().items():
+            yield f'{self.name}{_labels(self.label_names, labels)} {_number(value)}'
+
+
+class RateWindow:
+    """Events per second averaged over a sliding window of one-second buckets"""
+
+    def __init__(self, seconds=60):
+        # type: (int) -> None
+        self.seconds = seconds
+        self._buckets = [0] * seconds
+        self._stamps = [0] * seconds
+        self._lock = Lock()
+
+    def mark(self, n=1):
+        # type: (int) -> None
+        now = int(monotonic())
+        i = now % self.seconds
+        with self._lock:
+            if self._stamps[i] != now:
+                self._stamps[i] = now
+                self._buckets[i] = 0
+            self._buckets[i] += n
+
+    def rate(self):
+        # type: () -> float
+        now = int(monotonic())
+        with self._lock:
+            total = sum(b for b, s in zip(self._buckets, self._stamps) if now - s < self.seconds)
+        return total / self.seconds
+
+
+def _game_states():
+    # type: () -> Dict[Tuple, float]
+    emptied = GamePlayer.objects.filter(game=OuterRef('pk'), cards='')
+    counts = Game.objects.annotate(emptied=Exists(emptied)).aggregate(
+        lobby=Count('pk', filter=Q(turn__lt=0)),
+        active=Count('pk', filter=Q(turn__gte=0, emptied=False)),
+        finished=Count('pk', filter=Q(turn__gte=0, emptied=True)),
+    )
+    return {(state,): n for state, n in counts.items()}
+
+
+def _match_waiting():
+    # type: () -> Dict[Tuple, float]
+    return {(): MatchTicket.objects.filter(game=None).count()}
+
+
+requests = Histogram('poison_request_seconds', 'Latency of poison views', labels=('view',))
+errors = Counter('poison_errors_total', 'Game errors returned to clients', labels=('code',))
+actions = Counter('poison_actions_total', 'Game actions performed', labels=('type',))
+reshuffles = Counter('poison_reshuffles_total', 'Discard piles shuffled back into the center deck')
+replica_fallbacks = Counter('poison_replica_fallbacks_total', 'Replica reads repeated on the primary because the replica was behind')
+turn_timeouts = Counter('poison_turn_timeouts_total', 'Turns passed automatically after the seat went idle')
+match_wait = Histogram(
+    'poison_match_wait_seconds', 'Time from joining the matchmaking queue to being seated',
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+)
+match_conflicts = Counter('poison_match_conflicts_total', 'Matcher rounds dropped because another matcher seated their players first')
+bot_decisions = Histogram(
+    'poison_bot_decision_seconds', 'Time bots took to pick a move',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+bot_timeouts = Counter('poison_bot_timeouts_total', 'Bot moves not picked within the budget')
+action_rate = RateWindow()
+bot_rate = RateWindow()
+
+
+def _bot_queue():
+    # type: () -> Dict[Tuple, float]
+    from . import bots
+
+    return {(): bots._pool.pending() if bots._pool is not None else 0}
+
+
+REGISTRY = [
+    requests,
+    errors,
+    actions,
+    reshuffles,
+    turn_timeouts,
+    replica_fallbacks,
+    match_wait,
+    match_conflicts,
+    bot_decisions,
+    bot_timeouts,
+    Gauge('poison_match_waiting', 'Players waiting in the matchmaking queue', _match_waiting),
+    Gauge('poison_actions_per_second', 'Game actions per second over the last minute', lambda: {(): action_rate.rate()}),
+    Gauge('poison_bot_actions_per_second', 'Bot moves per second over the last minute', lambda: {(): bot_rate.rate()}),
+    Gauge('poison_bot_queue', 'Games waiting for or being moved by the bot pool', _bot_queue),
+    Gauge('poison_games', 'Games by state, finished once a seat has emptied its hand', _game_states, labels=('state',)),
+]
+
+
+def render():
+    # type: () -> str
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
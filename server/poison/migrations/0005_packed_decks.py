@@ -0,0 +1,128 @@
+from django.db import migrations, models
+import poison.models
+
+GAME_DECKS = ['center_deck', 'left_deck', 'right_deck']
+
+
+def pack_decks(apps, schema_editor):
+    Game = apps.get_model('poison', 'Game')
+    GamePlayer = apps.get_model('poison', 'GamePlayer')
+
+    for g in Game.objects.only('key', *GAME_DECKS).iterator():
+        for name in GAME_DECKS:
+            setattr(g, f'packed_{name}', getattr(g, name))
+        g.save(update_fields=[f'packed_{name}' for name in GAME_DECKS])
+    for gp in GamePlayer.objects.only('id', 'cards').iterator():
+        gp.packed_cards = gp.cards
+        gp.save(update_fields=['packed_cards'])
+
+
+def unpack_decks(apps, schema_editor):
+    Game = apps.get_model('poison', 'Game')
+    GamePlayer = apps.get_model('poison', 'GamePlayer')
+
+    for g in Game.objects.iterator():
+        for name in GAME_DECKS:
+            setattr(g, name, getattr(g, f'packed_{name}'))
+        g.save(update_fields=GAME_DECKS)
+    for gp in GamePlayer.objects.iterator():
+        gp.cards = gp.packed_cards
+        gp.save(update_fields=['cards'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0004_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='packed_center_deck',
+            field=poison.models.DeckField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='packed_left_deck',
+            field=poison.models.DeckField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='packed_right_deck',
+            field=poison.models.DeckField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='gameplayer',
+            name='packed_cards',
+            field=poison.models.DeckField(default=b''),
+        ),
+        migrations.RunPython(pack_decks, unpack_decks),
+        # Defaults only so that unapplying can add the text columns back to existing rows
+        migrations.AlterField(
+            model_name='game',
+            name='center_deck',
+            field=models.TextField(default='', max_length=104),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='left_deck',
+            field=models.TextField(default='', max_length=104),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='right_deck',
+            field=models.TextField(default='', max_length=104),
+        ),
+        migrations.RemoveField(
+            model_name='game',
+            name='center_deck',
+        ),
+        migrations.RemoveField(
+            model_name='game',
+            name='left_deck',
+        ),
+        migrations.RemoveField(
+            model_name='game',
+            name='right_deck',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='cards',
+        ),
+        migrations.RenameField(
+            model_name='game',
+            old_name='packed_center_deck',
+            new_name='center_deck',
+        ),
+        migrations.RenameField(
+            model_name='game',
+            old_name='packed_left_deck',
+            new_name='left_deck',
+        ),
+        migrations.RenameField(
+            model_name='game',
+            old_name='packed_right_deck',
+            new_name='right_deck',
+        ),
+        migrations.RenameField(
+            model_name='gameplayer',
+            old_name='packed_cards',
+            new_name='cards',
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='center_deck',
+            field=poison.models.DeckField(),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='left_deck',
+            field=poison.models.DeckField(),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='right_deck',
+            field=poison.models.DeckField(),
+        ),
+    ]
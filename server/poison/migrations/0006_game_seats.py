@@ -0,0 +1,37 @@
+# Generated by Django 4.0 on 2026-10-19 19:51
+
+from django.db import migrations, models
+
+
+def fill_seats(apps, schema_editor):
+    Game = apps.get_model('poison', 'Game')
+    GamePlayer = apps.get_model('poison', 'GamePlayer')
+    GameAction = apps.get_model('poison', 'GameAction')
+
+    for g in Game.objects.iterator():
+        gps = GamePlayer.objects.filter(game=g).select_related('player').order_by('index')
+        g.seats = [{'name': gp.player.name, 'hand': len(gp.cards) // 2} for gp in gps]
+        last = GameAction.objects.filter(game=g).select_related('player').order_by('-index').first()
+        g.last_actor = last.player.index if last else None
+        g.save(update_fields=['seats', 'last_actor'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0005_packed_decks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='last_actor',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='seats',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(fill_seats, migrations.RunPython.noop),
+    ]
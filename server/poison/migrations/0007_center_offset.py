@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-19 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0006_game_seats'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='game',
+            old_name='center_deck',
+            new_name='center_pile',
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='center_offset',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-19 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0007_center_offset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='turn_deadline',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
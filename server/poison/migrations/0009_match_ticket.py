@@ -0,0 +1,37 @@
+# Generated by Django 4.0 on 2026-10-19 19:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0008_turn_deadline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('seat', models.IntegerField(null=True)),
+                ('matched', models.DateTimeField(null=True)),
+                ('game', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='poison.game')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='poison.player')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='matchticket',
+            index=models.Index(condition=models.Q(('game', None)), fields=['created'], name='waiting_tickets'),
+        ),
+        migrations.AddIndex(
+            model_name='matchticket',
+            index=models.Index(fields=['player', '-id'], name='poison_matc_player__ac3122_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='matchticket',
+            constraint=models.UniqueConstraint(condition=models.Q(('game', None)), fields=('player',), name='one_waiting_ticket'),
+        ),
+    ]
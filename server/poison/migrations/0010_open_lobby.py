@@ -0,0 +1,40 @@
+# Generated by Django 4.0 on 2026-10-19 19:57
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def count_open_seats(apps, schema_editor):
+    Game = apps.get_model('poison', 'Game')
+    GamePlayer = apps.get_model('poison', 'GamePlayer')
+
+    Game.objects.filter(turn__gte=0).update(open_seats=0)
+    seated = models.Subquery(
+        GamePlayer.objects.filter(game=models.OuterRef('pk')).values('game').annotate(n=models.Count('pk')).values('n')
+    )
+    Game.objects.filter(turn__lt=0).update(open_seats=6 - seated)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0009_match_ticket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='open_seats',
+            field=models.IntegerField(default=6),
+        ),
+        migrations.RunPython(count_open_seats, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('open_seats__gt', 0)), fields=['-created', '-key'], name='open_lobby'),
+        ),
+    ]
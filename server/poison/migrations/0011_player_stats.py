@@ -0,0 +1,45 @@
+# Generated by Django 4.0 on 2026-10-19 19:58
+
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+
+def fill_winners(apps, schema_editor):
+    Game = apps.get_model('poison', 'Game')
+    GamePlayer = apps.get_model('poison', 'GamePlayer')
+
+    # The winner emptied their hand first, so of the seats with an empty hand it is the one whose
+    # last action comes earliest in the game's action log
+    emptied = (
+        GamePlayer.objects.filter(game__turn__gte=0, cards=b'')
+        .annotate(last_action=Max('gameaction__index')).order_by('game', 'last_action', 'index')
+    )
+    for game_id, index in emptied.values_list('game', 'index').iterator():
+        Game.objects.filter(pk=game_id, winner=None).update(winner=index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0010_open_lobby'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='poison.player')),
+                ('games_played', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('cards_played', models.IntegerField(default=0)),
+                ('poison_calls', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='winner',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(fill_winners, migrations.RunPython.noop),
+    ]
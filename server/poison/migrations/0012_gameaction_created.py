@@ -0,0 +1,19 @@
+# Generated by Django 4.0 on 2026-10-19 19:59
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0011_player_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameaction',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0 on 2026-10-19 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0012_gameaction_created'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('winner', None)), fields=['created'], name='unfinished_games'),
+        ),
+        migrations.AddIndex(
+            model_name='gameaction',
+            index=models.Index(fields=['created'], name='poison_game_created_3dba97_idx'),
+        ),
+    ]
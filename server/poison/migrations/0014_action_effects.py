@@ -0,0 +1,22 @@
+# Generated by Django 4.0 on 2026-10-19 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0013_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameaction',
+            name='effect',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddIndex(
+            model_name='gameaction',
+            index=models.Index(fields=['game', 'index'], name='poison_game_game_id_2dad7d_idx'),
+        ),
+    ]
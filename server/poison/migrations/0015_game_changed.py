@@ -0,0 +1,19 @@
+# Generated by Django 4.0 on 2026-10-19 20:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0014_action_effects'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='changed',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
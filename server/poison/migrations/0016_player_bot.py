@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-19 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0015_game_changed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='bot',
+            field=models.BooleanField(default=False),
+        ),
+    ]
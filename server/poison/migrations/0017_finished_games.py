@@ -0,0 +1,17 @@
+# Generated by Django 4.0 on 2026-10-19 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poison', '0016_player_bot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('winner', None), _negated=True), fields=['winner'], name='finished_games'),
+        ),
+    ]
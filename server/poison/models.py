@@ -1,13 +1,19 @@
 from enum import Enum
-from typing import List
+from typing import List, Optional
 from base64 import b32encode
 from hashlib import sha1
 from random import random
 
 from django.db import models
+from django.utils import timezone
+from django.db.models.query_utils import DeferredAttribute
 from django.core.exceptions import BadRequest, FieldError
 
+from .profiling import span
+from . import polling
+
 PK_LEN = 16
+MAX_SEATS = 6
 
 
 def gen_key():
@@ -18,6 +24,8 @@ def gen_key():
 class Player(models.Model):
     key = models.CharField(max_length=PK_LEN, primary_key=True, default=gen_key)
     name = models.TextField(max_length=64)
+    # Computer players, moved by the bot pool
+    bot  = models.BooleanField(default=False)
 
 
 class CardType(Enum):
@@ -79,7 +87,10 @@ class Card:
             raise FieldError(f'Bad length card array: {cards}')
         
         split = [cards[i:i+2] for i in range(0, len(cards), 2)]
-        return [Card(s) for s in split]
+        try:
+            return [CARDS[s] for s in split]
+        except KeyError:
+            return [Card(s) for s in split]
 
     @staticmethod
     def encode_deck(deck):
@@ -87,22 +98,188 @@ class Card:
         return ''.join([str(c) for c in deck])
 
 
+# Cards are immutable once built, so decks are hydrated from one shared instance per code
+CARD_CODES = tuple(f'{t.value}{s.value}' for t in CardType for s in CardSuit)
+CARDS = {code: Card(code) for code in CARD_CODES}
+CODE_TO_BYTE = {code: i for i, code in enumerate(CARD_CODES)}
+
+
+def pack_deck(cards):
+    # type: (str) -> bytes
+    try:
+        return bytes([CODE_TO_BYTE[cards[i:i+2]] for i in range(0, len(cards), 2)])
+    except KeyError:
+        raise FieldError(f'Bad card array: {cards}')
+
+
+def unpack_deck(packed):
+    # type: (bytes) -> str
+    return ''.join([CARD_CODES[b] for b in packed])
+
+
+class _LazyDeck(DeferredAttribute):
+    # Holds the packed bytes as loaded and only unpacks them the first time the deck is read
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, (bytes, memoryview)):
+            value = instance.__dict__[self.field.attname] = unpack_deck(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class DeckField(models.BinaryField):
+    """A deck of 2-character card codes stored as one byte per card"""
+
+    descriptor_class = _LazyDeck
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if isinstance(value, str):
+            return pack_deck(value)
+        return value
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return unpack_deck(value)
+        return value
+
+    def value_to_string(self, obj):
+        return self.to_python(self.value_from_object(obj))
+
+
 class Game(models.Model):
     key         = models.CharField(max_length=PK_LEN, primary_key=True, default=gen_key)
-    center_deck = models.TextField(max_length=104)
-    left_deck   = models.TextField(max_length=104)
-    right_deck  = models.TextField(max_length=104)
+    # The center deck is center_pile from center_offset on, so draws only move the offset
+    center_pile   = DeckField()
+    center_offset = models.IntegerField(default=0)
+    left_deck   = DeckField()
+    right_deck  = DeckField()
     turn        = models.IntegerField()
+    version     = models.IntegerField(default=0)
+    # Public per-seat summary ({'name', 'hand'} in seat order, with 'bot' on bot seats) so opponents
+    # render from this row
+    seats       = models.JSONField(default=list)
+    last_actor  = models.IntegerField(null=True)
+    # When the seat to move times out, None when no turn is running
+    turn_deadline = models.DateTimeField(null=True)
+    # The seat that emptied its hand first
+    winner      = models.IntegerField(null=True)
+    # Seats still free to join, 0 once the game has started
+    open_seats  = models.IntegerField(default=MAX_SEATS)
+    created     = models.DateTimeField(default=timezone.now)
+    # When the version last changed
+    changed     = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Only joinable games are in the lobby index, so it stays small however much history builds up
+            models.Index(fields=['-created', '-key'], condition=models.Q(open_seats__gt=0), name='open_lobby'),
+            # Games without a winner yet, likewise small next to the finished ones
+            models.Index(fields=['created'], condition=models.Q(winner=None), name='unfinished_games'),
+            # Finished games by winner, so they can be counted from the index where there is no estimate
+            models.Index(fields=['winner'], condition=~models.Q(winner=None), name='finished_games'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        game = super().from_db(db, field_names, values)
+        game._saved_pile = game._packed_pile()
+        return game
+
+    def _packed_pile(self):
+        # type: () -> Optional[bytes]
+        pile = self.__dict__.get('center_pile')
+        if pile is None:
+            return None
+        return pack_deck(pile) if isinstance(pile, str) else bytes(pile)
+
+    def _changed_fields(self):
+        # type: () -> List[str]
+        # Most saves follow a draw, which only moves center_offset, so the pile is written only when it changed
+        fields = [f.attname for f in self._meta.concrete_fields if not f.primary_key and f.attname in self.__dict__]
+        pile = self._packed_pile()
+        if pile is not None and pile == getattr(self, '_saved_pile', None):
+            fields.remove('center_pile')
+        return fields
+
+    def save(self, *args, **kwargs):
+        fields = self._changed_fields()
+        if 'center_pile' not in fields and not self._state.adding and not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = fields
+        super().save(*args, **kwargs)
+        self._saved_pile = self._packed_pile()
+
+    def save_if_version(self, version):
+        # type: (int) -> bool
+        """Saves the game only while the stored row is still at version, False when another change got there first"""
+
+        values = {f: getattr(self, f) for f in self._changed_fields()}
+        if not Game.objects.filter(pk=self.pk, version=version).update(**values):
+            return False
+        self._saved_pile = self._packed_pile()
+        return True
+
+    @property
+    def center_deck(self):
+        # type: () -> str
+        return self.center_pile[self.center_offset * 2:]
+
+    @center_deck.setter
+    def center_deck(self, cards):
+        # type: (str) -> None
+        self.center_pile = cards
+        self.center_offset = 0
+
+    @property
+    def center_count(self):
+        # type: () -> int
+        return len(self.center_pile) // 2 - self.center_offset
+
+    def take_center(self, n):
+        # type: (int) -> str
+        start = self.center_offset * 2
+        cards = self.center_pile[start:start + n * 2]
+        self.center_offset += n
+        return cards
+
+    @property
+    def is_finished(self):
+        # type: () -> bool
+        return self.turn >= 0 and any(s['hand'] == 0 for s in self.seats)
+
+    def add_seat(self, gp):
+        # type: (GamePlayer) -> None
+        seat = {'name': gp.player.name, 'hand': len(gp.cards) // 2}
+        if gp.player.bot:
+            seat['bot'] = True
+        self.seats.append(seat)
+        self.open_seats = MAX_SEATS - len(self.seats)
+
+    def sync_hand(self, gp):
+        # type: (GamePlayer) -> None
+        self.seats[gp.index]['hand'] = len(gp.cards) // 2
 
     @staticmethod
-    def encode_game(game, player_key):
-        # type: (Game, str) -> dict
+    def encode_game(game, player_key, seat=None):
+        # type: (Game, str, int) -> dict
 
         try:
-            gp = GamePlayer.objects.get(game__pk=game.key, player__pk=player_key)
+            if seat is None:
+                gp = GamePlayer.objects.get(game__pk=game.key, player__pk=player_key)
+            else:
+                gp = GamePlayer.objects.get(game__pk=game.key, index=seat)
+        except Exception:
+            raise BadRequest(f'Invalid player id: {player_key}')
+
+        with span('encode'):
             return {
                 'key': game.key,
                 'turn': game.turn,
+                'version': game.version,
                 'player_key': player_key,
                 'player_index': gp.index,
                 'cards': gp.cards,
@@ -110,17 +287,19 @@ class Game(models.Model):
                 'right_card': game.right_deck[0:2],
                 'left_count': len(game.left_deck) / 2,
                 'right_count': len(game.right_deck) / 2,
-                'center_count': len(game.center_deck) / 2
+                'center_count': game.center_count,
+                'seats': game.seats,
+                'last_actor': game.last_actor,
+                'winner': game.winner,
+                'poll_after_ms': polling.delay_ms(game.turn, game.winner, gp.index, len(game.seats), game.changed),
             }
-        except Exception:
-            raise BadRequest(f'Invalid player id: {player_key}')
 
 
 class GamePlayer(models.Model):
     index  = models.IntegerField()
     game   = models.ForeignKey(Game, on_delete=models.CASCADE)
     player = models.ForeignKey(Player, on_delete=models.CASCADE)
-    cards  = models.CharField(max_length=104, default='')
+    cards  = DeckField(default=b'')
 
     class Meta:
         ordering = ['index']
@@ -129,6 +308,35 @@ class GamePlayer(models.Model):
         ]
 
 
+class PlayerStats(models.Model):
+    """Running totals per player, kept current as games are played"""
+
+    player       = models.OneToOneField(Player, on_delete=models.CASCADE, primary_key=True)
+    games_played = models.IntegerField(default=0)
+    wins         = models.IntegerField(default=0)
+    cards_played = models.IntegerField(default=0)
+    poison_calls = models.IntegerField(default=0)
+
+
+class MatchTicket(models.Model):
+    """A player waiting in the matchmaking queue, or the seat they were matched into"""
+
+    player  = models.ForeignKey(Player, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+    game    = models.ForeignKey(Game, on_delete=models.CASCADE, null=True)
+    seat    = models.IntegerField(null=True)
+    matched = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['player'], condition=models.Q(game=None), name='one_waiting_ticket')
+        ]
+        indexes = [
+            models.Index(fields=['created'], condition=models.Q(game=None), name='waiting_tickets'),
+            models.Index(fields=['player', '-id']),
+        ]
+
+
 class GameAction(models.Model):
     class Type(models.IntegerChoices):
         CardPlayed = 1
@@ -140,6 +348,13 @@ class GameAction(models.Model):
     game   = models.ForeignKey(Game, on_delete=models.CASCADE)
     player = models.ForeignKey(GamePlayer, on_delete=models.CASCADE)
     data   = models.CharField(max_length=256)
+    # What every seat could see happen: hand size changes by seat and the seat to move next
+    effect = models.JSONField(default=dict)
+    created = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['-index']
+        indexes = [
+            models.Index(fields=['created']),
+            models.Index(fields=['game', 'index']),
+        ]
@@ -0,0 +1,205 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from pathlib import Path
+from threading import Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional
+import logging
+import os
+import socket
+import tempfile
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Change notifications: "game X advanced to version V". The game module publishes after each commit
+# and anything holding a poll or cache for a game subscribes to it. Callbacks run on whatever thread
+# delivers the notification, so they should only record or wake something up.
+#
+# Backends subclass Bus, send in publish() and call dispatch() for everything they receive. A
+# database-native backend (e.g. LISTEN/NOTIFY) does the same from its listener thread
+
+logger = logging.getLogger('poison.notify')
+
+Callback = Callable[[str, int], None]
+
+
+class Subscription:
+    def __init__(self, bus, game_key, callback):
+        # type: (Bus, str, Callback) -> None
+        self.bus = bus
+        self.game_key = game_key
+        self.callback = callback
+
+    def cancel(self):
+        self.bus.unsubscribe(self)
+
+
+class Bus(ABC):
+    def __init__(self):
+        self._subscribers = defaultdict(list) # type: Dict[str, List[Subscription]]
+        self._lock = Lock()
+
+    def subscribe(self, game_key, callback):
+        # type: (str, Callback) -> Subscription
+        sub = Subscription(self, game_key, callback)
+        with self._lock:
+            self._subscribers[game_key].append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        # type: (Subscription) -> None
+        with self._lock:
+            subs = self._subscribers.get(sub.game_key, [])
+            if sub in subs:
+                subs.remove(sub)
+            if not subs:
+                self._subscribers.pop(sub.game_key, None)
+
+    def dispatch(self, game_key, version):
+        # type: (str, int) -> None
+        with self._lock:
+            subs = list(self._subscribers.get(game_key, ()))
+        for sub in subs:
+            try:
+                sub.callback(game_key, version)
+            except Exception:
+                logger.exception('Notification callback failed for %s', game_key)
+
+    @abstractmethod
+    def publish(self, game_key, version):
+        # type: (str, int) -> None
+        pass
+
+    def close(self):
+        pass
+
+
+class InProcessBus(Bus):
+    def publish(self, game_key, version):
+        # type: (str, int) -> None
+        self.dispatch(game_key, version)
+
+
+class SocketBus(Bus):
+    """
+    Reaches every process on the host sharing POISON_NOTIFY_DIR. Each process binds a unix datagram
+    socket in the directory and a publish sends one datagram to each of them. Anyone who can write to
+    the directory can send notifications, so the default is one only the current user can open
+    """
+
+    PEER_REFRESH_SECONDS = 1.0
+    RECEIVE_BUFFER = 4 * 1024 * 1024
+
+    def __init__(self, directory=None):
+        # type: (Optional[str]) -> None
+        super().__init__()
+        directory = directory or getattr(settings, 'POISON_NOTIFY_DIR', None)
+        if directory is None:
+            self.directory = Path(tempfile.gettempdir()) / f'poison-notify-{os.getuid()}'
+            self.directory.mkdir(mode=0o700, exist_ok=True)
+            # It may have been made by someone else before us
+            stat = self.directory.lstat()
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o077 or self.directory.is_symlink():
+                raise PermissionError(f'{self.directory} is not private to this user')
+        else:
+            self.directory = Path(directory)
+            self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.path = self.directory / f'{os.getpid()}-{id(self):x}.sock'
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECEIVE_BUFFER)
+        self._sock.bind(str(self.path))
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+        self._peers = [] # type: List[str]
+        self._peers_at = 0.0
+        self._closed = False
+        self._thread = Thread(target=self._listen, name='poison-notify', daemon=True)
+        self._thread.start()
+
+    def _current_peers(self):
+        # type: () -> List[str]
+        now = monotonic()
+        if now - self._peers_at > self.PEER_REFRESH_SECONDS:
+            self._peers = [str(p) for p in self.directory.glob('*.sock') if p != self.path]
+            self._peers_at = now
+        return self._peers
+
+    def publish(self, game_key, version):
+        # type: (str, int) -> None
+        self.dispatch(game_key, version)
+        message = f'{game_key}:{version}'.encode('utf-8')
+        for peer in self._current_peers():
+            try:
+                self._sender.sendto(message, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The process behind it is gone
+                self._forget(peer)
+            except BlockingIOError:
+                # The peer's buffer is full. Versions only go up, so its next notification for
+                # this game supersedes the one lost here
+                logger.debug('Dropped notification for %s, %s is not keeping up', game_key, peer)
+
+    def _forget(self, peer):
+        # type: (str) -> None
+        try:
+            os.unlink(peer)
+        except OSError:
+            pass
+        self._peers_at = 0.0
+
+    def _listen(self):
+        while not self._closed:
+            try:
+                data = self._sock.recv(256)
+            except OSError:
+                return
+            if not data:
+                continue
+            try:
+                game_key, _, version = data.decode('utf-8').rpartition(':')
+                version = int(version)
+            except ValueError:
+                logger.warning('Ignored malformed notification %r', data[:64])
+                continue
+            self.dispatch(game_key, version)
+
+    def close(self):
+        self._closed = True
+        try:
+            # Wakes the listener so it sees the bus is closed
+            self._sender.sendto(b'', str(self.path))
+        except OSError:
+            pass
+        self._thread.join(1)
+        self._sock.close()
+        self._sender.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+_bus = None # type: Optional[Bus]
+_bus_lock = Lock()
+
+
+def bus():
+    # type: () -> Bus
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = import_string(getattr(settings, 'POISON_NOTIFY_BACKEND', 'poison.notify.InProcessBus'))()
+    return _bus
+
+
+def publish(game_key, version):
+    # type: (str, int) -> None
+    bus().publish(game_key, version)
+
+
+def subscribe(game_key, callback):
+    # type: (str, Callback) -> Subscription
+    return bus().subscribe(game_key, callback)
@@ -0,0 +1,50 @@
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import ratelimit
+
+# How long a client should wait before polling again, sent with every game state. Seats poll fastest
+# when they are next to move, slower the longer the game has gone without a change, and everyone
+# backs off while this process is busy
+
+LOBBY_MS = 2000
+NEXT_MS = 500
+WAITING_MS = 1000
+OWN_TURN_MS = 2000
+FINISHED_MS = 30000
+# Every this many idle seconds adds the base delay again
+IDLE_STEP = 30
+
+
+def load():
+    # type: () -> float
+    """Requests in flight as a fraction of POISON_MAX_IN_FLIGHT, 0 when there is no limit"""
+
+    limit = getattr(settings, 'POISON_MAX_IN_FLIGHT', None)
+    if not limit:
+        return 0.0
+    return min(1.0, ratelimit.in_flight() / limit)
+
+
+def delay_ms(turn, winner, seat, seats, changed):
+    # type: (int, Optional[int], int, int, Optional[datetime]) -> int
+    if winner is not None:
+        return FINISHED_MS
+    if turn < 0:
+        delay = LOBBY_MS
+    elif turn == seat:
+        delay = OWN_TURN_MS
+    elif (turn + 1) % seats == seat:
+        delay = NEXT_MS
+    else:
+        delay = WAITING_MS
+
+    if changed is not None:
+        idle = (timezone.now() - changed).total_seconds()
+        delay *= 1 + int(max(0.0, idle) // IDLE_STEP)
+    # Up to four times slower as the process fills up past half its limit
+    delay *= 1 + 6 * max(0.0, load() - 0.5)
+    return int(min(delay, getattr(settings, 'POISON_POLL_MAX_MS', FINISHED_MS)))
@@ -0,0 +1,185 @@
+"""
+Opt-in request profiling. Add 'poison.profiling.ServerTimingMiddleware' to MIDDLEWARE to get a
+Server-Timing header and a structured log line per request. Set POISON_PROFILE_EVERY to N to also
+dump a cProfile of every Nth request into POISON_PROFILE_DIR. Async views do their work on worker
+threads, so each thread hop is profiled on its own thread and the hops are merged into one dump.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from pathlib import Path
+from time import perf_counter, time
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import cProfile
+import json
+import logging
+import os
+import pstats
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpRequest, HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger('poison.profiling')
+
+_timings = ContextVar('poison_timings', default=None) # type: ContextVar[Optional[Dict[str, float]]]
+_profiles = ContextVar('poison_profiles', default=None) # type: ContextVar[Optional[List[cProfile.Profile]]]
+_request_number = count(1)
+_dump_number = count(1)
+
+Captured = Tuple[Optional[Dict[str, float]], Optional[List[cProfile.Profile]]]
+
+
+@contextmanager
+def span(name):
+    # type: (str) -> None
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + perf_counter() - start
+
+
+def capture():
+    # type: () -> Captured
+    """The current request's timings and profiles, to carry to the thread that does its work"""
+
+    return _timings.get(), _profiles.get()
+
+
+@contextmanager
+def hop(captured):
+    # type: (Captured) -> None
+    """Records timings and, when the request is being profiled, a profile of the enclosed work"""
+
+    timings, profiles = captured
+    token = _timings.set(timings)
+    profile = None
+    if profiles is not None:
+        profile = cProfile.Profile()
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            profiles.append(profile)
+        _timings.reset(token)
+
+
+def _time_query(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings['db'] = timings.get('db', 0.0) + perf_counter() - start
+        timings['db_queries'] = timings.get('db_queries', 0) + 1
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    # Connections are per thread, so the timer is attached to each one as it opens. That also
+    # covers the worker threads the async views run their queries on
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def _should_profile():
+    # type: () -> bool
+    every = getattr(settings, 'POISON_PROFILE_EVERY', 0)
+    return every > 0 and next(_request_number) % every == 0
+
+
+def _dump_profile(profiles, request):
+    # type: (List[cProfile.Profile], HttpRequest) -> None
+    if not profiles:
+        return
+    directory = Path(getattr(settings, 'POISON_PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+    directory.mkdir(parents=True, exist_ok=True)
+    name = request.path.strip('/').replace('/', '_') or 'root'
+    # Requests finishing in the same millisecond, here or in another worker, still get their own file
+    unique = f'{int(time() * 1000)}-{os.getpid()}-{next(_dump_number)}'
+    pstats.Stats(*profiles).dump_stats(directory / f'{unique}-{name}.prof')
+
+
+def _finish(request, response, timings, total):
+    # type: (HttpRequest, HttpResponse, Dict[str, float], float) -> None
+    queries = timings.pop('db_queries', 0)
+    entries = [f'{k};dur={v * 1000:.2f}' for k, v in timings.items()]
+    entries.append(f'total;dur={total * 1000:.2f}')
+    response['Server-Timing'] = ', '.join(entries)
+
+    logger.info(json.dumps({
+        'path': request.path,
+        'status': response.status_code,
+        'total_ms': round(total * 1000, 3),
+        'db_queries': queries,
+        **{f'{k}_ms': round(v * 1000, 3) for k, v in timings.items()},
+    }))
+
+
+class _RequestProfile:
+    def __init__(self, is_async=False):
+        # type: (bool) -> None
+        for connection in connections.all():
+            _install_query_timer(None, connection)
+        self.timings = {} # type: Dict[str, float]
+        self.profiles = [] if _should_profile() else None # type: Optional[List[cProfile.Profile]]
+        self.token = _timings.set(self.timings)
+        self.profiles_token = _profiles.set(self.profiles)
+        self.profile = None
+        if self.profiles is not None and not is_async:
+            # Sync requests run on this thread throughout. Async ones are profiled by their hops
+            self.profile = cProfile.Profile()
+            self.profiles.append(self.profile)
+        self.start = perf_counter()
+        if self.profile:
+            self.profile.enable()
+
+    def stop(self):
+        if self.profile:
+            self.profile.disable()
+        _profiles.reset(self.profiles_token)
+        _timings.reset(self.token)
+        self.elapsed = perf_counter() - self.start
+
+    def finish(self, request, response):
+        # type: (HttpRequest, HttpResponse) -> HttpResponse
+        _finish(request, response, self.timings, self.elapsed)
+        if self.profiles is not None:
+            _dump_profile(self.profiles, request)
+        return response
+
+
+@sync_and_async_middleware
+def ServerTimingMiddleware(get_response):
+    connection_created.connect(_install_query_timer, dispatch_uid='poison_query_timer')
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            profile = _RequestProfile(is_async=True)
+            try:
+                response = await get_response(request)
+            finally:
+                profile.stop()
+            return profile.finish(request, response)
+        return middleware
+
+    def middleware(request):
+        profile = _RequestProfile()
+        try:
+            response = get_response(request)
+        finally:
+            profile.stop()
+        return profile.finish(request, response)
+    return middleware
@@ -0,0 +1,151 @@
+from functools import lru_cache, wraps
+from threading import Lock
+from math import ceil, floor
+from time import monotonic, time
+from typing import Dict, Tuple
+import asyncio
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .exceptions import OverloadedException, RateLimitedException
+
+# Budgets are (tokens per second, burst size) per endpoint, keyed by game and player
+DEFAULT_RATE_LIMITS = {
+    'poll_game': (4.0, 8),
+    'perform_action': (2.0, 6),
+    'sync_actions': (4.0, 8),
+    'match_status': (2.0, 4),
+}
+
+
+class MemoryBackend:
+    """Token buckets held in this process"""
+
+    PRUNE_EVERY = 10000
+
+    def __init__(self):
+        # Tokens, when they were counted and when the bucket will be full again
+        self._buckets = {} # type: Dict[str, Tuple[float, float, float]]
+        self._lock = Lock()
+        self._ops = 0
+
+    def take(self, key, rate, burst):
+        # type: (str, float, int) -> float
+        """Takes a token from the bucket and returns 0, or returns the seconds until one is available"""
+
+        now = monotonic()
+        with self._lock:
+            tokens, stamp, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+
+            self._ops += 1
+            if self._ops >= self.PRUNE_EVERY:
+                self._ops = 0
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        # Buckets that have refilled completely are the same as missing ones. Each bucket knows its own
+        # refill time, since endpoints refill at different rates
+        self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+
+
+class CacheBackend:
+    """
+    Shares budgets between processes through the Django cache named by POISON_RATE_LIMIT_CACHE.
+    Allows `burst` requests per fixed window of the time the bucket takes to refill (burst / rate),
+    counted with atomic add/incr. That keeps the bucket's average rate and burst, though a client
+    can use two windows' worth back to back across a window boundary
+    """
+
+    def __init__(self):
+        self._cache = caches[getattr(settings, 'POISON_RATE_LIMIT_CACHE', 'default')]
+
+    def take(self, key, rate, burst):
+        # type: (str, float, int) -> float
+        now = time()
+        period = burst / rate
+        window = floor(now / period)
+        cache_key = f'poison-rl:{key}:{window}'
+        timeout = ceil(period) + 1
+        self._cache.add(cache_key, 0, timeout=timeout)
+        try:
+            used = self._cache.incr(cache_key)
+        except ValueError:
+            # Evicted or expired since the add
+            used = 1 if self._cache.add(cache_key, 1, timeout=timeout) else self._cache.incr(cache_key)
+        if used <= burst:
+            return 0.0
+        return (window + 1) * period - now
+
+
+@lru_cache(maxsize=None)
+def _backend(path):
+    return import_string(path)()
+
+
+def consume(endpoint, player_id, game_id):
+    # type: (str, str, str) -> None
+    limits = getattr(settings, 'POISON_RATE_LIMITS', DEFAULT_RATE_LIMITS)
+    if endpoint not in limits:
+        return
+    rate, burst = limits[endpoint]
+    backend = _backend(getattr(settings, 'POISON_RATE_LIMIT_BACKEND', 'poison.ratelimit.MemoryBackend'))
+    wait = backend.take(f'{endpoint}:{game_id}:{player_id}', rate, burst)
+    if wait > 0:
+        raise RateLimitedException(wait)
+
+
+_in_flight = 0
+_in_flight_lock = Lock()
+
+
+def in_flight():
+    # type: () -> int
+    return _in_flight
+
+
+def _enter():
+    global _in_flight
+    limit = getattr(settings, 'POISON_MAX_IN_FLIGHT', None)
+    with _in_flight_lock:
+        if limit is not None and _in_flight >= limit:
+            raise OverloadedException(getattr(settings, 'POISON_OVERLOAD_RETRY_AFTER', 1.0))
+        _in_flight += 1
+
+
+def _exit():
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+
+
+def admission(f):
+    """Sheds requests once POISON_MAX_IN_FLIGHT are already being served by this process"""
+
+    if asyncio.iscoroutinefunction(f):
+        @wraps(f)
+        async def async_wrapper(*args):
+            _enter()
+            try:
+                return await f(*args)
+            finally:
+                _exit()
+        return async_wrapper
+
+    @wraps(f)
+    def wrapper(*args):
+        _enter()
+        try:
+            return f(*args)
+        finally:
+            _exit()
+    return wrapper
@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.exceptions import BadRequest
+
+from . import metrics
+
+# Read-only views can read from the database alias named by POISON_REPLICA. They do it by running
+# their reads inside replica_reads(), which ReplicaRouter (in DATABASE_ROUTERS) sends to the replica.
+# Everything else keeps using the primary. Replicas lag, so a client passes the game version it last
+# saw from its own write and reads that come back older than that are repeated on the primary
+
+_replica_reads = ContextVar('poison_replica_reads', default=False)
+
+
+def alias():
+    # type: () -> Optional[str]
+    return getattr(settings, 'POISON_REPLICA', None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema with the data it copies
+        return db != alias() or alias() == 'default'
+
+
+@contextmanager
+def replica_reads():
+    token = _replica_reads.set(alias() is not None)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def read_state(load, min_version=None):
+    # type: (Callable[[], dict], Optional[int]) -> dict
+    """Runs load on the replica, and again on the primary if the replica is missing or behind the game"""
+
+    if alias() is None:
+        return load()
+    try:
+        with replica_reads():
+            state = load()
+        if min_version is None or state['version'] >= min_version:
+            return state
+    except BadRequest:
+        # Probably a game or seat the replica has not received yet
+        pass
+    metrics.replica_fallbacks.inc()
+    return load()
@@ -0,0 +1,213 @@
+from bisect import bisect
+from hashlib import md5
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+import ipaddress
+import json
+
+from django.utils.crypto import constant_time_compare
+
+from . import tokens
+
+# Games are owned by worker processes through consistent hashing of Game.key. The database stays
+# shared, so moving ownership never moves data: a worker that gains a game loads it on first use
+# and one that loses a game simply stops seeing requests for it
+
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'te', 'trailer', 'upgrade'}
+
+
+def _hash(value):
+    # type: (str) -> int
+    return int.from_bytes(md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, nodes=(), replicas=128):
+        # type: (Iterable[str], int) -> None
+        self.replicas = replicas
+        self._points = [] # type: List[int]
+        self._owners = {} # type: Dict[int, str]
+        self.nodes = set() # type: set
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        # type: (str) -> None
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash(f'{node}#{i}')
+            self._owners[point] = node
+        self._points = sorted(self._owners)
+
+    def remove(self, node):
+        # type: (str) -> None
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._owners = {p: n for p, n in self._owners.items() if n != node}
+        self._points = sorted(self._owners)
+
+    def owner(self, key):
+        # type: (str) -> Optional[str]
+        if not self._points:
+            return None
+        i = bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[i]]
+
+
+def routing_key(body):
+    # type: (bytes) -> Optional[str]
+    """The game a poison request is for, taken from game_id or the game bound into its token"""
+
+    try:
+        parsed = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(parsed, dict):
+        return None
+    if isinstance(parsed.get('game_id'), str):
+        return parsed['game_id']
+    token = tokens.peek(parsed.get('token'))
+    return token.game_id if token else None
+
+
+def parse_workers(body):
+    # type: (bytes) -> Optional[List[str]]
+    """The worker urls from a {"workers": [...]} body, None unless every one is an http url with a host"""
+
+    try:
+        parsed = json.loads(body)
+    except ValueError:
+        return None
+    workers = parsed.get('workers') if isinstance(parsed, dict) else None
+    if not isinstance(workers, list):
+        return None
+    for worker in workers:
+        if not isinstance(worker, str):
+            return None
+        try:
+            url = urlsplit(worker)
+            url.port
+        except ValueError:
+            return None
+        if url.scheme != 'http' or not url.hostname:
+            return None
+    return workers
+
+
+class ShardRouter:
+    """
+    Forwards each request to the worker owning its game, or round robin when it has none.
+    /_shards answers callers presenting the shared secret as a bearer token, or only loopback
+    callers when there is no secret
+    """
+
+    def __init__(self, workers, secret=None):
+        # type: (Iterable[str], Optional[str]) -> None
+        self.ring = HashRing(workers)
+        self.secret = secret
+        self._lock = Lock()
+        self._next = count()
+
+    def set_workers(self, workers):
+        # type: (Iterable[str]) -> None
+        workers = set(workers)
+        with self._lock:
+            for node in self.ring.nodes - workers:
+                self.ring.remove(node)
+            for node in workers - self.ring.nodes:
+                self.ring.add(node)
+
+    def allows(self, client, authorization):
+        # type: (str, Optional[str]) -> bool
+        if self.secret:
+            return constant_time_compare(authorization or '', f'Bearer {self.secret}')
+        try:
+            return ipaddress.ip_address(client).is_loopback
+        except ValueError:
+            return False
+
+    def pick(self, body):
+        # type: (bytes) -> Optional[str]
+        key = routing_key(body) if body else None
+        with self._lock:
+            if not self.ring.nodes:
+                return None
+            if key is not None:
+                return self.ring.owner(key)
+            nodes = sorted(self.ring.nodes)
+            return nodes[next(self._next) % len(nodes)]
+
+    def serve(self, host, port):
+        # type: (str, int) -> ThreadingHTTPServer
+        return ThreadingHTTPServer((host, port), _handler_for(self))
+
+
+def _handler_for(router):
+    # type: (ShardRouter) -> type
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self._handle()
+
+        def do_POST(self):
+            self._handle()
+
+        def _handle(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if self.path == '/_shards':
+                return self._shards(body)
+
+            owner = router.pick(body)
+            if owner is None:
+                return self._reply(503, b'{"message": "No workers"}')
+            worker = urlsplit(owner)
+            upstream = HTTPConnection(worker.hostname, worker.port, timeout=30)
+            headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_HEADERS}
+            try:
+                upstream.request(self.command, self.path, body=body, headers=headers)
+                response = upstream.getresponse()
+                payload = response.read()
+            except OSError:
+                return self._reply(502, b'{"message": "Worker unavailable"}')
+            finally:
+                upstream.close()
+
+            self.send_response(response.status)
+            for k, v in response.getheaders():
+                if k.lower() not in HOP_HEADERS and k.lower() != 'content-length':
+                    self.send_header(k, v)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _shards(self, body):
+            # POST {"workers": [...]} replaces the worker set, GET lists it
+            if not router.allows(self.client_address[0], self.headers.get('Authorization')):
+                return self._reply(403, b'{"message": "Forbidden"}')
+            if self.command == 'POST':
+                workers = parse_workers(body)
+                if workers is None:
+                    return self._reply(400, b'{"message": "Bad worker list"}')
+                router.set_workers(workers)
+            self._reply(200, json.dumps({'workers': sorted(router.ring.nodes)}).encode('utf-8'))
+
+        def _reply(self, status, payload):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
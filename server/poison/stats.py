@@ -0,0 +1,40 @@
+from typing import Iterable
+
+from django.db.models import F
+
+from .models import Game, GameAction, GamePlayer, PlayerStats
+
+# Player statistics are counters bumped with UPDATE ... SET n = n + 1 in the transaction that made the
+# change, so concurrent games never overwrite each other's totals and reading them is one row.
+# Rows are created the first time a player's counters change
+
+
+def add(player_ids, **increments):
+    # type: (Iterable[str], int) -> None
+    player_ids = list(player_ids)
+    PlayerStats.objects.bulk_create([PlayerStats(player_id=pk) for pk in player_ids], ignore_conflicts=True)
+    PlayerStats.objects.filter(player_id__in=player_ids).update(
+        **{name: F(name) + n for name, n in increments.items()}
+    )
+
+
+def record_action(game, player, kind):
+    # type: (Game, GamePlayer, GameAction.Type) -> None
+    increments = {}
+    if kind == GameAction.Type.CardPlayed:
+        increments['cards_played'] = 1
+    elif kind == GameAction.Type.PoisonCalled:
+        increments['poison_calls'] = 1
+    if game.winner is None and game.is_finished and player.cards == '':
+        game.winner = player.index
+        increments['wins'] = 1
+    if increments:
+        add([player.player_id], **increments)
+
+
+def get(player_id):
+    # type: (str) -> PlayerStats
+    try:
+        return PlayerStats.objects.get(pk=player_id)
+    except PlayerStats.DoesNotExist:
+        return PlayerStats(player_id=player_id)
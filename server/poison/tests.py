@@ -1,6 +1,30 @@
+from pathlib import Path
+from datetime import timedelta
+from http.client import HTTPConnection
+from io import StringIO
+from tempfile import TemporaryDirectory
+from threading import Event
+from time import time
 from typing import Tuple
+from unittest.mock import patch
+import asyncio
+import csv
+import gzip
+import json
+import os
+import pstats
+import re
+import threading
 
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
 from .exceptions import (
     BadTurnException,
@@ -13,10 +37,15 @@ from .exceptions import (
     NotHostException,
     NotInGameException,
     OutOfCardsException,
-    PoisonAlreadyCalledException
+    PoisonAlreadyCalledException,
+    OverloadedException,
+    RateLimitedException,
+    InvalidTokenException,
+    GameBusyException,
+    GameChangedException
 )
-from .models import Game, GameAction, GamePlayer, Player
-from . import game, actions
+from .models import Card, Game, GameAction, GamePlayer, MatchTicket, Player, PlayerStats, pack_deck, unpack_deck
+from . import game, actionlog, actions, actors, bots, dashboard, export, hotstate, matchmaking, metrics, notify, polling, replicas, stats, ratelimit, sharding, tokens, turns
 
 
 class GamePlayTests(TestCase):
@@ -340,3 +369,1111 @@ class GamePlayTests(TestCase):
 
         with self.assertRaises(PoisonAlreadyCalledException):
             game.perform_action(g.key, p2.player.key, GameAction.Type.PoisonCalled, {})
+
+
+@override_settings(POISON_ASYNC_DB_THREAD_SENSITIVE=True)
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.p1 = Player.objects.create(name='Ben')
+        cls.p2 = Player.objects.create(name='Anna')
+
+    async def _post(self, name, body):
+        response = await self.async_client.post(reverse(name), json.dumps(body), content_type='application/json')
+        return response.status_code, json.loads(response.content)
+
+    async def test_async_game_flow(self):
+        status, g = await self._post('async_create_game', {'player_id': self.p1.key})
+        self.assertEqual(status, 200)
+        self.assertEqual(g['turn'], -1)
+        self.assertEqual(g['player_index'], 0)
+
+        status, g = await self._post('async_join_game', {'player_id': self.p2.key, 'game_id': g['key']})
+        self.assertEqual(status, 200)
+        self.assertEqual(g['player_index'], 1)
+
+        status, g = await self._post('start_game', {'player_id': self.p1.key, 'game_id': g['key']})
+        self.assertEqual(status, 200)
+        self.assertEqual(g['turn'], 0)
+
+        status, err = await self._post('async_perform_action', {
+            'player_id': self.p2.key,
+            'game_id': g['key'],
+            'type': GameAction.Type.CardDrawn,
+            'params': {},
+        })
+        self.assertEqual(status, 418)
+        self.assertEqual(err['code'], BadTurnException().code)
+
+        status, g = await self._post('async_perform_action', {
+            'player_id': self.p1.key,
+            'game_id': g['key'],
+            'type': GameAction.Type.CardDrawn,
+            'params': {},
+        })
+        self.assertEqual(status, 200)
+        self.assertEqual(len(g['cards']), 16)
+
+        status, polled = await self._post('async_poll_game', {'player_id': self.p1.key, 'game_id': g['key']})
+        self.assertEqual(status, 200)
+        self.assertEqual(polled, g)
+
+
+class ProfilingTests(TestCase):
+    def test_server_timing(self):
+        g, p1, _ = GamePlayTests._create_game()
+        middleware = [*settings.MIDDLEWARE, 'poison.profiling.ServerTimingMiddleware']
+
+        with TemporaryDirectory() as profiles:
+            with override_settings(MIDDLEWARE=middleware, POISON_PROFILE_EVERY=1, POISON_PROFILE_DIR=profiles):
+                with self.assertLogs('poison.profiling', 'INFO') as logs:
+                    response = self.client.post(reverse('perform_action'), json.dumps({
+                        'player_id': p1.player.key,
+                        'game_id': g.key,
+                        'type': GameAction.Type.CardDrawn,
+                        'params': {},
+                    }), content_type='application/json')
+            self.assertEqual(len(list(Path(profiles).glob('*.prof'))), 1)
+
+        self.assertEqual(response.status_code, 200)
+        timings = [t.split(';')[0] for t in response['Server-Timing'].split(', ')]
+        for name in ['decode', 'rules', 'encode', 'db', 'total']:
+            self.assertIn(name, timings)
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertGreater(logged['db_queries'], 0)
+
+    @override_settings(POISON_ASYNC_DB_THREAD_SENSITIVE=True)
+    async def test_async_profile_covers_thread_hop(self):
+        g, p1, _ = await sync_to_async(GamePlayTests._create_game)()
+        middleware = [*settings.MIDDLEWARE, 'poison.profiling.ServerTimingMiddleware']
+        body = json.dumps({'player_id': p1.player_id, 'game_id': g.key})
+
+        with TemporaryDirectory() as profiles:
+            with override_settings(MIDDLEWARE=middleware, POISON_PROFILE_EVERY=1, POISON_PROFILE_DIR=profiles):
+                with self.assertLogs('poison.profiling', 'INFO'):
+                    for _ in range(2):
+                        await self.async_client.post(reverse('async_poll_game'), body, content_type='application/json')
+            dumps = list(Path(profiles).glob('*.prof'))
+            self.assertEqual(len(dumps), 2)
+            functions = {name for _, _, name in pstats.Stats(str(dumps[0])).stats}
+        self.assertIn('encode_game', functions)
+
+
+class MetricsTests(TestCase):
+    def test_metrics_endpoint(self):
+        g, p1, p2 = GamePlayTests._create_game()
+        errors = metrics.errors.value(BadTurnException().code)
+        reshuffles = metrics.reshuffles.value()
+
+        body = {'player_id': p2.player.key, 'game_id': g.key, 'type': GameAction.Type.CardDrawn, 'params': {}}
+        self.client.post(reverse('perform_action'), json.dumps(body), content_type='application/json')
+        self.assertEqual(metrics.errors.value(BadTurnException().code), errors + 1)
+
+        g.center_deck = ''
+        g.left_deck = '2d5c'
+        g.save()
+        game.perform_action(g.key, p1.player.key, GameAction.Type.CardDrawn, {})
+        self.assertEqual(metrics.reshuffles.value(), reshuffles + 1)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('poison_request_seconds_bucket{view="perform_action",le="+Inf"}', text)
+        self.assertIn('poison_games{state="active"} 1', text)
+        self.assertIn('poison_games{state="lobby"} 0', text)
+        self.assertIn('poison_actions_total{type="CardDrawn"}', text)
+
+
+class RateLimitTests(TestCase):
+    def _poll(self, g, p):
+        body = {'player_id': p.player.key, 'game_id': g.key}
+        return self.client.post(reverse('poll_game'), json.dumps(body), content_type='application/json')
+
+    @override_settings(POISON_RATE_LIMITS={'poll_game': (0.5, 2)})
+    def test_poll_budget(self):
+        g, p1, p2 = GamePlayTests._create_game()
+        self.assertEqual(self._poll(g, p1).status_code, 200)
+        self.assertEqual(self._poll(g, p1).status_code, 200)
+
+        response = self._poll(g, p1)
+        self.assertEqual(response.status_code, 429)
+        body = json.loads(response.content)
+        self.assertEqual(body['code'], RateLimitedException(0).code)
+        self.assertGreater(body['retry_after'], 0)
+        self.assertEqual(response['Retry-After'], '2')
+
+        # Budgets are per player
+        self.assertEqual(self._poll(g, p2).status_code, 200)
+
+    def test_memory_prune_keeps_slow_buckets(self):
+        backend = ratelimit.MemoryBackend()
+        with patch('poison.ratelimit.monotonic', return_value=100.0):
+            backend.take('slow', 2.0, 6)
+            backend.take('fast', 4.0, 8)
+        # The slow bucket needs 0.5s to refill, the fast one only 0.25s
+        backend._prune(100.3)
+        self.assertEqual(list(backend._buckets), ['slow'])
+        backend._prune(100.6)
+        self.assertEqual(backend._buckets, {})
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cache_backend_budget(self):
+        backend = ratelimit.CacheBackend()
+        with patch('poison.ratelimit.time', return_value=1000.5):
+            self.assertEqual([backend.take('k', 0.5, 2) for _ in range(3)][:2], [0.0, 0.0])
+            self.assertEqual(backend.take('k', 0.5, 2), 3.5)
+
+            incr = backend._cache.incr
+
+            def evicted(key):
+                backend._cache.delete(key)
+                raise ValueError(key)
+            with patch.object(backend._cache, 'incr', side_effect=evicted):
+                self.assertEqual(backend.take('e', 0.5, 2), 0.0)
+            self.assertEqual(incr('poison-rl:e:250'), 2)
+
+    def test_overload_shedding(self):
+        g, p1, _ = GamePlayTests._create_game()
+        with override_settings(POISON_MAX_IN_FLIGHT=0):
+            response = self._poll(g, p1)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(json.loads(response.content)['code'], OverloadedException(0).code)
+        self.assertEqual(ratelimit.in_flight(), 0)
+
+
+class TokenTests(TestCase):
+    def _post(self, name, body):
+        response = self.client.post(reverse(name), json.dumps(body), content_type='application/json')
+        return response.status_code, json.loads(response.content)
+
+    def test_round_trip(self):
+        token = tokens.issue('ABC', 'DEF', 3)
+        self.assertEqual(tokens.verify(token), tokens.PlayerToken('ABC', 'DEF', 3))
+        self.assertEqual(tokens.verify(tokens.issue('ABC')), tokens.PlayerToken('ABC', None, None))
+
+        payload, signature = token.split('.')
+        forged = tokens.issue('ABC', 'DEF', 0).split('.')[0]
+        for bad in [f'{forged}.{signature}', f'{payload}.{signature[:-1]}', payload, None]:
+            with self.assertRaises(InvalidTokenException):
+                tokens.verify(bad)
+
+    def test_token_flow(self):
+        _, host = self._post('create_player', {'name': 'Ben'})
+        _, guest = self._post('create_player', {'name': 'Anna'})
+
+        _, g = self._post('create_game', {'token': host['token']})
+        host_token = g['token']
+        _, joined = self._post('join_game', {'token': guest['token'], 'game_id': g['key']})
+        guest_token = joined['token']
+        self.assertEqual(tokens.verify(guest_token).seat, 1)
+
+        status, _ = self._post('start_game', {'token': guest_token})
+        self.assertEqual(status, 418)
+        status, g = self._post('start_game', {'token': host_token})
+        self.assertEqual(status, 200)
+        self.assertEqual(g['player_key'], host['id'])
+
+        status, g = self._post('perform_action', {'token': host_token, 'type': GameAction.Type.CardDrawn, 'params': {}})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(g['cards']), 16)
+
+        status, err = self._post('poll_game', {'token': host_token[:-2], 'game_id': g['key']})
+        self.assertEqual(err['code'], InvalidTokenException().code)
+
+        with override_settings(POISON_REQUIRE_TOKENS=True):
+            status, err = self._post('poll_game', {'player_id': host['id'], 'game_id': g['key']})
+            self.assertEqual(err['code'], InvalidTokenException().code)
+            status, _ = self._post('poll_game', {'token': guest_token})
+            self.assertEqual(status, 200)
+
+
+class ShardingTests(TestCase):
+    def test_ring_rebalance(self):
+        ring = sharding.HashRing(['a', 'b', 'c'])
+        keys = [f'GAME{i:012d}' for i in range(3000)]
+        before = {k: ring.owner(k) for k in keys}
+        for node in 'abc':
+            self.assertGreater(list(before.values()).count(node), 600)
+
+        ring.add('d')
+        moved = [k for k in keys if ring.owner(k) != before[k]]
+        self.assertTrue(all(ring.owner(k) == 'd' for k in moved))
+        self.assertLess(len(moved), 1200)
+
+        ring.remove('d')
+        self.assertEqual({k: ring.owner(k) for k in keys}, before)
+
+    def test_routing_key(self):
+        self.assertEqual(sharding.routing_key(b'{"game_id": "G1", "player_id": "P"}'), 'G1')
+        self.assertEqual(sharding.routing_key(json.dumps({'token': tokens.issue('P', 'G2', 1)}).encode()), 'G2')
+        self.assertIsNone(sharding.routing_key(json.dumps({'token': tokens.issue('P')}).encode()))
+        self.assertIsNone(sharding.routing_key(b'{"name": "Ben"}'))
+        self.assertIsNone(sharding.routing_key(b'not json'))
+
+        router = sharding.ShardRouter(['http://w1', 'http://w2'])
+        body = b'{"game_id": "G1"}'
+        self.assertEqual(router.pick(body), router.ring.owner('G1'))
+        router.set_workers([])
+        self.assertIsNone(router.pick(body))
+
+    def test_shards_endpoint(self):
+        self.assertEqual(sharding.parse_workers(b'{"workers": ["http://w1:8100"]}'), ['http://w1:8100'])
+        for body in (b'', b'[]', b'{"workers": "http://w1"}', b'{"workers": [1]}', b'{"workers": ["w1"]}',
+                     b'{"workers": ["http://w1:port"]}', b'{}'):
+            self.assertIsNone(sharding.parse_workers(body), body)
+
+        open_router = sharding.ShardRouter([])
+        self.assertTrue(open_router.allows('127.0.0.1', None))
+        self.assertTrue(open_router.allows('::1', None))
+        self.assertFalse(open_router.allows('10.0.0.5', None))
+        router = sharding.ShardRouter([], 's3cret')
+        self.assertTrue(router.allows('10.0.0.5', 'Bearer s3cret'))
+        self.assertFalse(router.allows('127.0.0.1', None))
+        self.assertFalse(router.allows('127.0.0.1', 'Bearer wrong'))
+
+        server = router.serve('127.0.0.1', 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            def post(body, **headers):
+                conn = HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+                conn.request('POST', '/_shards', body=body, headers=headers)
+                status = conn.getresponse().status
+                conn.close()
+                return status
+            self.assertEqual(post(b'{"workers": ["http://w1:8100"]}'), 403)
+            self.assertEqual(post(b'{"workers": "nope"}', Authorization='Bearer s3cret'), 400)
+            self.assertEqual(router.ring.nodes, set())
+            self.assertEqual(post(b'{"workers": ["http://w1:8100"]}', Authorization='Bearer s3cret'), 200)
+            self.assertEqual(router.ring.nodes, {'http://w1:8100'})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class ActorTests(TestCase):
+    async def test_commands_run_in_order(self):
+        registry = actors.ActorRegistry(queue_size=2, idle_seconds=0.05)
+        log = []
+        gate = asyncio.Event()
+
+        async def command(n):
+            await gate.wait()
+            log.append(n)
+            return n
+
+        first = registry.get('G').submit(command, 1)
+        second = registry.get('G').submit(command, 2)
+        with self.assertRaises(GameBusyException):
+            registry.get('G').submit(command, 3)
+        other = registry.get('H').submit(command, 4)
+
+        gate.set()
+        self.assertEqual(await asyncio.gather(first, second, other), [1, 2, 4])
+        self.assertEqual([n for n in log if n != 4], [1, 2])
+
+        await asyncio.sleep(0.2)
+        self.assertEqual(registry.actors, {})
+
+    async def test_errors_reach_caller(self):
+        registry = actors.ActorRegistry(idle_seconds=0.05)
+
+        async def fail():
+            raise BadTurnException()
+
+        with self.assertRaises(BadTurnException):
+            await registry.submit('G', fail)
+        self.assertEqual(await registry.submit('G', asyncio.sleep, 0, 'ok'), 'ok')
+
+
+@override_settings(POISON_GAME_ACTORS=True)
+class ActorViewTests(TransactionTestCase):
+    # Actor tasks run their database work on their own thread, so the data has to be committed
+
+    def setUp(self):
+        self.p1 = Player.objects.create(name='Ben')
+        self.p2 = Player.objects.create(name='Anna')
+
+    _post = AsyncViewTests._post
+
+    async def test_actor_backed_actions(self):
+        _, g = await self._post('async_create_game', {'player_id': self.p1.key})
+        await self._post('async_join_game', {'player_id': self.p2.key, 'game_id': g['key']})
+        await self._post('start_game', {'player_id': self.p1.key, 'game_id': g['key']})
+
+        body = {'player_id': self.p1.key, 'game_id': g['key'], 'type': GameAction.Type.CardDrawn, 'params': {}}
+        results = await asyncio.gather(*[self._post('async_perform_action', body) for _ in range(3)])
+        self.assertEqual([status for status, _ in results], [200] * 3)
+        self.assertEqual(sorted(len(state['cards']) for _, state in results), [16, 18, 20])
+
+
+class AsyncDefaultThreadTests(TransactionTestCase):
+    # The shipped default: database hops run on executor threads with their own connections
+
+    _post = AsyncViewTests._post
+
+    async def test_thread_insensitive_hops(self):
+        p1 = await sync_to_async(Player.objects.create)(name='Ben')
+        p2 = await sync_to_async(Player.objects.create)(name='Anna')
+        hops = []
+
+        def close_and_record():
+            close_old_connections()
+            hops.append(threading.get_ident())
+
+        with patch('poison.async_views.close_old_connections', close_and_record):
+            _, g = await self._post('async_create_game', {'player_id': p1.key})
+            await self._post('async_join_game', {'player_id': p2.key, 'game_id': g['key']})
+            body = {'player_id': p2.key, 'game_id': g['key']}
+            results = await asyncio.gather(*[self._post('async_poll_game', body) for _ in range(4)])
+
+        self.assertEqual([status for status, _ in results], [200] * 4)
+        self.assertEqual({state['player_index'] for _, state in results}, {1})
+        # Stale connections are closed before and after each of the six hops, never on the event loop
+        # thread (the in-memory test database itself is never really closed)
+        self.assertEqual(len(hops), 12)
+        self.assertNotIn(threading.get_ident(), hops)
+
+
+class NotifyTests(TestCase):
+    def test_publish_on_commit(self):
+        g, p1, _ = GamePlayTests._create_game()
+        seen = []
+        sub = notify.subscribe(g.key, lambda key, version: seen.append((key, version)))
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                g = game.perform_action(g.key, p1.player.key, GameAction.Type.CardDrawn, {})
+                self.assertEqual(seen, [])
+        finally:
+            sub.cancel()
+        self.assertEqual(seen, [(g.key, g.version)])
+        self.assertEqual(g.version, 3)
+
+    def test_socket_bus(self):
+        with TemporaryDirectory() as directory:
+            a = notify.SocketBus(directory)
+            b = notify.SocketBus(directory)
+            received = Event()
+            seen = []
+
+            def callback(key, version):
+                seen.append((key, version))
+                received.set()
+
+            b.subscribe('G', callback)
+            b.subscribe('H', lambda *_: self.fail('Not subscribed'))
+            # A bad datagram is skipped, the listener keeps going
+            with self.assertLogs('poison.notify', 'WARNING'):
+                a._sender.sendto(b'\xff:1', str(b.path))
+                a._sender.sendto(b'G:x', str(b.path))
+                a.publish('G', 7)
+                self.assertTrue(received.wait(2))
+            self.assertEqual(seen, [('G', 7)])
+
+            b.close()
+            a.publish('G', 8)
+            a.close()
+            self.assertEqual(list(Path(directory).glob('*.sock')), [])
+
+    def test_socket_bus_private_directory(self):
+        with TemporaryDirectory() as tmp, patch('tempfile.gettempdir', return_value=tmp):
+            bus = notify.SocketBus()
+            try:
+                self.assertEqual(bus.directory, Path(tmp) / f'poison-notify-{os.getuid()}')
+                self.assertEqual(bus.directory.stat().st_mode & 0o777, 0o700)
+            finally:
+                bus.close()
+            bus.directory.chmod(0o777)
+            with self.assertRaises(PermissionError):
+                notify.SocketBus()
+
+        with self.assertRaises(TypeError):
+            notify.Bus()
+
+
+class DeckFieldTests(TestCase):
+    def test_packed_storage(self):
+        g, p1, _ = GamePlayTests._create_game()
+        self.assertEqual(unpack_deck(pack_deck('ahqcxh')), 'ahqcxh')
+
+        g = Game.objects.get(pk=g.key)
+        packed = g.__dict__['center_pile']
+        self.assertIsInstance(packed, (bytes, memoryview))
+        self.assertEqual(len(g.center_pile), 2 * len(packed))
+        self.assertIsInstance(g.__dict__['center_pile'], str)
+        self.assertIs(Card.get_deck(g.center_deck)[0], Card.get_deck(g.center_deck)[0])
+
+        raw = GamePlayer.objects.filter(pk=p1.pk).values_list('cards', flat=True).get()
+        self.assertEqual(bytes(raw), pack_deck(p1.cards))
+        self.assertEqual(len(raw), len(p1.cards) // 2)
+
+
+class SeatSummaryTests(TestCase):
+    def test_seats_follow_hands(self):
+        g, p1, p2 = GamePlayTests._create_game()
+        g = Game.objects.get(pk=g.key)
+        self.assertEqual(g.seats, [{'name': 'Ben', 'hand': 7}, {'name': 'Anna', 'hand': 7}])
+        self.assertIsNone(g.last_actor)
+
+        g.left_deck = 'as'
+        g.save()
+        p1.cards = '2s' + p1.cards[2:]
+        p1.save()
+        game.perform_action(g.key, p1.player.key, GameAction.Type.CardPlayed, {'card': '2s', 'side': 'left'})
+
+        with self.assertNumQueries(1):
+            state = Game.objects.get(pk=g.key)
+            self.assertEqual(state.seats, [{'name': 'Ben', 'hand': 6}, {'name': 'Anna', 'hand': 9}])
+            self.assertEqual(state.last_actor, 0)
+
+
+class CenterDeckTests(TestCase):
+    def test_draws_move_offset(self):
+        g, p1, p2 = GamePlayTests._create_game()
+        g = Game.objects.get(pk=g.key)
+        pile = g.center_pile
+        self.assertEqual(g.center_offset, 14)
+        self.assertEqual(p1.cards + p2.cards, ''.join(
+            pile[i:i+2] for i in [*range(0, 28, 4), *range(2, 28, 4)]
+        ))
+
+        game.perform_action(g.key, p1.player.key, GameAction.Type.CardDrawn, {})
+        g = Game.objects.get(pk=g.key)
+        self.assertEqual(g.center_pile, pile)
+        self.assertEqual(g.center_offset, 15)
+        self.assertEqual(g.center_count, len(g.center_deck) // 2)
+        self.assertEqual(GamePlayer.objects.get(pk=p1.pk).cards[-2:], pile[28:30])
+
+        def updates(g):
+            with CaptureQueriesContext(connection) as queries:
+                g.save()
+            return [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+
+        g.take_center(1)
+        self.assertNotIn('center_pile', updates(g)[0])
+        g.center_deck = g.center_deck
+        self.assertIn('center_pile', updates(g)[0])
+        self.assertNotIn('center_pile', updates(g)[0])
+        self.assertEqual(Game.objects.get(pk=g.key).center_offset, 0)
+
+        g.center_deck = g.center_deck[-2:]
+        g.left_deck = '2d5c'
+        actions._draw_cards(g, p2, 2)
+        self.assertEqual(g.center_offset, 2)
+        self.assertEqual(g.center_count, 0)
+        self.assertEqual(g.left_deck, '2d')
+
+
+class TurnTimeoutTests(TestCase):
+    def test_scheduler_order(self):
+        fired = []
+        done = Event()
+
+        def expire(key, version):
+            fired.append((key, version))
+            if len(fired) == 2:
+                done.set()
+
+        scheduler = turns.TurnScheduler(expire, workers=1)
+        scheduler.start()
+        try:
+            now = time()
+            scheduler.schedule('B', 1, now + 0.06)
+            scheduler.schedule('A', 1, now + 0.03)
+            scheduler.schedule('A', 2, now + 0.09)
+            scheduler.schedule('A', 1, now)
+            self.assertTrue(done.wait(2))
+        finally:
+            scheduler.close()
+        self.assertEqual(fired, [('B', 1), ('A', 2)])
+        self.assertEqual(scheduler.pending(), 0)
+
+    @override_settings(POISON_TURN_TIMEOUT=30)
+    def test_timeout_draws_and_passes(self):
+        g, p1, _ = GamePlayTests._create_game()
+        g = Game.objects.get(pk=g.key)
+        self.assertGreater(g.turn_deadline, timezone.now())
+
+        self.assertIsNone(game.timeout_turn(g.key, g.version))
+        Game.objects.filter(pk=g.key).update(turn_deadline=timezone.now())
+        self.assertIsNone(game.timeout_turn(g.key, g.version - 1))
+
+        timed_out = game.timeout_turn(g.key, g.version)
+        self.assertEqual(timed_out.turn, 1)
+        self.assertEqual(timed_out.version, g.version + 1)
+        self.assertEqual(timed_out.seats[0]['hand'], 8)
+        self.assertGreater(timed_out.turn_deadline, timezone.now())
+        self.assertEqual(len(GamePlayer.objects.get(pk=p1.pk).cards), 16)
+        self.assertIsNone(game.timeout_turn(g.key, g.version))
+
+        # Nothing left to draw: the turn still passes, and the log says so
+        Game.objects.filter(pk=g.key).update(
+            center_pile=b'', center_offset=0, left_deck=pack_deck('as'), right_deck=pack_deck('ks'),
+            turn_deadline=timezone.now()
+        )
+        timed_out = game.timeout_turn(g.key, timed_out.version)
+        self.assertEqual(timed_out.turn, 0)
+        entry = actionlog.since(g.key)[0][-1]
+        self.assertEqual((entry['seat'], entry['timeout'], entry['drew'], entry['hands'], entry['turn']), (1, True, False, {}, 0))
+
+    @override_settings(POISON_TURN_TIMEOUT=30)
+    def test_timeout_loses_to_concurrent_move(self):
+        g, p1, _ = GamePlayTests._create_game()
+        Game.objects.filter(pk=g.key).update(turn_deadline=timezone.now())
+        g = Game.objects.get(pk=g.key)
+        actions_before = GameAction.objects.filter(game=g).count()
+
+        # The player's draw is saved after the timeout read the game but before it saved
+        save = Game.save_if_version
+
+        def moved_first(self, version):
+            Game.objects.filter(pk=self.pk).update(version=version + 1)
+            return save(self, version)
+        with patch.object(Game, 'save_if_version', moved_first):
+            self.assertIsNone(game.timeout_turn(g.key, g.version))
+        self.assertEqual(Game.objects.get(pk=g.key).turn, 0)
+        self.assertEqual(len(GamePlayer.objects.get(pk=p1.pk).cards), 14)
+        self.assertEqual(GameAction.objects.filter(game=g).count(), actions_before)
+
+    def test_moves_retry_after_losing_the_save(self):
+        g, p1, _ = GamePlayTests._create_game()
+        save = Game.save_if_version
+        misses = []
+
+        def once_stale(self, version):
+            if not misses:
+                misses.append(version)
+                return False
+            return save(self, version)
+        with patch.object(Game, 'save_if_version', once_stale):
+            g = game.perform_action(g.key, p1.player.key, GameAction.Type.CardDrawn, {})
+        self.assertEqual(misses, [g.version - 1])
+        self.assertEqual(GameAction.objects.filter(game=g, action=GameAction.Type.CardDrawn).count(), 1)
+
+        with patch.object(Game, 'save_if_version', return_value=False):
+            with self.assertRaises(GameChangedException):
+                game.perform_action(g.key, p1.player.key, GameAction.Type.CardDrawn, {})
+
+    def test_join_and_start_lose_to_concurrent_changes(self):
+        host, guest, late = [Player.objects.create(name=n) for n in ('Ben', 'Anna', 'Tom')]
+        g = game.create_game(host.key)
+        game.join_game(g.key, guest.key)
+        save = Game.save_if_version
+
+        def changed_first(self, version):
+            Game.objects.filter(pk=self.pk).update(version=version + 1)
+            return save(self, version)
+        with patch.object(Game, 'save_if_version', changed_first):
+            with self.assertRaises(GameChangedException):
+                game.join_game(g.key, late.key)
+            with self.assertRaises(GameChangedException):
+                game.start_game(g.key, host.key)
+        g = Game.objects.get(pk=g.key)
+        self.assertEqual((g.turn, len(g.seats)), (-1, 2))
+        self.assertEqual(GamePlayer.objects.filter(game=g).count(), 2)
+        self.assertEqual(GamePlayer.objects.get(game=g, index=0).cards, '')
+
+    def test_scheduler_waits_for_a_timeout_setting(self):
+        from django.core.signals import request_started
+
+        with patch('poison.turns.scheduler') as start:
+            turns.start_on_request()
+            start.assert_not_called()
+            self.assertIn(turns.start_on_request, [r[1]() for r in request_started.receivers])
+
+
+class MatchmakingTests(TestCase):
+    def test_batches_into_tables(self):
+        players = [Player.objects.create(name=f'P{i}') for i in range(9)]
+        for p in players:
+            response = self.client.post(reverse('enqueue'), {'player_id': p.key}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(matchmaking.enqueue(players[-1].key).pk, response.json()['ticket'])
+
+        # One full table, the other three wait for more players until they have waited long enough
+        # The same handful of queries however many tables a round forms
+        with self.assertNumQueries(8):
+            games = matchmaking.match()
+        self.assertEqual([len(g.seats) for g in games], [6])
+        MatchTicket.objects.filter(game=None).update(created=timezone.now() - timedelta(minutes=1))
+        games += matchmaking.match()
+        self.assertEqual([len(g.seats) for g in games], [6, 3])
+
+        g = Game.objects.get(pk=games[1].key)
+        self.assertEqual(g.turn, 0)
+        self.assertEqual([s['name'] for s in g.seats], ['P6', 'P7', 'P8'])
+        self.assertEqual(GamePlayer.objects.filter(game=g).count(), 3)
+
+        status = self.client.post(reverse('match_status'), {'player_id': players[7].key}, content_type='application/json').json()
+        self.assertEqual((status['matched'], status['game_id'], status['player_index']), (True, g.key, 1))
+        state = self.client.post(reverse('poll_game'), {'token': status['token']}, content_type='application/json').json()
+        self.assertEqual(len(state['cards']), 14)
+
+        self.assertFalse(matchmaking.match())
+        ticket = matchmaking.enqueue(players[7].key)
+        self.assertIsNone(ticket.game)
+        self.assertEqual(matchmaking.status(players[7].key), ticket)
+
+
+    def test_overlapping_matchers(self):
+        players = [Player.objects.create(name=f'P{i}') for i in range(6)]
+        tickets = [matchmaking.enqueue(p.key) for p in players]
+        other = game.create_game(players[0].key)
+        tables = matchmaking._tables
+
+        def claimed_meanwhile(waiting, max_wait, now):
+            # Another matcher seats one of the players while this round is working
+            MatchTicket.objects.filter(pk=tickets[3].pk).update(game=other, seat=0)
+            return tables(waiting, max_wait, now)
+        conflicts = metrics.match_conflicts.values().get((), 0)
+        with patch('poison.matchmaking._tables', claimed_meanwhile):
+            self.assertEqual(matchmaking.match(), [])
+        # The whole round is rolled back, here along with the other matcher's write
+        self.assertEqual(Game.objects.count(), 1)
+        self.assertEqual(GamePlayer.objects.count(), 1)
+        self.assertEqual(metrics.match_conflicts.values()[()], conflicts + 1)
+        self.assertEqual([len(g.seats) for g in matchmaking.match()], [6])
+
+
+class LobbyTests(TestCase):
+    def test_keyset_pages(self):
+        players = [Player.objects.create(name=f'P{i}') for i in range(7)]
+        games = [game.create_game(p.key) for p in players[:5]]
+        game.join_game(games[1].key, players[5].key)
+        game.start_game(games[1].key, players[1].key)
+        game.join_game(games[3].key, players[6].key)
+        self.assertEqual(Game.objects.get(pk=games[3].key).open_seats, 4)
+        self.assertEqual(Game.objects.get(pk=games[1].key).open_seats, 0)
+
+        seen = []
+        cursor = None
+        while True:
+            body = {'limit': 2} if cursor is None else {'limit': 2, 'cursor': cursor}
+            page = self.client.post(reverse('list_games'), body, content_type='application/json').json()
+            seen.extend(page['games'])
+            cursor = page['next']
+            if cursor is None:
+                break
+            # Games created after the listing started do not shift later pages
+            game.create_game(players[6].key)
+
+        self.assertEqual([g['key'] for g in seen], [g.key for g in reversed(games) if g.key != games[1].key])
+        self.assertEqual(seen[0]['players'], ['P4'])
+        self.assertEqual(seen[1]['players'], ['P3', 'P6'])
+
+
+class PlayerStatsTests(TestCase):
+    def test_incremental_and_backfill(self):
+        g, p1, p2 = GamePlayTests._create_game()
+        g.left_deck = 'as'
+        g.save()
+        p1.cards = '2s'
+        p1.save()
+        g = game.perform_action(g.key, p1.player.key, GameAction.Type.CardPlayed, {'card': '2s', 'side': 'left'})
+        game.perform_action(g.key, p2.player.key, GameAction.Type.PoisonCalled, {})
+        self.assertEqual(g.winner, 0)
+
+        def totals():
+            return {
+                gp.player.name: (s.games_played, s.wins, s.cards_played, s.poison_calls)
+                for gp in (p1, p2) for s in [stats.get(gp.player_id)]
+            }
+
+        expected = {'Ben': (1, 1, 1, 0), 'Anna': (1, 0, 0, 1)}
+        self.assertEqual(totals(), expected)
+        with self.assertNumQueries(1):
+            stats.get(p1.player_id)
+
+        response = self.client.post(reverse('player_stats'), {'player_id': p2.player_id}, content_type='application/json')
+        self.assertEqual(response.json(), {'games_played': 1, 'wins': 0, 'cards_played': 0, 'poison_calls': 1})
+
+        PlayerStats.objects.all().delete()
+        call_command('backfill_stats', stdout=StringIO())
+        self.assertEqual(totals(), expected)
+        call_command('backfill_stats', chunk_size=1, stdout=StringIO())
+        self.assertEqual(totals(), expected)
+
+    def test_fill_winners_uses_action_order(self):
+        from django.apps import apps
+        from importlib import import_module
+
+        g, p1, p2 = GamePlayTests._create_game()
+        for gp, index in ((p2, 0), (p1, 1)):
+            GameAction.objects.create(index=index, action=GameAction.Type.CardPlayed, game=g, player=gp, data='{}')
+            gp.cards = ''
+            gp.save()
+        import_module('poison.migrations.0011_player_stats').fill_winners(apps, None)
+        self.assertEqual(Game.objects.get(pk=g.key).winner, 1)
+
+
+class ExportTests(TestCase):
+    def test_streams_gzipped_history(self):
+        g, p1, _ = GamePlayTests._create_game()
+        for _ in range(3):
+            game.perform_action(g.key, p1.player.key, GameAction.Type.CardDrawn, {})
+
+        rows = list(export.rows('actions', game_ids=[g.key], chunk_size=2))
+        self.assertEqual([r['index'] for r in rows], [0, 1, 2])
+        self.assertEqual(rows[0]['action'], 'CardDrawn')
+        self.assertEqual(rows[0]['player_key'], p1.player_id)
+
+        self.assertEqual(self.client.get(reverse('export')).status_code, 403)
+        User.objects.create_user('data', password='pw', is_staff=True)
+        self.client.login(username='data', password='pw')
+        response = self.client.get(reverse('export'), {'kind': 'games', 'game': g.key})
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual([json.loads(line)['key'] for line in lines], [g.key])
+
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / 'actions.csv.gz'
+            call_command('export_history', 'actions', format='csv', output=str(path), stderr=StringIO())
+            with gzip.open(path, 'rt') as f:
+                exported = list(csv.DictReader(f))
+        self.assertEqual([r['index'] for r in exported], ['0', '1', '2'])
+        self.assertEqual(exported[2]['seat'], '0')
+
+
+@override_settings(POISON_REPLICA='default', DATABASE_ROUTERS=['poison.replicas.ReplicaRouter'])
+class ReplicaTests(TestCase):
+    def test_falls_back_when_behind(self):
+        g, p1, _ = GamePlayTests._create_game()
+        fallbacks = metrics.replica_fallbacks.value()
+
+        def poll(**body):
+            body.update(player_id=p1.player_id, game_id=g.key)
+            return self.client.post(reverse('poll_game'), body, content_type='application/json').json()
+
+        self.assertEqual(poll(min_version=g.version)['version'], g.version)
+        self.assertEqual(metrics.replica_fallbacks.value(), fallbacks)
+        # The stand-in replica is the primary, so asking for a later version always falls back
+        poll(min_version=g.version + 1)
+        self.assertEqual(metrics.replica_fallbacks.value(), fallbacks + 1)
+
+        loads = []
+
+        def load():
+            loads.append(replicas._replica_reads.get())
+            return {'version': g.version - len(loads) % 2}
+        self.assertEqual(replicas.read_state(load, g.version)['version'], g.version)
+        self.assertEqual(loads, [True, False])
+
+
+@override_settings(POISON_SHARED_STATE=f'poison-test-{os.getpid()}', POISON_SHARED_STATE_SLOTS=8)
+class HotStateTests(TestCase):
+    def tearDown(self):
+        hotstate.store().close(unlink=True)
+        hotstate._store = None
+
+    def test_polls_from_shared_memory(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            g, p1, p2 = GamePlayTests._create_game()
+            g = game.perform_action(g.key, p1.player.key, GameAction.Type.CardDrawn, {})
+
+        for gp in (p1, p2):
+            expected = Game.encode_game(g, gp.player_id)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    reverse('poll_game'), {'player_id': gp.player_id, 'game_id': g.key}, content_type='application/json'
+                )
+            self.assertEqual(response.json(), expected)
+            # Only the request's own savepoints
+            self.assertEqual([q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']], [])
+        self.assertIsNone(hotstate.read(g.key, p1.player_id, min_version=g.version + 1))
+
+        # An older version never replaces a newer one
+        store = hotstate.store()
+        record = store._read(g.key)
+        Game.objects.filter(pk=g.key).update(version=g.version - 1)
+        store.publish(g.key)
+        self.assertEqual(store._read(g.key), record)
+        store.invalidate(g.key)
+        self.assertIsNone(hotstate.read(g.key, p1.player_id))
+
+    def test_malformed_ids_go_to_the_database(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            g, p1, _ = GamePlayTests._create_game()
+        self.assertIsNone(hotstate.read(5, p1.player_id))
+        self.assertIsNone(hotstate.read('é', p1.player_id))
+        self.assertIsNone(hotstate.read(g.key, ['x']))
+        self.assertIsNone(hotstate.read(g.key, 'é'))
+        for body in ({'player_id': p1.player_id, 'game_id': 5}, {'player_id': p1.player_id, 'game_id': 'é'}):
+            response = self.client.post(reverse('poll_game'), body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_announced_after_saving(self):
+        # Outside a transaction the hooks run at once, so they must see the saved game
+        with patch('poison.game.transaction.on_commit', lambda f: f()):
+            g, p1, p2 = GamePlayTests._create_game()
+        state = hotstate.read(g.key, p2.player_id)
+        self.assertEqual(state['version'], Game.objects.get(pk=g.key).version)
+        self.assertEqual(len(state['cards']), 14)
+
+    def test_old_records_are_refreshed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            g, p1, _ = GamePlayTests._create_game()
+        # An edit that goes around the game module
+        Game.objects.filter(pk=g.key).update(turn=1)
+        self.assertEqual(hotstate.read(g.key, p1.player_id)['turn'], 0)
+        with override_settings(POISON_SHARED_STATE_MAX_AGE=0):
+            self.assertEqual(hotstate.read(g.key, p1.player_id)['turn'], 1)
+        self.assertEqual(hotstate.read(g.key, p1.player_id)['turn'], 1)
+
+
+class AdminTests(TestCase):
+    def test_dashboard_and_changelists(self):
+        g, p1, _ = GamePlayTests._create_game()
+        for _ in range(3):
+            game.perform_action(g.key, p1.player.key, GameAction.Type.CardDrawn, {})
+        game.create_game(p1.player_id)
+        User.objects.create_superuser('ops', password='pw')
+        self.client.login(username='ops', password='pw')
+
+        response = self.client.get(reverse('admin:poison_dashboard'))
+        self.assertEqual(response.context['games'], {'lobby': 1, 'active': 1, 'finished': 0})
+        Game.objects.filter(pk=g.key).update(winner=0)
+        self.assertEqual(dashboard.games_by_state(), {'lobby': 1, 'active': 0, 'finished': 1})
+        Game.objects.filter(pk=g.key).update(winner=None)
+        self.assertEqual(sum(n for _, n in response.context['actions_per_minute']), 3)
+        self.assertEqual([r.key for r in response.context['longest_running']], [g.key])
+
+        def changelist_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(reverse('admin:poison_gameaction_changelist')).status_code, 200)
+            return len(queries)
+
+        queries = changelist_queries()
+        for _ in range(3):
+            game.perform_action(g.key, p1.player.key, GameAction.Type.CardDrawn, {})
+        self.assertEqual(changelist_queries(), queries)
+        self.assertEqual(self.client.get(reverse('admin:poison_game_changelist'), {'state': 'active'}).status_code, 200)
+
+
+class ActionLogTests(TestCase):
+    def test_sync_since_index(self):
+        g, p1, p2 = GamePlayTests._create_game()
+        g.left_deck = 'as'
+        p1.cards = '2s3h'
+        p1.save()
+        g.sync_hand(p1)
+        g.save()
+        game.perform_action(g.key, p1.player.key, GameAction.Type.CardPlayed, {'card': '2s', 'side': 'left'})
+        game.perform_action(g.key, p2.player.key, GameAction.Type.CardDrawn, {})
+
+        def sync(player, **body):
+            body.update(player_id=player.player_id, game_id=g.key)
+            return self.client.post(reverse('sync_actions'), body, content_type='application/json').json()
+
+        page = sync(p2, limit=1)
+        self.assertTrue(page['more'])
+        played = page['actions'][0]
+        self.assertEqual((played['index'], played['action'], played['seat']), (0, 'CardPlayed', 0))
+        self.assertEqual((played['card'], played['side']), ('2s', 'left'))
+        self.assertEqual((played['hands'], played['turn']), ({'0': -1, '1': 2}, 1))
+
+        page = sync(p1, after=0)
+        self.assertFalse(page['more'])
+        self.assertEqual([(a['action'], a['hands']) for a in page['actions']], [('CardDrawn', {'1': 1})])
+        self.assertNotIn('card', page['actions'][0])
+        self.assertEqual(sync(p1, after=1)['actions'], [])
+
+        outsider = Player.objects.create(name='Eve')
+        body = {'player_id': outsider.key, 'game_id': g.key}
+        self.assertEqual(self.client.post(reverse('sync_actions'), body, content_type='application/json').status_code, 400)
+
+
+class PollingTests(TestCase):
+    def test_delay_hints(self):
+        now = timezone.now()
+        self.assertEqual(polling.delay_ms(-1, None, 0, 2, now), polling.LOBBY_MS)
+        self.assertEqual(polling.delay_ms(0, None, 1, 3, now), polling.NEXT_MS)
+        self.assertEqual(polling.delay_ms(0, None, 2, 3, now), polling.WAITING_MS)
+        self.assertEqual(polling.delay_ms(0, 1, 2, 3, now), polling.FINISHED_MS)
+        self.assertEqual(polling.delay_ms(0, None, 2, 3, now - timedelta(seconds=65)), polling.WAITING_MS * 3)
+        self.assertEqual(polling.delay_ms(0, None, 2, 3, now - timedelta(hours=1)), polling.FINISHED_MS)
+
+        with override_settings(POISON_MAX_IN_FLIGHT=4):
+            ratelimit._enter()
+            try:
+                self.assertEqual(polling.delay_ms(0, None, 1, 3, now), polling.NEXT_MS)
+                for _ in range(3):
+                    ratelimit._enter()
+                self.assertEqual(polling.delay_ms(0, None, 1, 3, now), polling.NEXT_MS * 4)
+            finally:
+                for _ in range(4):
+                    ratelimit._exit()
+
+        g, p1, p2 = GamePlayTests._create_game()
+        body = {'player_id': p2.player_id, 'game_id': g.key}
+        response = self.client.post(reverse('poll_game'), body, content_type='application/json')
+        self.assertEqual(response.json()['poll_after_ms'], polling.NEXT_MS)
+
+
+class BotTests(TestCase):
+    def test_move_choice(self):
+        self.assertTrue(bots.poisonable('2h'))
+        self.assertTrue(bots.poisonable('2hah5h3s'))
+        self.assertFalse(bots.poisonable('2has5h'))
+        # 3h would leave three reds for the next seat to call poison on
+        self.assertEqual(bots.choose_move('3h3s', '2hah', '9c', 1), ('play', '3s', 'left'))
+        # Unless it is the last card
+        self.assertEqual(bots.choose_move('3h', '2hah', '9c', 1), ('play', '3h', 'left'))
+        self.assertEqual(bots.choose_move('9h5d', 'ks', 'js', 1), ('draw', None, None))
+
+    def test_bot_calls_poison_and_moves(self):
+        host = Player.objects.create(name='Ben')
+        g = game.create_game(host.key)
+        body = {'player_id': host.key, 'game_id': g.key}
+        response = self.client.post(reverse('add_bot'), body, content_type='application/json').json()
+        self.assertEqual(response['seats'][1], {'name': 'Bot 1', 'hand': 0, 'bot': True})
+        game.start_game(g.key, host.key)
+
+        g = Game.objects.get(pk=g.key)
+        h = GamePlayer.objects.get(game=g, index=0)
+        g.left_deck = 'ah5h'
+        h.cards = '2h3h'
+        h.save()
+        g.sync_hand(h)
+        g.save()
+        self.assertFalse(bots.act(g.key))
+        game.perform_action(g.key, host.key, GameAction.Type.CardPlayed, {'card': '2h', 'side': 'left'})
+
+        self.assertTrue(bots.act(g.key))
+        called = GameAction.objects.filter(game=g).first()
+        self.assertEqual((called.action, called.player.index), (GameAction.Type.PoisonCalled, 1))
+        self.assertEqual(len(GamePlayer.objects.get(pk=h.pk).cards), 8)
+
+        self.assertTrue(bots.act(g.key))
+        moved = GameAction.objects.filter(game=g).first()
+        self.assertEqual((moved.index, moved.player.index), (2, 1))
+
+    def test_bot_moves_need_their_version(self):
+        host = Player.objects.create(name='Ben')
+        g = game.create_game(host.key)
+        bots.add_bot(g.key, host.key)
+        game.start_game(g.key, host.key)
+        players = Player.objects.count()
+        with self.assertRaises(GameAlreadStartedException):
+            bots.add_bot(g.key, host.key)
+        self.assertEqual(Player.objects.count(), players)
+
+        g = Game.objects.get(pk=g.key)
+        bot = GamePlayer.objects.get(game=g, index=1)
+        with self.assertRaises(GameChangedException):
+            game.perform_action(g.key, host.key, GameAction.Type.CardDrawn, {}, version=g.version - 1)
+        g.version -= 1
+        bots._perform(g, bot, GameAction.Type.PoisonCalled, {})
+        self.assertFalse(GameAction.objects.filter(game=g).exists())
+
+    def test_stuck_bot_passes(self):
+        host = Player.objects.create(name='Ben')
+        g = game.create_game(host.key)
+        bots.add_bot(g.key, host.key)
+        game.start_game(g.key, host.key)
+
+        g = Game.objects.get(pk=g.key)
+        h, bot = GamePlayer.objects.filter(game=g).order_by('index')
+        g.turn = 1
+        g.center_deck = ''
+        g.left_deck, g.right_deck = 'ks', 'js'
+        bot.cards = '9h'
+        h.cards = 'qs'
+        for gp in (h, bot):
+            gp.save()
+            g.sync_hand(gp)
+        g.save()
+        self.assertTrue(bots.act(g.key))
+        self.assertEqual(Game.objects.get(pk=g.key).turn, 0)
+        passed = actionlog.since(g.key)[0][-1]
+        self.assertEqual((passed['action'], passed['seat'], passed['drew'], passed['turn']), ('CardDrawn', 1, False, 0))
+
+        # Nobody can move at all
+        Game.objects.filter(pk=g.key).update(turn=1)
+        GamePlayer.objects.filter(pk=h.pk).update(cards=pack_deck('5d'))
+        self.assertFalse(bots.act(g.key))
+        self.assertEqual(Game.objects.get(pk=g.key).turn, 1)
+
+    def test_pool_coalesces(self):
+        started, release, done = Event(), Event(), Event()
+        calls = []
+
+        def act(key):
+            calls.append(key)
+            if len(calls) == 1:
+                started.set()
+                release.wait(2)
+            if len(calls) == 3:
+                done.set()
+
+        pool = bots.BotPool(act, workers=2)
+        pool.start()
+        try:
+            pool.wake('A')
+            self.assertTrue(started.wait(2))
+            # Woken while running: runs once more afterwards, never alongside itself
+            pool.wake('A')
+            pool.wake('A')
+            pool.wake('B')
+            release.set()
+            self.assertTrue(done.wait(2))
+        finally:
+            pool.close()
+        self.assertEqual(sorted(calls), ['A', 'A', 'B'])
+
+    @override_settings(POISON_BOT_PROCESSES=2)
+    def test_processes_start_with_the_first_bot_game(self):
+        from django.apps import apps
+        with patch.object(bots, 'ProcessPoolExecutor') as executor, patch.object(bots, '_processes', None), \
+                patch.object(bots, 'pool'):
+            apps.get_app_config('poison').ready()
+            executor.assert_not_called()
+            bots.wake('A')
+            executor.assert_called_once_with(2)
+
+
+class ClientTests(TestCase):
+    def test_fingerprinted_precompressed_assets(self):
+        with TemporaryDirectory() as directory:
+            build = Path(directory) / 'build'
+            (build / 'static' / 'js').mkdir(parents=True)
+            (build / 'index.html').write_text(
+                '<link rel="icon" href="/client/favicon.ico"><script src="/client/static/js/main.0123abcd.js"></script>'
+            )
+            (build / 'favicon.ico').write_bytes(b'icon')
+            (build / 'robots.txt').write_text('User-agent: *')
+            (build / 'manifest.json').write_text('{"icons": [{"src": "favicon.ico"}], "name": "favicon.ico app"}')
+            (build / 'static' / 'js' / 'chunk.js').write_text('fetch("../../favicon.ico"); fetch("./favicon.ico")')
+            (build / 'static' / 'js' / 'main.0123abcd.js').write_text('console.log("poison");' * 50)
+
+            output = Path(directory) / 'client'
+            call_command('collect_client', build=str(build), output=str(output), stdout=StringIO())
+            index_html = (output / 'index.html').read_text()
+            icon = re.search(r'/client/(favicon\.[0-9a-f]{12}\.ico)', index_html).group(1)
+            self.assertIn('/client/static/js/main.0123abcd.js', index_html)
+            self.assertTrue((output / 'static' / 'js' / 'main.0123abcd.js.gz').is_file())
+
+            # Relative references are rewritten, and everything is still there under its own name
+            manifest = json.loads((output / 'manifest.json').read_text())
+            self.assertEqual(manifest, {'icons': [{'src': icon}], 'name': 'favicon.ico app'})
+            chunk = next((output / 'static' / 'js').glob('chunk.*.js')).read_text()
+            self.assertEqual(chunk, f'fetch("../../{icon}"); fetch("./favicon.ico")')
+            self.assertEqual((output / 'robots.txt').read_text(), 'User-agent: *')
+            self.assertEqual((output / 'favicon.ico').read_bytes(), b'icon')
+
+            with override_settings(POISON_CLIENT_DIR=output):
+                response = self.client.get('/client/static/js/main.0123abcd.js', HTTP_ACCEPT_ENCODING='br, gzip')
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertIn('immutable', response['Cache-Control'])
+                self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'console.log("poison");' * 50)
+                response.close()
+
+                response = self.client.get(f'/client/{icon}')
+                self.assertEqual(b''.join(response.streaming_content), b'icon')
+                self.assertNotIn('Content-Encoding', response)
+                response.close()
+
+                response = self.client.get(reverse('index'))
+                self.assertEqual(response['Cache-Control'], 'no-cache')
+                response.close()
+                response = self.client.get('/client/robots.txt')
+                self.assertEqual(response['Cache-Control'], 'no-cache')
+                response.close()
+                self.assertEqual(self.client.get('/client/../db.sqlite3').status_code, 404)
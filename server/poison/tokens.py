@@ -0,0 +1,69 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import NamedTuple, Optional
+
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .exceptions import InvalidTokenException
+
+# Tokens are '<payload>.<signature>' where the payload is 'player|game|seat' and the signature is
+# an HMAC keyed from SECRET_KEY. A valid token proves identity and seat without touching the
+# database, and cannot be produced by guessing player keys
+
+SALT = 'poison.tokens'
+
+
+class PlayerToken(NamedTuple):
+    player_id: str
+    game_id: Optional[str]
+    seat: Optional[int]
+
+
+def _b64(data):
+    # type: (bytes) -> str
+    return urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _unb64(data):
+    # type: (str) -> bytes
+    return urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(payload):
+    # type: (str) -> str
+    return _b64(salted_hmac(SALT, payload, algorithm='sha256').digest())
+
+
+def issue(player_id, game_id=None, seat=None):
+    # type: (str, Optional[str], Optional[int]) -> str
+    payload = _b64(f'{player_id}|{game_id or ""}|{"" if seat is None else seat}'.encode('utf-8'))
+    return f'{payload}.{_sign(payload)}'
+
+
+def _decode(payload):
+    # type: (str) -> PlayerToken
+    player_id, game_id, seat = _unb64(payload).decode('utf-8').split('|')
+    return PlayerToken(player_id, game_id or None, int(seat) if seat else None)
+
+
+def peek(token):
+    # type: (str) -> Optional[PlayerToken]
+    """Reads a token without checking its signature, for routing only"""
+
+    try:
+        return _decode(token.split('.')[0])
+    except (AttributeError, ValueError):
+        return None
+
+
+def verify(token):
+    # type: (str) -> PlayerToken
+    if not isinstance(token, str) or token.count('.') != 1:
+        raise InvalidTokenException()
+    payload, signature = token.split('.')
+    if not constant_time_compare(signature, _sign(payload)):
+        raise InvalidTokenException()
+
+    try:
+        return _decode(payload)
+    except ValueError:
+        raise InvalidTokenException()
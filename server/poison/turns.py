@@ -0,0 +1,141 @@
+from concurrent.futures import ThreadPoolExecutor
+from heapq import heappop, heappush
+from threading import Condition, Lock, Thread
+from time import time
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DatabaseError, close_old_connections
+
+# Turn deadlines. Every change to a started game gives the seat to move POISON_TURN_TIMEOUT seconds
+# (Game.turn_deadline), and one scheduler per process keeps all pending deadlines in a heap served by
+# a single timer thread. A deadline only fires if the game is still at the version that set it, so
+# superseded entries cost nothing but their heap slot. Deadlines are read back from the database
+# when the scheduler starts. Firing the same deadline in several processes is harmless, since the
+# expiry saves the game with an UPDATE conditional on that same version and only one of them matches
+
+logger = logging.getLogger('poison.turns')
+
+Expire = Callable[[str, int], object]
+
+
+class TurnScheduler:
+    def __init__(self, expire, workers=4):
+        # type: (Expire, int) -> None
+        self.expire = expire
+        self._heap = [] # type: List[Tuple[float, str, int]]
+        self._latest = {} # type: Dict[str, int]
+        self._cond = Condition()
+        self._closed = False
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='poison-turns')
+        self._thread = Thread(target=self._run, name='poison-turn-timer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def schedule(self, key, version, deadline):
+        # type: (str, int, float) -> None
+        with self._cond:
+            if self._latest.get(key, -1) > version:
+                return
+            self._latest[key] = version
+            heappush(self._heap, (deadline, key, version))
+            if self._heap[0][1] == key:
+                self._cond.notify()
+
+    def cancel(self, key):
+        # type: (str) -> None
+        with self._cond:
+            self._latest.pop(key, None)
+
+    def pending(self):
+        # type: () -> int
+        with self._cond:
+            return len(self._latest)
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, key, version = self._heap[0]
+                delay = deadline - time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heappop(self._heap)
+                if self._latest.get(key) != version:
+                    continue
+                del self._latest[key]
+                self._pool.submit(self._fire, key, version)
+
+    def _fire(self, key, version):
+        # type: (str, int) -> None
+        close_old_connections()
+        try:
+            self.expire(key, version)
+        except Exception:
+            logger.exception('Turn timeout failed for %s', key)
+        finally:
+            close_old_connections()
+
+    def load(self):
+        """Schedules the deadlines stored on games, e.g. after a restart"""
+
+        from .models import Game
+
+        close_old_connections()
+        try:
+            stored = Game.objects.filter(turn_deadline__isnull=False).values_list('key', 'version', 'turn_deadline')
+            for key, version, deadline in stored.iterator():
+                self.schedule(key, version, deadline.timestamp())
+        except DatabaseError:
+            logger.exception('Could not load turn deadlines')
+        finally:
+            close_old_connections()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(1)
+        self._pool.shutdown(wait=False)
+
+
+def timeout():
+    # type: () -> Optional[float]
+    return getattr(settings, 'POISON_TURN_TIMEOUT', None)
+
+
+_scheduler = None # type: Optional[TurnScheduler]
+_scheduler_lock = Lock()
+
+
+def scheduler():
+    # type: () -> TurnScheduler
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                from .game import timeout_turn
+
+                _scheduler = TurnScheduler(timeout_turn, getattr(settings, 'POISON_TURN_WORKERS', 4))
+                _scheduler.start()
+                _scheduler._pool.submit(_scheduler.load)
+    return _scheduler
+
+
+def schedule(key, version, deadline):
+    # type: (str, int, float) -> None
+    scheduler().schedule(key, version, deadline)
+
+
+def start_on_request(**kwargs):
+    # Serving processes start the scheduler with their first request, so stored deadlines resume
+    # after a restart without management commands ever starting it
+    if timeout():
+        scheduler()
+        request_started.disconnect(start_on_request)
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 
 urlpatterns = [
@@ -9,6 +9,18 @@ urlpatterns = [
     path('create_game', views.create_game, name='create_game'),
     path('join_game', views.join_game, name='join_game'),
     path('start_game', views.start_game, name='start_game'),
+    path('add_bot', views.add_bot, name='add_bot'),
     path('poll_game', views.poll_game, name='poll_game'),
     path('perform_action', views.perform_action, name='perform_action'),
+    path('sync_actions', views.sync_actions, name='sync_actions'),
+    path('list_games', views.list_games, name='list_games'),
+    path('player_stats', views.player_stats, name='player_stats'),
+    path('enqueue', views.enqueue, name='enqueue'),
+    path('match_status', views.match_status, name='match_status'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('export', views.export_view, name='export'),
+    path('async/create_game', async_views.create_game, name='async_create_game'),
+    path('async/join_game', async_views.join_game, name='async_join_game'),
+    path('async/poll_game', async_views.poll_game, name='async_poll_game'),
+    path('async/perform_action', async_views.perform_action, name='async_perform_action'),
 ]
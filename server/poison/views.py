@@ -1,34 +1,112 @@
+from time import perf_counter
+import asyncio
+
 from django.core.exceptions import BadRequest
-from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.http import Http404, HttpRequest, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 
 from .exceptions import PoisonException
 from .messages import (
+    AddBotRequest,
     CreateGameRequest,
     CreatePlayerRequest,
+    EnqueueRequest,
     JoinGameRequest,
+    ListGamesRequest,
+    MatchStatusRequest,
     PerformActionRequest,
+    PlayerStatsRequest,
     PollGameRequest,
-    StartGameRequest
+    StartGameRequest,
+    SyncActionsRequest
 )
 from .models import Game, Player
-from . import game
+from .ratelimit import admission
+from . import actionlog, game, hotstate, metrics, ratelimit, replicas, stats, tokens
+
+# Modules poll_game never needs (the client, export, bots, the lobby and matchmaking) are imported in
+# their views, so a worker that only serves polls does not load them
 
 
 def error_handler(f):
+    if asyncio.iscoroutinefunction(f):
+        view = f'async_{f.__name__}'
+
+        async def async_wrapper(*args):
+            start = perf_counter()
+            try:
+                return await f(*args)
+            except PoisonException as e:
+                metrics.errors.inc(e.code)
+                return e.to_response()
+            finally:
+                metrics.requests.observe(perf_counter() - start, view)
+        return async_wrapper
+
     def wrapper(*args):
+        start = perf_counter()
         try:
             return f(*args)
         except PoisonException as e:
+            metrics.errors.inc(e.code)
             return e.to_response()
+        finally:
+            metrics.requests.observe(perf_counter() - start, f.__name__)
     return wrapper
 
 
+def with_token(state):
+    # type: (dict) -> dict
+    state['token'] = tokens.issue(state['player_key'], state['key'], state['player_index'])
+    return state
+
+
 def index(request):
     # type: (HttpRequest) -> HttpResponse
-    return HttpResponse("Web-app here")
+    from . import client
+
+    return client.serve(request, client.ENTRY) or HttpResponse("Web-app here")
+
+
+def client_asset(request, path):
+    # type: (HttpRequest, str) -> HttpResponse
+    from . import client
+
+    response = client.serve(request, path)
+    if response is None:
+        raise Http404(path)
+    return response
+
+
+def metrics_view(request):
+    # type: (HttpRequest) -> HttpResponse
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def export_view(request):
+    # type: (HttpRequest) -> HttpResponse
+    from . import export
+
+    # No user at all when auth is not installed, as in the API-only profile
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_staff:
+        return HttpResponseForbidden()
+
+    kind = request.GET.get('kind', 'actions')
+    fmt = request.GET.get('format', 'ndjson')
+    export.check(kind, fmt)
+    rows = export.rows(
+        kind,
+        export.parse_time(request.GET.get('since')),
+        export.parse_time(request.GET.get('until')),
+        request.GET.getlist('game'),
+    )
+    response = StreamingHttpResponse(export.gzipped(export.encode(kind, fmt, rows)), content_type='application/gzip')
+    response['Content-Disposition'] = f'attachment; filename="poison-{kind}.{fmt}.gz"'
+    return response
 
 
 @error_handler
+@admission
 def create_player(request):
     # type: (HttpRequest) -> JsonResponse
 
@@ -36,54 +114,162 @@ def create_player(request):
     player = Player(name=req.name)
     player.save()
 
-    return JsonResponse({'id': player.key})
+    return JsonResponse({'id': player.key, 'token': tokens.issue(player.key)})
 
 
 @error_handler
+@admission
 def create_game(request):
     # type: (HttpRequest) -> JsonResponse
 
     req = CreateGameRequest(request.body)
     g = game.create_game(req.player_id)
     
-    return JsonResponse(game.encode_game(g, req.player_id))
+    return JsonResponse(with_token(Game.encode_game(g, req.player_id)))
 
 
 @error_handler
+@admission
 def join_game(request):
     # type: (HttpRequest) -> JsonResponse
 
     req = JoinGameRequest(request.body)
     g = game.join_game(req.game_id, req.player_id)
-    return JsonResponse(game.encode_game(g, req.player_id))
+    return JsonResponse(with_token(Game.encode_game(g, req.player_id)))
 
 
 @error_handler
+@admission
 def start_game(request):
     # type: (HttpRequest) -> JsonResponse
 
     req = StartGameRequest(request.body)
-    g = game.start_game(req.game_id, req.player_id)
-    return JsonResponse(game.encode_game(g, req.player_id))
+    g = game.start_game(req.game_id, req.player_id, req.seat)
+    return JsonResponse(Game.encode_game(g, req.player_id, req.seat))
+
+
+@error_handler
+@admission
+def add_bot(request):
+    # type: (HttpRequest) -> JsonResponse
+
+    from . import bots
+
+    req = AddBotRequest(request.body)
+    g = bots.add_bot(req.game_id, req.player_id, req.seat)
+    return JsonResponse(Game.encode_game(g, req.player_id, req.seat))
 
 
 @error_handler
+@admission
 def poll_game(request):
     # type: (HttpRequest) -> JsonResponse
 
     req = PollGameRequest(request.body)
-    try:
-        g = Game.objects.get(pk=req.game_id)
-    except Exception:
-        raise BadRequest(f'Bad game id: {req.game_id}')
+    ratelimit.consume('poll_game', req.player_id, req.game_id)
+    state = hotstate.read(req.game_id, req.player_id, req.seat, req.min_version)
+    if state is not None:
+        return JsonResponse(state)
+
+    def load():
+        try:
+            g = Game.objects.get(pk=req.game_id)
+        except Exception:
+            raise BadRequest(f'Bad game id: {req.game_id}')
+        return Game.encode_game(g, req.player_id, req.seat)
+
+    return JsonResponse(replicas.read_state(load, req.min_version))
+
 
-    return JsonResponse(game.encode_game(g, req.player_id))
+@error_handler
+@admission
+def sync_actions(request):
+    # type: (HttpRequest) -> JsonResponse
+
+    req = SyncActionsRequest(request.body)
+    ratelimit.consume('sync_actions', req.player_id, req.game_id)
+    if req.seat is None:
+        try:
+            game.find_seat(req.game_id, req.player_id)
+        except Exception:
+            raise BadRequest(f'Invalid player id: {req.player_id}')
+    actions, more = actionlog.since(req.game_id, req.after, req.limit)
+    return JsonResponse({'actions': actions, 'more': more})
 
 
 @error_handler
+@admission
 def perform_action(request):
     # type: (HttpRequest) -> JsonResponse
 
     req = PerformActionRequest(request.body)
-    g = game.perform_action(req.game_id, req.player_id, req.kind, req.params)
-    return JsonResponse(game.encode_game(g, req.player_id))
+    ratelimit.consume('perform_action', req.player_id, req.game_id)
+    g = game.perform_action(req.game_id, req.player_id, req.kind, req.params, req.seat)
+    return JsonResponse(Game.encode_game(g, req.player_id, req.seat))
+
+
+@error_handler
+@admission
+def list_games(request):
+    # type: (HttpRequest) -> JsonResponse
+
+    from . import lobby
+
+    req = ListGamesRequest(request.body)
+    games, cursor = lobby.open_games(req.cursor, req.limit)
+    return JsonResponse({
+        'games': [
+            {'key': g.key, 'players': [s['name'] for s in g.seats], 'open_seats': g.open_seats, 'created': g.created}
+            for g in games
+        ],
+        'next': cursor,
+    })
+
+
+@error_handler
+@admission
+def player_stats(request):
+    # type: (HttpRequest) -> JsonResponse
+
+    req = PlayerStatsRequest(request.body)
+    s = stats.get(req.player_id)
+    return JsonResponse({
+        'games_played': s.games_played,
+        'wins': s.wins,
+        'cards_played': s.cards_played,
+        'poison_calls': s.poison_calls,
+    })
+
+
+@error_handler
+@admission
+def enqueue(request):
+    # type: (HttpRequest) -> JsonResponse
+
+    from . import matchmaking
+
+    req = EnqueueRequest(request.body)
+    ticket = matchmaking.enqueue(req.player_id)
+    return JsonResponse({'ticket': ticket.pk})
+
+
+@error_handler
+@admission
+def match_status(request):
+    # type: (HttpRequest) -> JsonResponse
+
+    from . import matchmaking
+
+    req = MatchStatusRequest(request.body)
+    ratelimit.consume('match_status', req.player_id, '')
+    ticket = matchmaking.status(req.player_id)
+    if ticket.game_id is None:
+        return JsonResponse({'ticket': ticket.pk, 'matched': False})
+
+    return JsonResponse({
+        'ticket': ticket.pk,
+        'matched': True,
+        'game_id': ticket.game_id,
+        'player_index': ticket.seat,
+        'token': tokens.issue(req.player_id, ticket.game_id, ticket.seat),
+    })
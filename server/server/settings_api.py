@@ -0,0 +1,21 @@
+# API-only profile for game server workers: the production profile (the dev one with
+# POISON_API_PROFILE=dev) trimmed to the poison app, the middleware its JSON views use and the API
+# urls, so a worker does not load admin, auth, sessions, messages or staticfiles. Select it with
+# DJANGO_SETTINGS_MODULE=server.settings_api
+import os
+
+from .settings_common import *
+
+if os.environ.get('POISON_API_PROFILE') == 'dev':
+    from .settings_dev import *
+else:
+    from .settings_prod import *
+
+INSTALLED_APPS = [
+    'poison.apps.PoisonConfig',
+]
+
+# The profile's middleware without the session, auth and message layers those apps provide
+MIDDLEWARE = [m for m in MIDDLEWARE if not m.startswith('django.contrib.')]
+
+ROOT_URLCONF = 'server.urls_api'
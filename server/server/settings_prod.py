@@ -16,3 +16,5 @@ DATABASES = {
 }
 
 MIDDLEWARE.append('django.middleware.csrf.CsrfViewMiddleware')
+
+POISON_REQUIRE_TOKENS = True
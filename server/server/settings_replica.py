@@ -0,0 +1,14 @@
+# Dev profile with a stand-in read replica: a second SQLite file that `manage.py sync_replica` keeps
+# copying from db.sqlite3. Game polls read from it and fall back to the primary when it is behind.
+# Select it with DJANGO_SETTINGS_MODULE=server.settings_replica
+from .settings import *
+
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': BASE_DIR / 'db-replica.sqlite3',
+    'TEST': {'MIRROR': 'default'},
+}
+
+DATABASE_ROUTERS = ['poison.replicas.ReplicaRouter']
+
+POISON_REPLICA = 'replica'
@@ -16,10 +16,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from poison.views import client_asset
 from .views import index
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', index, name='index'),
+    path('client/<path:path>', client_asset, name='client_asset'),
     path('poison', include('poison.urls'))
 ]
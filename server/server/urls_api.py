@@ -0,0 +1,6 @@
+"""URLs for the API-only profile, the poison API without the admin"""
+from django.urls import path, include
+
+urlpatterns = [
+    path('poison', include('poison.urls'))
+]